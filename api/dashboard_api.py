@@ -1,9 +1,11 @@
 import json
 from collections import OrderedDict
-from datetime import datetime, timedelta
-from typing import Any, List
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Tuple
 
 import pytz
+from django.db.models import Max, Min, Sum
+from django.db.models.functions import TruncDate
 from django.shortcuts import render
 from django.utils.timezone import make_aware
 
@@ -12,7 +14,7 @@ from constants.dashboard_constants import COMPLETE_DATA_STREAM_DICT, PROCESSED_D
 from constants.data_stream_constants import ALL_DATA_STREAMS
 from constants.datetime_constants import API_DATE_FORMAT
 from database.dashboard_models import DashboardColorSetting, DashboardGradient, DashboardInflection
-from database.data_access_models import ChunkRegistry, PipelineRegistry
+from database.data_access_models import ChunkRegistry, DataExtent, PipelineRegistry
 from database.study_models import Study
 from database.user_models import Participant
 from libs.internal_types import ResearcherRequest
@@ -110,21 +112,15 @@ def get_data_for_dashboard_datastream_display(
     if data_stream in ALL_DATA_STREAMS:
         first_day, last_day = dashboard_chunkregistry_date_query(study_id, data_stream)
         if first_day is not None:
-            stream_data = OrderedDict(
-                (
-                    participant.patient_id,
-                    dashboard_chunkregistry_query(participant.id, data_stream=data_stream)
-                )
-                for participant in participant_objects
-            )
-            unique_dates, _, _ = get_unique_dates(start, end, first_day, last_day)
+            unique_dates = get_unique_dates(start, end, first_day, last_day)
             next_url, past_url = create_next_past_urls(first_day, last_day, start=start, end=end)
 
             # get the byte streams per date for each patient for a specific data stream for those dates
+            daily_bytes = dashboard_chunkregistry_daily_bytes_query(study_id, data_stream, unique_dates)
             byte_streams = OrderedDict(
                 (
                     participant.patient_id,
-                    [get_bytes_participant_match(stream_data[participant.patient_id], date) for date in unique_dates]
+                    [daily_bytes.get((participant.id, date)) for date in unique_dates]
                 )
                 for participant in participant_objects
             )
@@ -134,7 +130,7 @@ def get_data_for_dashboard_datastream_display(
         start, end = extract_date_args_from_request(request)
         first_day, last_day, stream_data = parse_processed_data(study_id, participant_objects, data_stream)
         if first_day is not None:
-            unique_dates, _, _ = get_unique_dates(start, end, first_day, last_day)
+            unique_dates = get_unique_dates(start, end, first_day, last_day)
             next_url, past_url = create_next_past_urls(first_day, last_day, start=start, end=end)
 
             # get the byte streams per date for each patient for a specific data stream for those dates
@@ -185,7 +181,6 @@ def dashboard_participant_page(request: ResearcherRequest, study_id, patient_id)
     study = Study.get_or_404(pk=study_id)
     participant = get_participant(patient_id, study_id)
     start, end = extract_date_args_from_request(request)
-    chunks = dashboard_chunkregistry_query(participant.id)
     patient_ids = list(
         Participant.objects.filter(study=study_id)
         .exclude(patient_id=patient_id)
@@ -193,31 +188,32 @@ def dashboard_participant_page(request: ResearcherRequest, study_id, patient_id)
     )
 
     # ----------------- dates for bytes data streams -----------------------
-    if chunks:
-        first_day, last_day = dashboard_chunkregistry_date_query(study_id)
-        _, first_date_data_entry, last_date_data_entry = \
-            get_unique_dates(start, end, first_day, last_day, chunks)
+    first_day, _ = dashboard_chunkregistry_date_query(study_id)
+    if first_day is not None:
+        first_date_data_entry, last_date_data_entry = \
+            dashboard_chunkregistry_participant_date_query(participant.id, first_day)
     else:
         last_date_data_entry = first_date_data_entry = None
+    has_chunks = first_date_data_entry is not None
     # --------------- dates for  processed data streams -------------------
     # all_data is a list of dicts [{"time_bin": , "stream": , "processed_data": }...]
     processed_first_date_data_entry, processed_last_date_data_entry, all_data = parse_patient_processed_data(study_id, participant)
 
     # ------- decide the first date of data entry from processed AND bytes data as well as put the data together ------
     # but only if there are both processed and bytes data
-    if chunks and all_data:
+    if has_chunks and all_data:
         if (processed_first_date_data_entry - first_date_data_entry).days < 0:
             first_date_data_entry = processed_first_date_data_entry
         if (processed_last_date_data_entry - last_date_data_entry).days < 0:
             last_date_data_entry = processed_last_date_data_entry
-    if all_data and not chunks:
+    if all_data and not has_chunks:
         first_date_data_entry = processed_first_date_data_entry
         last_date_data_entry = processed_last_date_data_entry
 
     # ---------------------- get next/past urls and unique dates, as long as data has been entered -------------------
-    if chunks or all_data:
+    if has_chunks or all_data:
         next_url, past_url = create_next_past_urls(first_date_data_entry, last_date_data_entry, start=start, end=end)
-        unique_dates, _, _ = get_unique_dates(start, end, first_date_data_entry, last_date_data_entry)
+        unique_dates = get_unique_dates(start, end, first_date_data_entry, last_date_data_entry)
     else:
         next_url = past_url = unique_dates = None
 
@@ -233,25 +229,26 @@ def dashboard_participant_page(request: ResearcherRequest, study_id, patient_id)
         processed_byte_streams = None
 
 
-    if chunks:
+    if has_chunks:
+        daily_bytes = dashboard_chunkregistry_stream_daily_bytes_query(participant.id, unique_dates)
         byte_streams = OrderedDict(
             (stream, [
-                get_bytes_data_stream_match(chunks, date, stream) for date in unique_dates
+                daily_bytes.get((stream, date)) for date in unique_dates
             ]) for stream in ALL_DATA_STREAMS
         )
     else:
         byte_streams = None
 
-    if chunks and all_data:
+    if has_chunks and all_data:
         byte_streams.update(processed_byte_streams)
-    elif all_data and not chunks:
+    elif all_data and not has_chunks:
         byte_streams = OrderedDict(
             (stream, [
                 None for date in unique_dates
             ]) for stream in ALL_DATA_STREAMS
         )
         byte_streams.update(processed_byte_streams)
-    elif chunks and not all_data:
+    elif has_chunks and not all_data:
         processed_byte_streams = OrderedDict(
             (stream, [None for date in unique_dates]) for stream in PROCESSED_DATA_STREAM_DICT
         )
@@ -429,20 +426,8 @@ def set_default_settings_post_request(request: ResearcherRequest, study: Study,
     return color_low_range, color_high_range, all_flags_list
 
 
-def get_unique_dates(start, end, first_day, last_day, chunks=None):
+def get_unique_dates(start, end, first_day, last_day):
     """ create a list of all the unique days in which data was recorded for this study """
-    first_date_data_entry = None
-    last_date_data_entry = None
-    if chunks:
-        all_dates = sorted(
-            chunk["time_bin"].date() for chunk in chunks if chunk["time_bin"].date() >= first_day
-            # must be >= first day bc there are some point for 1970 that get filtered out bc obv are garbage
-        )
-
-        # create a list of all of the valid days in this study
-        first_date_data_entry = all_dates[0]
-        last_date_data_entry = all_dates[-1]
-
     # validate start date is before end date
     if (start and end) and (end.date() - start.date()).days < 0:
         temp = start
@@ -471,7 +456,7 @@ def get_unique_dates(start, end, first_day, last_day, chunks=None):
         end_num = (end.date() - start.date()).days + 1
         unique_dates = [(start.date() + timedelta(days=date)) for date in range(end_num)]
 
-    return unique_dates, first_date_data_entry, last_date_data_entry
+    return unique_dates
 
 
 def create_next_past_urls(first_day, last_day, start=None, end=None):
@@ -508,35 +493,6 @@ def create_next_past_urls(first_day, last_day, start=None, end=None):
     return next_url, past_url
 
 
-def get_bytes_data_stream_match(chunks, date, stream):
-    """ returns byte value for correct chunk based on data stream and type comparisons"""
-    all_bytes = None
-    for chunk in chunks:
-        if (chunk["time_bin"]).date() == date and chunk["data_stream"] == stream:
-            if all_bytes is None:
-                all_bytes = chunk.get("bytes", 0) or 0
-            else:
-                all_bytes += chunk.get("bytes", 0) or 0
-    if all_bytes is not None:
-        return all_bytes
-    else:
-        return None
-
-
-def get_bytes_participant_match(stream_data, date):
-    all_bytes = None
-    for data_point in stream_data:
-        if (data_point["time_bin"]).date() == date:
-            if all_bytes is None:
-                all_bytes = data_point.get("bytes", 0) or 0
-            else:
-                all_bytes += data_point.get("bytes", 0) or 0
-    if all_bytes is not None:
-        return all_bytes
-    else:
-        return None
-
-
 def get_bytes_processed_data_match(participant_data, date):
     # participant_data is a list of dicts which hold {time_bin: , processed_data: }
     # there should only ever be one data_point corresponding to a specific date per patient
@@ -568,45 +524,82 @@ def dashboard_chunkregistry_date_query(study_id, data_stream=None):
     kwargs = {"study_id": study_id}
     if data_stream:
         kwargs["data_type"] = data_stream
-    
-    # this as queries with .first() and .last() is slow even as size of all_time_bins grows.
-    all_time_bins: List[datetime] = list(
-        ChunkRegistry.objects.filter(**kwargs).exclude(time_bin__lt=unix_epoch_start_sorta)
-        .order_by("time_bin").values_list("time_bin", flat=True)
-    )
-    
+
+    first, last = DataExtent.get_extent(**kwargs)
+    if first is not None and first < unix_epoch_start_sorta:
+        # the extents include 1/1/1970, exclude it with an (indexed) aggregate over the chunks.
+        extent = ChunkRegistry.objects.filter(**kwargs, time_bin__gte=unix_epoch_start_sorta) \
+            .aggregate(first=Min("time_bin"), last=Max("time_bin"))
+        first, last = extent["first"], extent["last"]
+
     # default behavior for 1 or 0 time_bins
-    if len(all_time_bins) < 2:
+    if first is None:
         return None, None
-    
-    return all_time_bins[0].date(), all_time_bins[-1].date()
-
-
-def dashboard_chunkregistry_query(participant_id, data_stream=None, start=None, end=None):
-    """ Queries ChunkRegistry based on the provided parameters and returns a list of dictionaries
-    with 3 keys: bytes, data_stream, and time_bin. """
-    kwargs = {"participant__id": participant_id}
-    if start:
-        kwargs["time_bin__gte"] = start
-    if end:
-        kwargs["time_bin__lte"] = end
-    if data_stream:
-        kwargs["data_type"] = data_stream
+    if first == last and ChunkRegistry.objects.filter(**kwargs, time_bin=first)[:2].count() < 2:
+        return None, None
+
+    return first.date(), last.date()
+
+
+def dashboard_chunkregistry_participant_date_query(participant_id, first_day: date):
+    """ gets the first and last days of a participant's data, ignoring days before first_day (the first
+    day of the study, see dashboard_chunkregistry_date_query).  Returns None, None if there is none. """
+    first, last = DataExtent.get_extent(participant_id=participant_id)
+    if first is not None and first < start_of_day(first_day):
+        extent = ChunkRegistry.objects.filter(
+            participant_id=participant_id, time_bin__gte=start_of_day(first_day)
+        ).aggregate(first=Min("time_bin"), last=Max("time_bin"))
+        first, last = extent["first"], extent["last"]
+
+    if first is None:
+        return None, None
+
+    return first.date(), last.date()
 
-    # on a (good) test device running on sqlite, for 12,200 chunks, this takes ~135ms
-    # sticking the query_set directly into a list is a slight speedup. (We need it all in memory anyway.)
-    chunks = list(
-        ChunkRegistry.objects.filter(**kwargs)
-        .extra(
-            select={
-                # rename the data_type and file_size fields in the db query itself for speed
-                'data_stream': 'data_type',
-                'bytes': 'file_size',
-            }
-        ).values("bytes", "data_stream", "time_bin")
+
+def dashboard_chunkregistry_daily_bytes_query(
+    study_id, data_stream, dates: List[date]
+) -> Dict[Tuple[int, date], int]:
+    """ Sums the bytes of a data stream per participant per day over the given dates in a single
+    query, returns a dict keyed by (participant id, date). """
+    return chunkregistry_daily_bytes(
+        dates, "participant_id", study_id=study_id, data_type=data_stream
     )
 
-    return chunks
+
+def dashboard_chunkregistry_stream_daily_bytes_query(
+    participant_id, dates: List[date]
+) -> Dict[Tuple[str, date], int]:
+    """ Sums the bytes of a participant's data per data stream per day over the given dates in a
+    single query, returns a dict keyed by (data stream, date). """
+    return chunkregistry_daily_bytes(dates, "data_type", participant_id=participant_id)
+
+
+def chunkregistry_daily_bytes(dates: List[date], group_by: str, **filters) -> Dict[Tuple[Any, date], int]:
+    """ Sums ChunkRegistry file sizes per (group_by, day) over the given dates with a GROUP BY, days
+    without data are absent.  Days are UTC days, the same as the dates of time_bin.date() elsewhere on
+    the dashboard. """
+    if not dates:
+        return {}
+
+    daily_bytes = (
+        ChunkRegistry.objects.filter(
+            time_bin__gte=start_of_day(min(dates)),
+            time_bin__lt=start_of_day(max(dates) + timedelta(days=1)),
+            **filters,
+        )
+        .annotate(day=TruncDate("time_bin"))
+        .order_by()  # an ordering would be added to the GROUP BY
+        .values(group_by, "day")
+        .annotate(bytes=Sum("file_size"))
+        .values_list(group_by, "day", "bytes")
+    )
+    # a chunk without a file size counts as 0 bytes, the day still has data.
+    return {(key, day): total or 0 for key, day, total in daily_bytes}
+
+
+def start_of_day(day: date) -> datetime:
+    return make_aware(datetime.combine(day, datetime.min.time()), pytz.utc)
 
 
 def dashboard_pipelineregistry_query(study_id, participant_id):
@@ -1,20 +1,23 @@
 import json
 from datetime import datetime
+from typing import Tuple
 
 from dateutil import tz
 from django.db.models import QuerySet
-from django.http.response import FileResponse
+from django.http.response import FileResponse, HttpResponse
 from django.utils.timezone import make_aware
 from django.views.decorators.http import require_http_methods
 
 from authentication.data_access_authentication import api_study_credential_check
-from constants.data_access_api_constants import CHUNK_FIELDS
+from constants.data_access_api_constants import CHUNK_FIELDS, MANIFEST_PAGE_SIZE
 from constants.data_stream_constants import ALL_DATA_STREAMS
 from constants.datetime_constants import API_TIME_FORMAT
 from database.data_access_models import ChunkRegistry
 from database.user_models import Participant
+from libs.export_cache import EXPORT_CACHE
 from libs.internal_types import ApiStudyResearcherRequest
-from libs.streaming_zip import zip_generator
+from libs.s3 import s3_retrieve
+from libs.streaming_zip import determine_file_name, zip_generator
 from middleware.abort_middleware import abort
 
 
@@ -35,19 +38,36 @@ def get_data(request: ApiStudyResearcherRequest):
     cases handled:
         missing creds or study, invalid researcher or study, researcher does not have access
         researcher creds are invalid
-    Returns a zip file of all data files found by the query. """
+    optional: after, until = chunk pks, restricts the download to a range of a manifest (see
+        get_data_manifest), files are then added to the zip in manifest order.
+    Returns a zip file of all data files found by the query.  Downloads without a registry or a
+    manifest range go through the export cache, if it is enabled. """
     
     query_args = {}
     determine_data_streams_for_db_query(request, query_args)
     determine_users_for_db_query(request, query_args)
     determine_time_range_for_db_query(request, query_args)
+    after, until = determine_manifest_range(request)
+    registry_dict = parse_registry(request)
+    construct_registry = 'web_form' not in request.POST
     
     # Do query! (this is actually a generator, it can only be iterated over once)
     get_these_files = handle_database_query(
-        request.api_study.pk, query_args, registry_dict=parse_registry(request)
+        request.api_study.pk, query_args, registry_dict=registry_dict
     )
+    is_manifest_range = after is not None or until is not None
+    if is_manifest_range:
+        get_these_files = filter_manifest_range(get_these_files, after, until)
+        zip_stream = zip_generator(get_these_files, construct_registry=construct_registry, ordered=True)
+    elif EXPORT_CACHE.enabled and not registry_dict:
+        zip_stream = EXPORT_CACHE.stream(
+            request.api_study.pk, query_args, get_these_files, construct_registry
+        )
+    else:
+        zip_stream = zip_generator(get_these_files, construct_registry=construct_registry)
+    
     streaming_response = FileResponse(
-        zip_generator(get_these_files, construct_registry='web_form' not in request.POST),
+        zip_stream,
         content_type="application/zip",
         as_attachment='web_form' in request.POST,
         filename="data.zip",
@@ -57,6 +77,78 @@ def get_data(request: ApiStudyResearcherRequest):
     streaming_response.set_headers(None)
     return streaming_response
 
+
+@require_http_methods(['POST', "GET"])
+@api_study_credential_check(block_test_studies=True)
+def get_data_manifest(request: ApiStudyResearcherRequest):
+    """ Takes the same parameters as get_data, and optionally:
+        page_size = the number of chunks in a page, at most (and by default) MANIFEST_PAGE_SIZE
+        after = the "next" value of the previous page.
+    Returns a page of the manifest of the files that get_data would download, as json:
+        {"chunks": [{"pk", "chunk_path", "chunk_hash", "file_size", "file_name", "data_type",
+                     "patient_id", "time_bin"}, ...],
+         "next": the pk of the last chunk, null on the last page}
+    The manifest is ordered by pk, pages are stable as new data arrives (new chunks are added at
+    the end, updated chunks keep their place and get a new chunk_hash).  A page can be downloaded
+    as a zip file by passing its after and its next as the after and until of get_data, and single
+    files can be downloaded with get_data_file. """
+    query_args = {}
+    determine_data_streams_for_db_query(request, query_args)
+    determine_users_for_db_query(request, query_args)
+    determine_time_range_for_db_query(request, query_args)
+    after, _ = determine_manifest_range(request)
+    page_size = determine_manifest_page_size(request)
+    
+    chunks = handle_database_query(
+        request.api_study.pk, query_args, registry_dict=parse_registry(request),
+        fields=CHUNK_FIELDS + ("file_size",),
+    )
+    chunks = list(filter_manifest_range(chunks, after, None)[:page_size])
+    
+    manifest = [
+        {
+            "pk": chunk["pk"],
+            "chunk_path": chunk["chunk_path"],
+            "chunk_hash": chunk["chunk_hash"],
+            "file_size": chunk["file_size"],
+            "file_name": determine_file_name(chunk),
+            "data_type": chunk["data_type"],
+            "patient_id": chunk["participant__patient_id"],
+            "time_bin": chunk["time_bin"].strftime(API_TIME_FORMAT),
+        }
+        for chunk in chunks
+    ]
+    next_page = chunks[-1]["pk"] if len(chunks) == page_size else None
+    return HttpResponse(
+        json.dumps({"chunks": manifest, "next": next_page}), content_type="application/json"
+    )
+
+
+@require_http_methods(['POST', "GET"])
+@api_study_credential_check(block_test_studies=True)
+def get_data_file(request: ApiStudyResearcherRequest):
+    """ Required: access key, access secret, study_id, chunk_path (from get_data_manifest)
+    Returns the decrypted contents of a single file, its chunk_hash is in the manifest. """
+    chunk_path = request.POST.get("chunk_path", None)
+    if not chunk_path:
+        log("no chunk_path")
+        return abort(400)
+    
+    chunk = ChunkRegistry.objects.filter(
+        study_id=request.api_study.pk, chunk_path=chunk_path
+    ).values(*CHUNK_FIELDS).first()
+    if chunk is None:
+        log("no such chunk")
+        return abort(404)
+    
+    response = HttpResponse(
+        s3_retrieve(chunk_path, request.api_study.object_id, raw_path=True),
+        content_type="application/octet-stream",
+    )
+    response["Content-Disposition"] = \
+        f'attachment; filename="{determine_file_name(chunk).rsplit("/", 1)[-1]}"'
+    return response
+
 # @require_http_methods(["GET", "POST"])
 # @api_study_credential_check()
 # def pipeline_data_download(request: ApiStudyResearcherRequest):
@@ -162,12 +254,56 @@ def determine_time_range_for_db_query(request: ApiStudyResearcherRequest, query:
         query['end'] = str_to_datetime(request.POST['time_end'])
 
 
-def handle_database_query(study_id: int, query_dict: dict, registry_dict: dict = None) -> QuerySet:
+def determine_manifest_range(request: ApiStudyResearcherRequest) -> Tuple[int, int]:
+    """ Determines, from the html request, the range of chunk pks of a manifest (see
+    get_data_manifest) that should be downloaded.  Throws a 400 if they are not integers. """
+    after = request.POST.get("after", None)
+    until = request.POST.get("until", None)
+    try:
+        return (
+            int(after) if after not in (None, "") else None,
+            int(until) if until not in (None, "") else None,
+        )
+    except ValueError:
+        log("bad manifest range")
+        return abort(400)
+
+
+def determine_manifest_page_size(request: ApiStudyResearcherRequest) -> int:
+    """ Determines, from the html request, the size of a page of a manifest, throws a 400 if it is
+    not a positive integer.  At most MANIFEST_PAGE_SIZE. """
+    page_size = request.POST.get("page_size", None)
+    if page_size in (None, ""):
+        return MANIFEST_PAGE_SIZE
+    try:
+        page_size = int(page_size)
+    except ValueError:
+        log("bad page size")
+        return abort(400)
+    if page_size < 1:
+        log("bad page size")
+        return abort(400)
+    return min(page_size, MANIFEST_PAGE_SIZE)
+
+
+def filter_manifest_range(chunks: QuerySet, after: int = None, until: int = None) -> QuerySet:
+    """ Restricts a query to the chunks after (exclusive) and until (inclusive) two pks, in
+    manifest order. """
+    if after is not None:
+        chunks = chunks.filter(pk__gt=after)
+    if until is not None:
+        chunks = chunks.filter(pk__lte=until)
+    return chunks.order_by("pk")
+
+
+def handle_database_query(
+    study_id: int, query_dict: dict, registry_dict: dict = None, fields: Tuple[str] = CHUNK_FIELDS
+) -> QuerySet:
     """ Runs the database query and returns a QuerySet. """
     chunks = ChunkRegistry.get_chunks_time_range(study_id, **query_dict)
     
     if not registry_dict:
-        return chunks.values(*CHUNK_FIELDS)
+        return chunks.values(*fields)
     
     # If there is a registry, we need to filter on the chunks
     else:
@@ -184,4 +320,4 @@ def handle_database_query(study_id: int, query_dict: dict, registry_dict: dict =
         ]
         
         # add the exclude and return the queryset
-        return chunks.exclude(pk__in=registered_chunk_pks).values(*CHUNK_FIELDS)
+        return chunks.exclude(pk__in=registered_chunk_pks).values(*fields)
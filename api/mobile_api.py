@@ -3,11 +3,9 @@ import json
 import plistlib
 import time
 
-from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.http.response import HttpResponse
-from django.utils import timezone
 
 from authentication.participant_authentication import (authenticate_participant,
     authenticate_participant_registration, minimal_validation)
@@ -15,17 +13,19 @@ from config.settings import REPORT_DECRYPTION_KEY_ERRORS
 from constants.celery_constants import ANDROID_FIREBASE_CREDENTIALS, IOS_FIREBASE_CREDENTIALS
 from constants.message_strings import (DECRYPTION_KEY_ADDITIONAL_MESSAGE,
     DECRYPTION_KEY_ERROR_MESSAGE, DEVICE_IDENTIFIERS_HEADER, INVALID_EXTENSION_ERROR, NO_FILE_ERROR,
-    S3_FILE_PATH_UNIQUE_CONSTRAINT_ERROR, UNKNOWN_ERROR)
+    UNKNOWN_ERROR)
 from database.data_access_models import FileToProcess
-from database.profiling_models import DecryptionKeyError, UploadTracking
+from database.profiling_models import DecryptionKeyError
 from database.system_models import FileAsText
 from database.user_models import Participant
-from libs.encryption import decrypt_device_file, DecryptionKeyInvalidError, HandledError
+from libs.encryption import (decrypt_device_file, DecryptionKeyInvalidError, HandledError,
+    validate_device_file_key)
 from libs.http_utils import determine_os_api
 from libs.internal_types import ParticipantRequest
 from libs.push_notification_helpers import repopulate_all_survey_scheduled_events
 from libs.s3 import get_client_public_key_string, s3_upload
 from libs.sentry import make_sentry_client, SentryTypes
+from libs.upload_spool import UPLOAD_SPOOL
 from middleware.abort_middleware import abort
 
 
@@ -98,6 +98,11 @@ def upload(request: ParticipantRequest, OS_API=""):
     
     uploaded_file = get_uploaded_file(request)
     try:
+        if UPLOAD_SPOOL.has_capacity():
+            # the rest of the upload is handled in the background, see libs/upload_spool.py
+            validate_device_file_key(file_name, uploaded_file, participant)
+            UPLOAD_SPOOL.spool(participant, file_name, uploaded_file)
+            return HttpResponse(status=200)
         uploaded_file = decrypt_device_file(file_name, uploaded_file, participant)
     except HandledError:
         return HttpResponse(status=200)
@@ -127,28 +132,15 @@ def upload(request: ParticipantRequest, OS_API=""):
     if uploaded_file and file_name and contains_valid_extension(file_name):
         s3_upload(s3_file_location, uploaded_file, participant.study.object_id)
         
-        # race condition: multiple _concurrent_ uploads with same file path. Behavior without
-        # try-except is correct, but we don't care about reporting it. Just send the device a 500
-        # error so it skips the file, the followup attempt receives 200 code and deletes the file.
-        try:
-            FileToProcess.append_file_for_processing(
-                s3_file_location, participant.study.object_id, participant=participant
-            )
-        except ValidationError as e:
-            # Real error is a second validation inside e.error_dict["s3_file_path"].
-            # Ew; just test for this string instead...
-            if S3_FILE_PATH_UNIQUE_CONSTRAINT_ERROR in str(e):
-                # this tells the device to just move on to the next file, try again later.
-                return abort(500)
-            else:
-                raise
-        
-        UploadTracking.objects.create(
-            file_path=s3_file_location,
-            file_size=len(uploaded_file),
-            timestamp=timezone.now(),
-            participant=participant,
+        # race condition: multiple _concurrent_ uploads with same file path. The file is only
+        # registered once, we don't care about reporting it. Just send the device a 500 error so it
+        # skips the file, the followup attempt receives 200 code and deletes the file.
+        new_paths = FileToProcess.register_uploads(
+            [(s3_file_location, participant, len(uploaded_file))]
         )
+        if s3_file_location not in new_paths:
+            # this tells the device to just move on to the next file, try again later.
+            return abort(500)
         return HttpResponse(status=200)
     
     elif not uploaded_file:
@@ -72,6 +72,20 @@ for mandatory_var in MANDATORY_VARS:
 # Environment variable type can be unpredictable, sanitize the numerical ones.
 settings.CONCURRENT_NETWORK_OPS = int(settings.CONCURRENT_NETWORK_OPS)
 settings.FILE_PROCESS_PAGE_SIZE = int(settings.FILE_PROCESS_PAGE_SIZE)
+settings.FILE_PROCESS_MEMORY_BUDGET_MB = int(settings.FILE_PROCESS_MEMORY_BUDGET_MB)
+settings.FILE_PROCESS_DOWNLOAD_CONCURRENCY = int(settings.FILE_PROCESS_DOWNLOAD_CONCURRENCY)
+settings.FILE_PROCESS_MERGE_CONCURRENCY = int(settings.FILE_PROCESS_MERGE_CONCURRENCY)
+settings.FILE_PROCESS_UPLOAD_CONCURRENCY = int(settings.FILE_PROCESS_UPLOAD_CONCURRENCY)
+settings.ZIP_DOWNLOAD_CONCURRENCY = int(settings.ZIP_DOWNLOAD_CONCURRENCY)
+settings.ZIP_DOWNLOAD_MAX_CONCURRENCY = int(settings.ZIP_DOWNLOAD_MAX_CONCURRENCY)
+settings.ZIP_DOWNLOAD_READ_AHEAD_MB = int(settings.ZIP_DOWNLOAD_READ_AHEAD_MB)
+settings.EXPORT_CACHE_MAX_MB = int(settings.EXPORT_CACHE_MAX_MB)
+settings.FOREST_CHUNK_CACHE_MAX_MB = int(settings.FOREST_CHUNK_CACHE_MAX_MB)
+settings.PRIVATE_KEY_CACHE_SIZE = int(settings.PRIVATE_KEY_CACHE_SIZE)
+settings.PRIVATE_KEY_CACHE_SECONDS = int(settings.PRIVATE_KEY_CACHE_SECONDS)
+settings.UPLOAD_SPOOL_WORKERS = int(settings.UPLOAD_SPOOL_WORKERS)
+settings.UPLOAD_SPOOL_MAX_PENDING = int(settings.UPLOAD_SPOOL_MAX_PENDING)
+settings.PUSH_NOTIFICATION_BATCH_SIZE = min(int(settings.PUSH_NOTIFICATION_BATCH_SIZE), 500)
 
 # email addresses are parsed from a comma separated list, strip whitespace.
 if settings.SYSADMIN_EMAILS:
@@ -66,6 +66,79 @@ CONCURRENT_NETWORK_OPS = getenv("CONCURRENT_NETWORK_OPS") or cpu_count() * 2
 #   Expects an integer number.
 FILE_PROCESS_PAGE_SIZE = getenv("FILE_PROCESS_PAGE_SIZE", 100)
 
+# This is the approximate amount of memory, in megabytes, that data processing may use to hold
+# parsed rows of data for a single page of files.  When this value is exceeded the largest hourly
+# bins of data are spilled to a temporary file on disk, and are read back in one at a time when
+# they are uploaded.  This caps memory usage on high-rate data streams (e.g. accelerometer, gyro)
+# independently of FILE_PROCESS_PAGE_SIZE.  A value of 0 disables spilling to disk.
+#   Expects an integer number.
+FILE_PROCESS_MEMORY_BUDGET_MB = getenv("FILE_PROCESS_MEMORY_BUDGET_MB", 0)
+
+# File processing is a pipeline: files are downloaded from S3, parsed into hourly bins, merged into
+# any existing chunks of data (which are downloaded from S3), and the chunks are uploaded to S3.
+# These set the number of threads used by the download, merge, and upload stages.  Each stage holds
+# at most twice its number of threads worth of items, so these also bound the memory used between
+# stages.  By default each stage uses CONCURRENT_NETWORK_OPS threads.
+#   Expects an integer number.
+FILE_PROCESS_DOWNLOAD_CONCURRENCY = getenv("FILE_PROCESS_DOWNLOAD_CONCURRENCY") or CONCURRENT_NETWORK_OPS
+FILE_PROCESS_MERGE_CONCURRENCY = getenv("FILE_PROCESS_MERGE_CONCURRENCY") or CONCURRENT_NETWORK_OPS
+FILE_PROCESS_UPLOAD_CONCURRENCY = getenv("FILE_PROCESS_UPLOAD_CONCURRENCY") or CONCURRENT_NETWORK_OPS
+
+#
+# Data download options
+
+# Data downloads (the data access api, Forest task data) retrieve files from S3 on a pool of threads.
+# A download starts with ZIP_DOWNLOAD_CONCURRENCY threads and, based on the throughput it observes,
+# adjusts the number of threads between 1 and ZIP_DOWNLOAD_MAX_CONCURRENCY.  Set the two to the same
+# value for a fixed number of threads.  At most ZIP_DOWNLOAD_READ_AHEAD_MB megabytes of downloaded
+# files wait to be sent to the client, this caps the memory used by a download to a slow client.
+#   Expects integer numbers.
+ZIP_DOWNLOAD_CONCURRENCY = getenv("ZIP_DOWNLOAD_CONCURRENCY", 3)
+ZIP_DOWNLOAD_MAX_CONCURRENCY = getenv("ZIP_DOWNLOAD_MAX_CONCURRENCY", 16)
+ZIP_DOWNLOAD_READ_AHEAD_MB = getenv("ZIP_DOWNLOAD_READ_AHEAD_MB", 64)
+
+# When a directory is provided the zip files built by the data access api are kept in it, and a
+# repeated download of the same query is served from disk while the data it covers is unchanged.
+# When the data has changed only new and changed files are retrieved from S3.  Files in this
+# directory are decrypted study data, it must be protected accordingly.  The least recently used
+# downloads are deleted when the directory holds more than EXPORT_CACHE_MAX_MB megabytes.  An empty
+# value (the default) disables the export cache.
+#   Expects a directory path, and an integer number.
+EXPORT_CACHE_DIRECTORY = getenv("EXPORT_CACHE_DIRECTORY", "")
+EXPORT_CACHE_MAX_MB = getenv("EXPORT_CACHE_MAX_MB", 10240)
+
+# When a directory is provided Forest servers keep the files they download for Forest tasks in it,
+# and tasks over the same data (jasmine and willow for a participant, overlapping date ranges) reuse
+# them instead of retrieving them from S3 again.  The directory should be on the same filesystem as
+# /tmp/forest so that files are hard linked into task folders rather than copied.  Files in this
+# directory are decrypted study data.  The least recently used files are deleted when the directory
+# holds more than FOREST_CHUNK_CACHE_MAX_MB megabytes.  An empty value (the default) disables it.
+#   Expects a directory path, and an integer number.
+FOREST_CHUNK_CACHE_DIRECTORY = getenv("FOREST_CHUNK_CACHE_DIRECTORY", "")
+FOREST_CHUNK_CACHE_MAX_MB = getenv("FOREST_CHUNK_CACHE_MAX_MB", 20480)
+
+#
+# Upload options
+
+# Participant private keys are needed to decrypt every file uploaded by a device, and they are
+# stored encrypted on S3.  Frontend servers keep up to PRIVATE_KEY_CACHE_SIZE parsed keys in memory
+# for PRIVATE_KEY_CACHE_SECONDS, which removes an S3 request and an RSA key parse from most uploads.
+# A value of 0 for either setting disables the cache.
+#   Expects integer numbers.
+PRIVATE_KEY_CACHE_SIZE = getenv("PRIVATE_KEY_CACHE_SIZE", 1000)
+PRIVATE_KEY_CACHE_SECONDS = getenv("PRIVATE_KEY_CACHE_SECONDS", 600)
+
+# When a directory is provided the upload endpoint only validates an upload, writes it to this
+# directory, and responds.  Decryption, the upload to S3, and database entries are handled by
+# UPLOAD_SPOOL_WORKERS background threads per server process.  The directory must be on durable
+# local storage: a device deletes its copy of a file once it has been written here.  When a process
+# has more than UPLOAD_SPOOL_MAX_PENDING uploads waiting, further uploads are handled synchronously.
+# An empty value (the default) disables the upload spool.
+#   Expects a directory path, and integer numbers.
+UPLOAD_SPOOL_DIRECTORY = getenv("UPLOAD_SPOOL_DIRECTORY", "")
+UPLOAD_SPOOL_WORKERS = getenv("UPLOAD_SPOOL_WORKERS", 4)
+UPLOAD_SPOOL_MAX_PENDING = getenv("UPLOAD_SPOOL_MAX_PENDING", 200)
+
 #
 # Push Notification directives
 
@@ -80,6 +153,18 @@ PUSH_NOTIFICATION_ATTEMPT_COUNT = getenv("PUSH_NOTIFICATION_ATTEMPT_COUNT", 720)
 #   Expects (case-insensitive) "true" to block errors.
 BLOCK_QUOTA_EXCEEDED_ERROR = getenv('BLOCK_QUOTA_EXCEEDED_ERROR', 'false').lower() == 'true'
 
+# Sends push notifications in batches of up to this many notifications, each batch is one celery
+# task and one request to firebase.  Firebase allows at most 500 messages in a batch.  A value of 0
+# sends each notification in its own celery task.
+#   Expects an integer number.
+PUSH_NOTIFICATION_BATCH_SIZE = getenv("PUSH_NOTIFICATION_BATCH_SIZE", 0)
+
+# Set to true when the push notification scheduler (services/push_notification_scheduler.py) is
+# running.  It sends notifications within seconds of their scheduled time, and the five minute cron
+# task then stops queueing notifications.
+#   Expects (case-insensitive) "true" to enable.
+PUSH_NOTIFICATION_SCHEDULER_ENABLED = getenv("PUSH_NOTIFICATION_SCHEDULER_ENABLED", "false").lower() == "true"
+
 #
 # Developer options
 
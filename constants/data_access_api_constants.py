@@ -2,3 +2,6 @@ CHUNK_FIELDS = (
     "pk", "participant_id", "data_type", "chunk_path", "time_bin", "chunk_hash",
     "participant__patient_id", "study_id", "survey_id", "survey__object_id"
 )
+
+# the largest (and default) number of chunks in a page of a data download manifest.
+MANIFEST_PAGE_SIZE = 10000
@@ -1,7 +1,8 @@
 import json
 from random import choice as random_choice
+from typing import Dict, List, Sequence
 
-from django.db import models
+from django.db import connections, models, router
 from django.db.models.fields.related import RelatedField
 
 from constants.security_constants import OBJECT_ID_ALLOWED_CHARS
@@ -11,6 +12,13 @@ from middleware.abort_middleware import abort
 class ObjectIdError(Exception): pass
 
 
+# the sql functions of the bulk_upsert combine modes, sqlite's multi-argument min and max are scalar.
+UPSERT_COMBINE_FUNCTIONS = {
+    "postgresql": {"least": "LEAST", "greatest": "GREATEST"},
+    "sqlite": {"least": "MIN", "greatest": "MAX"},
+}
+
+
 def generate_objectid_string():
     return ''.join(random_choice(OBJECT_ID_ALLOWED_CHARS) for _ in range(24))
 
@@ -125,11 +133,104 @@ class UtilityModel(models.Model):
         
         return field_dict
     
-    def save(self, *args, **kwargs):
-        # Raise a ValidationError if any data is invalid
-        self.full_clean()
+    def save(self, *args, validate: bool = True, **kwargs):
+        # Raise a ValidationError if any data is invalid.  full_clean costs a query for every unique
+        # field and foreign key, internal hot paths that write known-good data pass validate=False
+        # and rely on the database constraints instead (which raise IntegrityError).
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
     
+    @classmethod
+    def bulk_upsert(
+        cls, objects: List["UtilityModel"], unique_fields: Sequence[str], update_fields: Sequence[str],
+        increment: bool = False, combine: Dict[str, str] = None,
+    ):
+        """ Inserts objects, rows that already exist (a conflict on unique_fields, which must be a
+        unique constraint) have only their update_fields (and auto_now fields) updated.  With
+        increment=True the update_fields of existing rows are incremented by the objects' values
+        (a NULL counts as 0), atomically.  combine maps update fields to "least" or "greatest", those
+        fields keep the lesser or greater of the existing and new values (neither may be NULL).
+        This is one INSERT ... ON CONFLICT DO UPDATE query per batch, PostgreSQL and SQLite support
+        it.  Like bulk_create the objects are not validated, primary keys are not set, and no
+        signals are sent. """
+        if not objects:
+            return
+        
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        fields = [field for field in cls._meta.concrete_fields if not field.primary_key]
+        table = quote(cls._meta.db_table)
+        combine = combine or {}
+        updates = []
+        for name in update_fields:
+            column = quote(cls._meta.get_field(name).column)
+            if name in combine:
+                function = UPSERT_COMBINE_FUNCTIONS[connection.vendor][combine[name]]
+                updates.append(f"{column} = {function}({table}.{column}, excluded.{column})")
+            elif increment:
+                updates.append(f"{column} = COALESCE({table}.{column}, 0) + excluded.{column}")
+            else:
+                updates.append(f"{column} = excluded.{column}")
+        updates.extend(
+            f"{quote(field.column)} = excluded.{quote(field.column)}" for field in fields
+            if getattr(field, "auto_now", False) and field.name not in update_fields
+        )
+        
+        row = "(%s)" % ", ".join(["%s"] * len(fields))
+        sql = "INSERT INTO %s (%s) VALUES %%s ON CONFLICT (%s) DO UPDATE SET %s" % (
+            table,
+            ", ".join(quote(field.column) for field in fields),
+            ", ".join(quote(cls._meta.get_field(name).column) for name in unique_fields),
+            ", ".join(updates),
+        )
+        
+        batch_size = max(connection.ops.bulk_batch_size(fields, objects), 1)
+        with connection.cursor() as cursor:
+            for i in range(0, len(objects), batch_size):
+                batch = objects[i:i + batch_size]
+                params = [
+                    # pre_save populates auto_now and auto_now_add fields
+                    field.get_db_prep_save(field.pre_save(obj, True), connection)
+                    for obj in batch for field in fields
+                ]
+                cursor.execute(sql % ", ".join([row] * len(batch)), params)
+    
+    @classmethod
+    def bulk_insert_new(cls, objects: List["UtilityModel"], returning: str) -> list:
+        """ Inserts objects, skipping those that conflict with an existing row on a unique
+        constraint, and returns the values of the returning field of the rows that were inserted.
+        Of concurrent inserts of the same row exactly one reports it as inserted.  This is one
+        INSERT ... ON CONFLICT DO NOTHING RETURNING query per batch, PostgreSQL and SQLite (3.35+)
+        support it.  Like bulk_create the objects are not validated, primary keys are not set, and
+        no signals are sent. """
+        if not objects:
+            return []
+        
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        fields = [field for field in cls._meta.concrete_fields if not field.primary_key]
+        row = "(%s)" % ", ".join(["%s"] * len(fields))
+        sql = "INSERT INTO %s (%s) VALUES %%s ON CONFLICT DO NOTHING RETURNING %s" % (
+            quote(cls._meta.db_table),
+            ", ".join(quote(field.column) for field in fields),
+            quote(cls._meta.get_field(returning).column),
+        )
+        
+        inserted = []
+        batch_size = max(connection.ops.bulk_batch_size(fields, objects), 1)
+        with connection.cursor() as cursor:
+            for i in range(0, len(objects), batch_size):
+                batch = objects[i:i + batch_size]
+                params = [
+                    # pre_save populates auto_now and auto_now_add fields
+                    field.get_db_prep_save(field.pre_save(obj, True), connection)
+                    for obj in batch for field in fields
+                ]
+                cursor.execute(sql % ", ".join([row] * len(batch)), params)
+                inserted.extend(value for value, in cursor.fetchall())
+        return inserted
+    
     def update(self, **kwargs):
         """ Convenience method on to update the database with a dictionary or kwargs."""
         for attr, value in kwargs.items():
@@ -1,8 +1,9 @@
 from collections import Counter
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max, Min
 from django.utils import timezone
 from django_extensions.db.fields.json import JSONField
 
@@ -10,18 +11,32 @@ from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM, CHUNKS_
 from constants.data_stream_constants import (CHUNKABLE_FILES, IDENTIFIERS,
     REVERSE_UPLOAD_FILE_TYPE_MAPPING)
 from constants.datetime_constants import API_TIME_FORMAT
-from database.models import TimestampedModel
+from database.models import TimestampedModel, UtilityModel
 from database.study_models import Study
 from database.user_models import Participant
 from database.validators import LengthValidator
 from libs.s3 import s3_list_files, s3_retrieve
 from libs.security import chunk_hash
+from libs.utils.cache_utils import ExpiringLRUCache
 
 
 class UnchunkableDataTypeError(Exception): pass
 class ChunkableDataTypeError(Exception): pass
 
 
+# time bins at or before the unix epoch are from devices with broken clocks.
+UNIX_EPOCH = timezone.make_aware(datetime(1970, 1, 1), timezone.utc)
+
+# study object ids never change, caching them saves a query when registering uploaded files.
+STUDY_OBJECT_ID_CACHE = ExpiringLRUCache(1000, 60 * 60)
+
+
+def get_study_object_id(study_id: int) -> str:
+    return STUDY_OBJECT_ID_CACHE.get(
+        study_id, lambda: Study.objects.filter(pk=study_id).values_list("object_id", flat=True).get()
+    )
+
+
 class PipelineRegistry(TimestampedModel):
     study = models.ForeignKey(
         'Study', on_delete=models.PROTECT, related_name='pipeline_registries', db_index=True
@@ -56,6 +71,9 @@ class ChunkRegistry(TimestampedModel):
     data_type = models.CharField(max_length=32, db_index=True)
     time_bin = models.DateTimeField(db_index=True)
     file_size = models.IntegerField(null=True, default=None)  # Size (in bytes) of the uncompressed file
+    # Largest (unix millisecond) timestamp in the chunk, only populated for chunks written by data
+    # processing.  When newer data arrives it can be appended to the chunk without a re-sort.
+    max_timestamp = models.BigIntegerField(null=True, blank=True, default=None)
     study = models.ForeignKey(
         'Study', on_delete=models.PROTECT, related_name='chunk_registries', db_index=True
     )
@@ -72,8 +90,9 @@ class ChunkRegistry(TimestampedModel):
     
     @classmethod
     def register_chunked_data(
-            cls, data_type, time_bin, chunk_path, file_contents, study_id, participant_id, survey_id=None
-    ):
+            cls, data_type, time_bin, chunk_path, file_contents, study_id, participant_id, survey_id=None,
+            max_timestamp=None
+    ) -> "ChunkRegistry":
         if data_type not in CHUNKABLE_FILES:
             raise UnchunkableDataTypeError
         
@@ -81,7 +100,8 @@ class ChunkRegistry(TimestampedModel):
         time_bin = int(time_bin) * CHUNK_TIMESLICE_QUANTUM
         time_bin = timezone.make_aware(datetime.utcfromtimestamp(time_bin), timezone.utc)
         
-        cls.objects.create(
+        # data processing is the only writer of chunks, the database enforces the unique chunk_path.
+        chunk = cls(
             is_chunkable=True,
             chunk_path=chunk_path,
             chunk_hash=chunk_hash_str,
@@ -91,17 +111,23 @@ class ChunkRegistry(TimestampedModel):
             participant_id=participant_id,
             survey_id=survey_id,
             file_size=len(file_contents),
+            max_timestamp=max_timestamp,
         )
+        chunk.save(force_insert=True, validate=False)
+        return chunk
     
     @classmethod
     def register_unchunked_data(cls, data_type, unix_timestamp, chunk_path, study_id, participant_id,
-                                file_contents, survey_id=None):
+                                file_contents, survey_id=None) -> int:
+        """ Registers an unchunkable file.  A user can upload an unchunkable file more than once, in
+        that case the existing registry is kept and its file size is updated, just in case it
+        changed.  Returns the change in the registered file size (for data quantity statistics). """
         time_bin = timezone.make_aware(datetime.utcfromtimestamp(unix_timestamp), timezone.utc)
         
         if data_type in CHUNKABLE_FILES:
             raise ChunkableDataTypeError
         
-        cls.objects.create(
+        chunk = cls(
             is_chunkable=False,
             chunk_path=chunk_path,
             chunk_hash='',
@@ -112,6 +138,10 @@ class ChunkRegistry(TimestampedModel):
             survey_id=survey_id,
             file_size=len(file_contents),
         )
+        previous_file_size = cls.objects.filter(chunk_path=chunk_path) \
+            .values_list("file_size", flat=True).first()
+        cls.bulk_upsert([chunk], unique_fields=["chunk_path"], update_fields=["file_size"])
+        return chunk.file_size - (previous_file_size or 0)
     
     @classmethod
     def update_registered_unchunked_data(cls, data_type, chunk_path, file_contents):
@@ -119,9 +149,9 @@ class ChunkRegistry(TimestampedModel):
         and updates the file size just in case it changed. """
         if data_type in CHUNKABLE_FILES:
             raise ChunkableDataTypeError
-        chunk = cls.objects.get(chunk_path=chunk_path)
-        chunk.file_size = len(file_contents)
-        chunk.save()
+        cls.objects.filter(chunk_path=chunk_path).update(
+            file_size=len(file_contents), last_updated=timezone.now()
+        )
     
     @classmethod
     def get_chunks_time_range(cls, study_id, user_ids=None, data_types=None, start=None, end=None):
@@ -140,8 +170,13 @@ class ChunkRegistry(TimestampedModel):
         return cls.objects.filter(**query)
     
     def update_chunk(self, data_to_hash: bytes):
+        """ Saves a chunk that data processing has appended to, with its new hash.  The file size
+        and max timestamp are set by the caller. """
         self.chunk_hash = chunk_hash(data_to_hash).decode()
-        self.save()
+        self.save(
+            update_fields=["chunk_hash", "file_size", "max_timestamp", "last_updated"],
+            validate=False,
+        )
     
     @classmethod
     def get_updated_users_for_study(cls, study, date_of_last_activity):
@@ -152,6 +187,71 @@ class ChunkRegistry(TimestampedModel):
         return cls.objects.filter(
             study=study, last_updated__gte=date_of_last_activity
         ).values_list("participant__patient_id", flat=True).distinct()
+    
+    class Meta:
+        indexes = [
+            # the first and last time bins of a study's data are index lookups.
+            models.Index(fields=["study", "time_bin"], name="chunk_registry_study_time_idx"),
+        ]
+
+
+class DataExtent(UtilityModel):
+    """ The first and last time bins of a participant's data of a data type (after the unix epoch).
+    Data processing maintains these as it registers chunks (see DataQuantityDeltas), the extent of
+    a study's or participant's data is a lookup in this small table instead of an aggregate over
+    their chunks.  Deleting chunks doesn't update them, call recalculate after deleting chunks. """
+    study = models.ForeignKey('Study', on_delete=models.PROTECT, related_name='data_extents')
+    participant = models.ForeignKey(
+        'Participant', on_delete=models.PROTECT, related_name='data_extents'
+    )
+    data_type = models.CharField(max_length=32)
+    first_time_bin = models.DateTimeField()
+    last_time_bin = models.DateTimeField()
+    
+    class Meta:
+        unique_together = (("participant", "data_type"),)
+    
+    @classmethod
+    def record(
+        cls, study_id: int, participant_id: int, extents: Dict[str, Tuple[datetime, datetime]]
+    ):
+        """ Widens the extents of a participant's data to include {data type: (first time bin, last
+        time bin)}, in one query.  Extents that start at or before the unix epoch are ignored. """
+        cls.bulk_upsert(
+            [
+                cls(
+                    study_id=study_id, participant_id=participant_id, data_type=data_type,
+                    first_time_bin=first_time_bin, last_time_bin=last_time_bin,
+                )
+                for data_type, (first_time_bin, last_time_bin) in extents.items()
+                if first_time_bin > UNIX_EPOCH
+            ],
+            unique_fields=["participant", "data_type"],
+            update_fields=["first_time_bin", "last_time_bin"],
+            combine={"first_time_bin": "least", "last_time_bin": "greatest"},
+        )
+    
+    @classmethod
+    def recalculate(cls, participant_ids: Iterable[int]):
+        """ Rebuilds the extents of participants' data from ChunkRegistry. """
+        participant_ids = list(participant_ids)
+        extents = ChunkRegistry.objects.filter(
+            participant_id__in=participant_ids, time_bin__gt=UNIX_EPOCH
+        ).order_by().values("study_id", "participant_id", "data_type").annotate(
+            first_time_bin=Min("time_bin"), last_time_bin=Max("time_bin")
+        )
+        with transaction.atomic():
+            cls.objects.filter(participant_id__in=participant_ids).delete()
+            cls.objects.bulk_create([cls(**extent) for extent in extents])
+    
+    @classmethod
+    def get_extent(cls, **filters) -> Tuple[Optional[datetime], Optional[datetime]]:
+        """ The first and last time bins of the data matching the filters (study_id, participant_id,
+        data_type), None, None if there is none. """
+        extent = cls.objects.filter(**filters).aggregate(
+            first=Min("first_time_bin"), last=Max("last_time_bin")
+        )
+        return extent["first"], extent["last"]
 
 
 class FileToProcess(TimestampedModel):
@@ -188,13 +288,47 @@ class FileToProcess(TimestampedModel):
         )
     
     @classmethod
-    def reprocess_originals_from_chunk_path(cls, chunk_path):
-        """ Takes a processed file (chunk) s3 path, identifies the original source files,
-        and prepares a FileToProcess entry so that the source data will be re-processed
-        and merged into the existing data.
-        This is mostly a utility function, it was originally part of a script, but it is
-        quite complex to accomplish, and worth holding on to.
-        Contains print statements. """
+    def append_files_for_processing(cls, files: Iterable[Tuple[str, Participant]]) -> Set[str]:
+        """ Bulk version of append_file_for_processing, takes (file path, participant) pairs.
+        Returns the set of provided file paths that were not already present.  Whether a path is
+        new is decided by the insert itself (paths that are already present are skipped by the
+        unique constraint on s3_file_path), so if several processes register the same path at the
+        same moment exactly one of them reports it as new. """
+        normalized_paths = {}
+        new_ftps = []
+        for file_path, participant in files:
+            normalized_path = cls.normalize_s3_file_path(
+                file_path, get_study_object_id(participant.study_id)
+            )
+            if normalized_path in normalized_paths:
+                continue
+            normalized_paths[normalized_path] = file_path
+            new_ftps.append(
+                cls(s3_file_path=normalized_path, study_id=participant.study_id, participant=participant)
+            )
+        
+        inserted_paths = cls.bulk_insert_new(new_ftps, returning="s3_file_path")
+        return {normalized_paths[normalized_path] for normalized_path in inserted_paths}
+    
+    @classmethod
+    def register_uploads(cls, uploads: Iterable[Tuple[str, Participant, int]]) -> Set[str]:
+        """ Takes (file path, participant, file size) tuples of files uploaded by devices, adds them
+        to FileToProcess, and creates UploadTracking entries for the ones that were new.  Returns
+        the set of file paths that were new. """
+        from database.profiling_models import UploadTracking  # circular import
+        uploads = list(uploads)
+        new_paths = cls.append_files_for_processing(
+            (file_path, participant) for file_path, participant, _ in uploads
+        )
+        UploadTracking.track_uploads(upload for upload in uploads if upload[0] in new_paths)
+        return new_paths
+    
+    @staticmethod
+    def find_original_files_of_chunk_path(chunk_path: str) -> Tuple[str, List[str]]:
+        """ Takes a processed file (chunk) s3 path, returns the patient id and the s3 paths of the
+        original source files of the chunk: the files from the hour of the chunk through the next
+        hour, and the last file of the hour before it.  Only the files around that window are
+        listed, this makes no database queries. """
         path_components = chunk_path.split("/")
         if len(path_components) != 5:
             raise Exception("chunked file paths contain exactly 5 components separated by a slash.")
@@ -204,8 +338,6 @@ class FileToProcess(TimestampedModel):
         if not chunk_files_text == CHUNKS_FOLDER:
             raise Exception("This is not a chunked file, it is not in the chunked data folder.")
         
-        participant = Participant.objects.get(patient_id=username)
-        
         # data stream names are truncated
         full_data_stream = REVERSE_UPLOAD_FILE_TYPE_MAPPING[data_stream]
         
@@ -217,14 +349,26 @@ class FileToProcess(TimestampedModel):
         dt_start = datetime.strptime(timestamp.strip(".csv"), API_TIME_FORMAT)
         dt_prev = dt_start - timedelta(hours=1)
         dt_end = dt_start + timedelta(hours=1)
+        
+        # file names are timestamps (milliseconds, identifiers files are seconds).  S3 lists keys in
+        # lexicographic order, which is chronological for timestamps with the same number of digits,
+        # the listing starts at the prior hour and stops after the window.  ("~" sorts after any
+        # file name that starts with the last timestamp.)
+        scale = 1 if full_data_stream == IDENTIFIERS else 1000
+        first_timestamp = str(int(dt_prev.timestamp() * scale))
+        last_timestamp = str(int(dt_end.timestamp() * scale))
+        if len(first_timestamp) == len(last_timestamp) and not first_timestamp.startswith("-"):
+            start_after, end_key = file_prefix + first_timestamp, file_prefix + last_timestamp + "~"
+        else:
+            start_after, end_key = None, None  # list all of the files
+        
         prior_hour_last_file = None
-        file_paths_to_reprocess = []
-        for s3_file_path in s3_list_files(file_prefix, as_generator=False):
+        file_paths = []
+        for s3_file_path in s3_list_files(file_prefix, as_generator=True, start_after=start_after):
+            if end_key and s3_file_path > end_key:
+                break
             # convert timestamp....
-            if full_data_stream == IDENTIFIERS:
-                file_timestamp = float(s3_file_path.rsplit(splitter_end_char)[-1][:-4])
-            else:
-                file_timestamp = float(s3_file_path.rsplit(splitter_end_char)[-1][:-4]) / 1000
+            file_timestamp = float(s3_file_path.rsplit(splitter_end_char)[-1][:-4]) / scale
             file_dt = datetime.fromtimestamp(file_timestamp)
             # we need to get the last file from the prior hour as it my have relevant data,
             # fortunately returns of file paths are in ascending order, so it is the file
@@ -234,26 +378,39 @@ class FileToProcess(TimestampedModel):
             
             # and then every file within the relevant hour
             if dt_start <= file_dt <= dt_end:
-                print("found:", s3_file_path)
-                file_paths_to_reprocess.append(s3_file_path)
+                file_paths.append(s3_file_path)
         
         # a "should be an unnecessary" safety check, but apparently we can't have nice things.
-        if prior_hour_last_file and prior_hour_last_file not in file_paths_to_reprocess:
-            print("found:", prior_hour_last_file)
-            file_paths_to_reprocess.append(prior_hour_last_file)
+        if prior_hour_last_file and prior_hour_last_file not in file_paths:
+            file_paths.append(prior_hour_last_file)
         
-        if not prior_hour_last_file and not file_paths_to_reprocess:
+        return username, file_paths
+    
+    @classmethod
+    def reprocess_originals_from_chunk_path(cls, chunk_path):
+        """ Takes a processed file (chunk) s3 path, identifies the original source files,
+        and prepares a FileToProcess entry so that the source data will be re-processed
+        and merged into the existing data.
+        This is mostly a utility function, it was originally part of a script, but it is
+        quite complex to accomplish, and worth holding on to.  To reprocess many chunks use
+        libs.file_processing.reprocess_originals.
+        Contains print statements. """
+        username, file_paths_to_reprocess = cls.find_original_files_of_chunk_path(chunk_path)
+        
+        if not file_paths_to_reprocess:
             raise Exception(  # this should not happen...
-                f"did not find any matching files: '{chunk_path}' using prefix '{file_prefix}'"
+                f"did not find any matching files: '{chunk_path}'"
             )
         
+        participant = Participant.objects.get(patient_id=username)
+        new_file_paths = cls.append_files_for_processing(
+            (fp, participant) for fp in file_paths_to_reprocess
+        )
         for fp in file_paths_to_reprocess:
-            if cls.objects.filter(s3_file_path=fp).exists():
-                print(f"{fp} is already queued for processing")
-                continue
-            else:
+            if fp in new_file_paths:
                 print(f"Adding {fp} as a file to reprocess.")
-                cls.append_file_for_processing(fp, study_obj_id, participant=participant)
+            else:
+                print(f"{fp} is already queued for processing")
     
     @classmethod
     def report(cls, *args, **kwargs) -> Dict[str, int]:
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.27 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0066_remove_researcher_is_batch_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkregistry',
+            name='max_timestamp',
+            field=models.BigIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.27 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0067_chunkregistry_max_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduledevent',
+            index=models.Index(fields=['scheduled_time', 'participant', 'survey'], name='scheduled_event_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledevent',
+            index=models.Index(fields=['created_on', 'scheduled_time'], name='scheduled_event_created_idx'),
+        ),
+    ]
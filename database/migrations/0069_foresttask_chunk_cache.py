@@ -0,0 +1,28 @@
+# Generated by Django 2.2.27 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0068_scheduledevent_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foresttask',
+            name='cached_file_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foresttask',
+            name='cached_file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='foresttask',
+            name='downloaded_file_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
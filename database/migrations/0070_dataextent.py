@@ -0,0 +1,48 @@
+# Generated by Django 2.2.27 on 2026-10-18 12:00
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def populate_data_extents(apps, schema_editor):
+    """ The extents of all existing data, one aggregate query over ChunkRegistry. """
+    db_alias = schema_editor.connection.alias
+    ChunkRegistry = apps.get_model('database', 'ChunkRegistry')
+    DataExtent = apps.get_model('database', 'DataExtent')
+    unix_epoch = timezone.make_aware(datetime(1970, 1, 1), timezone.utc)
+
+    extents = ChunkRegistry.objects.using(db_alias).filter(time_bin__gt=unix_epoch).order_by() \
+        .values("study_id", "participant_id", "data_type") \
+        .annotate(first_time_bin=Min("time_bin"), last_time_bin=Max("time_bin"))
+    DataExtent.objects.using(db_alias).bulk_create(
+        (DataExtent(**extent) for extent in extents.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0069_foresttask_chunk_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataExtent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_type', models.CharField(max_length=32)),
+                ('first_time_bin', models.DateTimeField()),
+                ('last_time_bin', models.DateTimeField()),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_extents', to='database.Participant')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_extents', to='database.Study')),
+            ],
+            options={
+                'unique_together': {('participant', 'data_type')},
+            },
+        ),
+        migrations.RunPython(populate_data_extents, migrations.RunPython.noop),
+    ]
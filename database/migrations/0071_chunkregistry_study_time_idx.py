@@ -0,0 +1,46 @@
+# Generated by Django 2.2.27 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+INDEX_NAME = "chunk_registry_study_time_idx"
+
+
+def create_index(apps, schema_editor):
+    """ ChunkRegistry is the largest table, a plain CREATE INDEX would block writes to it (all data
+    processing) until the index is built.  On PostgreSQL the index is built concurrently, which
+    can't run in a transaction, so this migration is not atomic. """
+    ChunkRegistry = apps.get_model('database', 'ChunkRegistry')
+    concurrently = "CONCURRENTLY " if schema_editor.connection.vendor == "postgresql" else ""
+    schema_editor.execute(
+        f"CREATE INDEX {concurrently}IF NOT EXISTS {INDEX_NAME} "
+        f"ON {ChunkRegistry._meta.db_table} (study_id, time_bin)"
+    )
+
+
+def drop_index(apps, schema_editor):
+    concurrently = "CONCURRENTLY " if schema_editor.connection.vendor == "postgresql" else ""
+    schema_editor.execute(f"DROP INDEX {concurrently}IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('database', '0070_dataextent'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='chunkregistry',
+                    index=models.Index(fields=['study', 'time_bin'], name=INDEX_NAME),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_index, drop_index),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from typing import Iterable, List, Tuple
 
 from django.db import models
 from django.utils import timezone
@@ -86,87 +87,49 @@ class UploadTracking(TimestampedModel):
     timestamp = models.DateTimeField()
     participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='upload_trackers')
     
+    @classmethod
+    def track_uploads(cls, uploads: Iterable[Tuple[str, Participant, int]]):
+        """ Bulk creates entries from (file path, participant, file size) tuples. """
+        now = timezone.now()
+        cls.objects.bulk_create([
+            cls(file_path=file_path, file_size=file_size, timestamp=now, participant=participant)
+            for file_path, participant, file_size in uploads
+        ])
+    
     @classmethod
     def re_add_files_to_process(cls, number=100):
         """ Re-adds the most recent [number] files that have been uploaded recently to FiletToProcess.
             (this is fairly optimized because it is part of debugging file processing) """
-        from database.data_access_models import FileToProcess
-        uploads = cls.objects.order_by("-created_on").values_list(
-            "file_path", "participant__study_id", "participant_id"
-        )[:number]
-        new_ftps = []
-        participant_cache = {}  # uhg need to cache participants...
-        for i, (file_path, study_id, participant_id) in enumerate(uploads):
-            if participant_id in participant_cache:
-                participant = participant_cache[participant_id]
-            else:
-                participant = Participant.objects.get(id=participant_id)
-                participant_cache[participant_id] = participant
-            
-            if i % 10 == 0:
-                print(i, sep="... ")
-            
-            if FileToProcess.objects.filter(s3_file_path__icontains=file_path).exists():
-                print(f"skipping {file_path}, appears to already be present")
-                continue
-            
-            new_ftps.append(FileToProcess(
-                s3_file_path=file_path,
-                study_id=study_id,
-                participant=participant
-            ))
-        FileToProcess.objects.bulk_create(
-            new_ftps
+        uploads = list(
+            cls.objects.order_by("-created_on").values_list("file_path", "participant_id")[:number]
         )
-        # FileToProcess.append_file_for_processing(
-        #     # file_path, study_object_id, **kwargs
-        #     file_path,
-        #     # participant__study__object_id,
-        #     participant=participant,
-        # )
+        cls._append_uploads_for_processing(uploads)
     
     @classmethod
     def add_files_to_process2(cls, limit=25):
         """ Re-adds the most recent [limit] files that have been uploaded recently to FiletToProcess.
             (this is fairly optimized because it is part of debugging file processing) """
-        from database.data_access_models import FileToProcess
-        
-        upload_queries = []
+        uploads = []
         for ds in DATA_STREAM_TO_S3_FILE_NAME_STRING.values():
             if ds == "identifiers":
                 continue
-            query = (
+            print(ds)
+            uploads.extend(
                 cls.objects.order_by("-created_on")
                     .filter(file_path__contains=ds)
-                    .values_list("file_path",
-                                 "participant__study_id",
-                                 "participant__study__object_id",
-                                 "participant_id")[:limit]
+                    .values_list("file_path", "participant_id")[:limit]
             )
-            upload_queries.append((ds, query))
-        
-        new_ftps = []
-        # participant_cache = {}  # uhg need to cache participants...
-        file_paths_wandered = set(FileToProcess.objects.values_list("s3_file_path", flat=True))
-        for file_type, uploads_query in upload_queries:
-            print(file_type)
-            for i, (file_path, study_id, object_id, participant_id) in enumerate(uploads_query):
-                
-                if i % 10 == 0 or i == limit-1:
-                    print(i+1 if i == limit-1 else i, sep="... ",)
-                
-                if file_path in file_paths_wandered:
-                    continue
-                else:
-                    file_paths_wandered.add(file_path)
-                
-                new_ftps.append(FileToProcess(
-                    s3_file_path=object_id + "/" + file_path,
-                    study_id=study_id,
-                    participant_id=participant_id
-                ))
-        FileToProcess.objects.bulk_create(new_ftps)
+        cls._append_uploads_for_processing(uploads)
     
+    @staticmethod
+    def _append_uploads_for_processing(uploads: List[Tuple[str, int]]):
+        """ Takes (file path, participant id) pairs. """
+        from database.data_access_models import FileToProcess  # circular import
+        participants = Participant.objects.in_bulk({participant_id for _, participant_id in uploads})
+        new_file_paths = FileToProcess.append_files_for_processing(
+            (file_path, participants[participant_id]) for file_path, participant_id in uploads
+        )
+        print(f"added {len(new_file_paths)} of {len(uploads)} files, the rest were already present.")
     
     @classmethod
     def get_trailing_count(cls, time_delta):
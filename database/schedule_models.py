@@ -1,5 +1,5 @@
 from datetime import date, datetime, time, timedelta, tzinfo
-from typing import List
+from typing import List, Tuple
 
 from dateutil.tz import gettz
 from django.core.paginator import Paginator
@@ -203,8 +203,28 @@ class ScheduledEvent(TimestampedModel):
     #  class Meta:
     #     unique_together = ('survey', 'participant', 'scheduled_time',)
 
+    class Meta:
+        indexes = [
+            # the due events query of push notifications, the notification scheduler's horizon query.
+            models.Index(fields=["scheduled_time", "participant", "survey"], name="scheduled_event_due_idx"),
+            # the notification scheduler's created_on watermark query.
+            models.Index(fields=["created_on", "scheduled_time"], name="scheduled_event_created_idx"),
+        ]
+
     def get_schedule_type(self):
-        return self.SCHEDULE_CLASS_LOOKUP[self.get_schedule().__class__]
+        # uses the foreign key ids, so that the schedule is not loaded from the database.
+        schedule_types = [
+            schedule_type for schedule_type, schedule_id in (
+                (ScheduleTypes.weekly, self.weekly_schedule_id),
+                (ScheduleTypes.relative, self.relative_schedule_id),
+                (ScheduleTypes.absolute, self.absolute_schedule_id),
+            ) if schedule_id is not None
+        ]
+        if len(schedule_types) > 1:
+            raise Exception(f"ScheduledEvent had {len(schedule_types)} associated schedules.")
+        if not schedule_types:
+            raise Exception("ScheduledEvent had no associated schedule")
+        return schedule_types[0]
 
     def get_schedule(self):
         number_schedules = sum((
@@ -251,6 +271,43 @@ class ScheduledEvent(TimestampedModel):
         if self_delete:
             self.delete()
 
+    @staticmethod
+    def bulk_archive(
+            events_and_statuses: List[Tuple["ScheduledEvent", str]], self_delete: bool,
+            created_on: datetime = None,
+    ):
+        """ archive for many ScheduledEvents.  Survey archives are looked up once per survey, the
+        ArchivedEvents are bulk created, and the ScheduledEvents are bulk deleted. """
+        if not events_and_statuses:
+            return
+
+        # the most recent archive of each survey, in one query.
+        surveys = {event.survey_id: event.survey for event, _ in events_and_statuses}
+        survey_archives = {}
+        for survey_archive in SurveyArchive.objects.filter(survey_id__in=surveys) \
+                .order_by("survey_id", "-archive_start"):
+            survey_archives.setdefault(survey_archive.survey_id, survey_archive)
+
+        # see archive for the no-existing-survey-archive case.
+        for survey_id, survey in surveys.items():
+            if survey_id not in survey_archives:
+                survey.archive()
+                survey_archives[survey_id] = survey.most_recent_archive()
+
+        extra_kwargs = {"created_on": created_on} if created_on else {}
+        ArchivedEvent.objects.bulk_create([
+            ArchivedEvent(
+                survey_archive=survey_archives[event.survey_id],
+                participant_id=event.participant_id,
+                schedule_type=event.get_schedule_type(),
+                scheduled_time=event.scheduled_time,
+                status=status,
+                **extra_kwargs,
+            ) for event, status in events_and_statuses
+        ])
+        if self_delete:
+            ScheduledEvent.objects.filter(pk__in=[event.pk for event, _ in events_and_statuses]).delete()
+
     @staticmethod
     @disambiguate_participant_survey
     def find_pending_events(
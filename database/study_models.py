@@ -1,13 +1,12 @@
 from __future__ import annotations
 
-import operator
 from datetime import datetime
 from typing import Optional
 
 from dateutil.tz import gettz
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.db.models import F, Func, Q
+from django.db.models import F, Func, Max, Min, Q
 from django.db.models.query import QuerySet
 from django.utils import timezone
 from django.utils.timezone import localtime
@@ -57,6 +56,9 @@ class Study(TimestampedModel):
         except ObjectDoesNotExist:
             self.forest_param = ForestParam.objects.get(default=True)
         super().save(*args, **kwargs)
+        # the encryption key may have changed, drop it from this process's key cache.
+        from libs.encryption import STUDY_ENCRYPTION_KEY_CACHE  # circular import
+        STUDY_ENCRYPTION_KEY_CACHE.invalidate(self.object_id)
         try:
             self.device_settings
         except ObjectDoesNotExist:
@@ -125,30 +127,34 @@ class Study(TimestampedModel):
         """
         Return the earliest ChunkRegistry time bin datetime for this study.
 
-        Note: As of 2021-07-01, running the query as a QuerySet filter or sorting the QuerySet can
-              take upwards of 30 seconds. Doing the logic in python speeds this up tremendously.
+        Note: The extent of a study's data after the epoch is maintained in DataExtent, usually this
+              is a lookup in that table.  Otherwise (data from before the epoch, or the latest
+              data is in the future) this is an aggregate over the study's chunks, which the
+              (study, time_bin) index of ChunkRegistry makes an index lookup.
         Args:
             earliest: if True, will return earliest datetime; if False, will return latest datetime
             only_after_epoch: if True, will filter results only for datetimes after the Unix epoch
                               (1970-01-01T00:00:00Z)
             only_before_now: if True, will filter results only for datetimes before now
         """
-        time_bins = self.chunk_registries.values_list("time_bin", flat=True)
-        comparator = operator.lt if earliest else operator.gt
+        from database.data_access_models import UNIX_EPOCH, ChunkRegistry, DataExtent
         now = timezone.now()
-        desired_time_bin = None
-        for time_bin in time_bins:
-            if only_after_epoch and time_bin.timestamp() <= 0:
-                continue
-            if only_before_now and time_bin > now:
-                continue
-            if desired_time_bin is None:
-                desired_time_bin = time_bin
-                continue
-            if comparator(desired_time_bin, time_bin):
-                continue
-            desired_time_bin = time_bin
-        return desired_time_bin
+        if only_after_epoch:
+            first_time_bin, last_time_bin = DataExtent.get_extent(study_id=self.pk)
+            time_bin = first_time_bin if earliest else last_time_bin
+            if time_bin is None or not only_before_now or time_bin <= now:
+                return time_bin
+            if earliest:
+                return None  # all of the data is in the future
+        
+        time_bins = ChunkRegistry.objects.filter(study_id=self.pk)
+        if only_after_epoch:
+            time_bins = time_bins.filter(time_bin__gt=UNIX_EPOCH)
+        if only_before_now:
+            time_bins = time_bins.filter(time_bin__lte=now)
+        return time_bins.aggregate(
+            time_bin=Min("time_bin") if earliest else Max("time_bin")
+        )["time_bin"]
     
     def notification_events(self, **archived_event_filter_kwargs):
         from database.schedule_models import ArchivedEvent
@@ -5,7 +5,9 @@ import os
 import pickle
 import shutil
 import uuid
+from collections import defaultdict
 from time import sleep
+from typing import Any, Dict, Iterable, Tuple
 
 from django.db import models
 
@@ -64,6 +66,11 @@ class ForestTask(TimestampedModel):
     process_download_end_time = models.DateTimeField(null=True, blank=True)
     process_end_time = models.DateTimeField(null=True, blank=True)
     
+    # input files placed from the local chunk cache, and downloaded from S3, for accounting
+    cached_file_count = models.IntegerField(blank=True, null=True)
+    downloaded_file_count = models.IntegerField(blank=True, null=True)
+    cached_file_size = models.BigIntegerField(blank=True, null=True)  # bytes not downloaded
+    
     # Whether or not there was any data output by Forest (None indicates unknown)
     forest_output_exists = models.NullBooleanField()
     
@@ -98,6 +105,7 @@ class ForestTask(TimestampedModel):
         with open(self.forest_results_path, "r") as f:
             reader = csv.DictReader(f)
             has_data = False
+            statistics = []
             log("opened file...")
             
             for line in reader:
@@ -120,14 +128,10 @@ class ForestTask(TimestampedModel):
                     else:
                         raise BadForestField(column_name)
                 
-                data = {
-                    "date": summary_date,
-                    "defaults": updates,
-                    "participant": self.participant,
-                }
-                log("creating SummaryStatisticDaily:", data)
-                SummaryStatisticDaily.objects.update_or_create(**data)
+                log("creating SummaryStatisticDaily:", summary_date, updates)
+                statistics.append((self.participant_id, summary_date, updates))
         
+        SummaryStatisticDaily.bulk_upsert_statistics(statistics)
         return has_data
     
     def clean_up_files(self):
@@ -209,6 +213,13 @@ class ForestTask(TimestampedModel):
         self.all_memory_dict_s3_key = self.generate_all_memory_dict_s3_key()
         self.save(update_fields=["all_memory_dict_s3_key"])
     
+    @property
+    def cache_hit_rate(self):
+        """ The fraction of input files that were placed from the local chunk cache. """
+        if not self.cached_file_count and not self.downloaded_file_count:
+            return None
+        return self.cached_file_count / (self.cached_file_count + (self.downloaded_file_count or 0))
+    
     ## File paths
     @property
     def data_base_path(self):
@@ -338,3 +349,22 @@ class SummaryStatisticDaily(TimestampedModel):
         constraints = [
             models.UniqueConstraint(fields=['date', 'participant'], name="unique_summary_statistic")
         ]
+    
+    @classmethod
+    def bulk_upsert_statistics(
+        cls, statistics: Iterable[Tuple[int, datetime.date, Dict[str, Any]]], increment: bool = False
+    ):
+        """ Takes (participant id, date, {field name: value}) tuples, creates the statistics that
+        don't exist and updates only the provided fields of those that do (like update_or_create
+        with defaults), or with increment=True adds the values to them.  This is a query per batch
+        of statistics with the same fields rather than several queries per statistic. """
+        by_fields = defaultdict(list)
+        for participant_id, date, updates in statistics:
+            by_fields[tuple(sorted(updates))].append(
+                cls(participant_id=participant_id, date=date, **updates)
+            )
+        for fields, objects in by_fields.items():
+            cls.bulk_upsert(
+                objects, unique_fields=["date", "participant"], update_fields=fields,
+                increment=increment,
+            )
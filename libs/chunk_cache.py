@@ -0,0 +1,127 @@
+import errno
+import os
+import shutil
+from hashlib import sha256
+from os.path import join as path_join
+from typing import Optional
+from uuid import uuid4
+
+from config.settings import FOREST_CHUNK_CACHE_DIRECTORY, FOREST_CHUNK_CACHE_MAX_MB
+
+
+"""
+The chunk cache keeps decrypted chunk files on the local disk of the Forest servers, so that
+overlapping Forest tasks (jasmine and willow for the same participant, consecutive date ranges)
+don't retrieve and decrypt the same files from S3 again.
+
+A file is stored under a hash of its chunk_path and chunk_hash, a chunk that has changed since it
+was cached is simply a different file.  Files are placed into a task's input folder as hard links
+(or copies if the task folder is on a different filesystem), deleting the task folder does not
+affect the cache.  Forest only reads its input files, nothing may write to them.
+
+The modification time of a cached file is the last time it was used, when the cache is over
+FOREST_CHUNK_CACHE_MAX_MB the least recently used files are deleted.
+"""
+
+TEMPORARY_SUFFIX = ".tmp"
+
+
+class ChunkCache:
+
+    def __init__(self, directory: str, max_megabytes: int):
+        self.directory = directory
+        self.max_bytes = max_megabytes * 1024 * 1024
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def path(self, chunk: dict) -> Optional[str]:
+        """ The cache path of a chunk, None if it can't be cached. """
+        if not self.enabled or not chunk["chunk_hash"]:
+            return None  # without a hash we can't tell whether a chunk has changed
+        key = sha256(f"{chunk['chunk_path']}\n{chunk['chunk_hash']}".encode()).hexdigest()
+        return path_join(self.directory, key[:2], key)
+
+    def place(self, chunk: dict, destination: str) -> Optional[int]:
+        """ Places a cached chunk at destination, returns its size, None if it is not cached. """
+        cache_path = self.path(chunk)
+        if cache_path is None:
+            return None
+        try:
+            os.utime(cache_path)
+            self._link(cache_path, destination)
+        except FileNotFoundError:
+            return None  # not cached, or evicted by another process just now
+        return os.path.getsize(destination)
+
+    def store(self, chunk: dict, contents: bytes, destination: str):
+        """ Writes the chunk to destination, and stores it in the cache. """
+        cache_path = self.path(chunk)
+        if cache_path is None:
+            with open(destination, "xb") as f:
+                f.write(contents)
+            return
+
+        # write to a temporary file and rename it into place, a concurrent reader never sees a
+        # partial file, and a concurrent writer of the same chunk writes identical contents.
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary_path = f"{cache_path}.{uuid4().hex}{TEMPORARY_SUFFIX}"
+        try:
+            with open(temporary_path, "wb") as f:
+                f.write(contents)
+            os.rename(temporary_path, cache_path)
+        finally:
+            self._remove(temporary_path)
+        try:
+            self._link(cache_path, destination)
+        except FileNotFoundError:  # evicted by another process just now
+            with open(destination, "xb") as f:
+                f.write(contents)
+
+    def evict(self):
+        """ Deletes the least recently used files until the cache is within its size limit. """
+        if not self.enabled or not os.path.exists(self.directory):
+            return
+
+        files = []
+        total_size = 0
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(TEMPORARY_SUFFIX):
+                    continue  # being written
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+                total_size += stat.st_size
+
+        for _, path, size in sorted(files):
+            if total_size <= self.max_bytes:
+                break
+            self._remove(path)
+            total_size -= size
+
+    @staticmethod
+    def _link(source: str, destination: str):
+        # a hard link is free, a copy is the fallback for a destination on another filesystem.
+        try:
+            os.link(source, destination)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            with open(source, "rb") as f_in, open(destination, "xb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+FOREST_CHUNK_CACHE = ChunkCache(FOREST_CHUNK_CACHE_DIRECTORY, FOREST_CHUNK_CACHE_MAX_MB)
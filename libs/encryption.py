@@ -1,8 +1,9 @@
 import json
 import traceback
+from binascii import a2b_base64, Error as base64_error
 from os import urandom
 from sys import version_info
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from Crypto.PublicKey import RSA as old_RSA
 from Cryptodome.Cipher import AES
@@ -15,6 +16,7 @@ from database.profiling_models import (DecryptionKeyError, EncryptionErrorMetada
 from database.study_models import Study
 from database.user_models import Participant
 from libs.security import Base64LengthException, decode_base64, encode_base64, PaddingException
+from libs.utils.cache_utils import ExpiringLRUCache
 
 
 # TODO: there is a circular import due to the database imports in this file and this file being
@@ -39,6 +41,20 @@ class InvalidIV(Exception): pass
 class InvalidData(Exception): pass
 class DefinitelyInvalidFile(Exception): pass
 
+
+# number of lines of a device file that are decrypted together by decrypt_device_lines.
+DEVICE_LINE_BATCH_SIZE = 1000
+URLSAFE_TO_STANDARD_BASE64 = bytes.maketrans(b"-_", b"+/")
+
+
+# Study encryption keys are looked up for every S3 operation.  They are cached per process, entries
+# are invalidated by Study.save, and otherwise expire so that other processes pick up changes.
+STUDY_ENCRYPTION_KEY_CACHE_SIZE = 1000
+STUDY_ENCRYPTION_KEY_CACHE_SECONDS = 300
+STUDY_ENCRYPTION_KEY_CACHE = ExpiringLRUCache(
+    STUDY_ENCRYPTION_KEY_CACHE_SIZE, STUDY_ENCRYPTION_KEY_CACHE_SECONDS
+)
+
 ################################################################################
 ################################# RSA ##########################################
 ################################################################################
@@ -81,6 +97,15 @@ def get_RSA_cipher(key: bytes) -> old_RSA._RSAobj:
 ################################################################################
 
 
+def get_study_encryption_key(study_object_id: str) -> bytes:
+    return STUDY_ENCRYPTION_KEY_CACHE.get(
+        study_object_id,
+        lambda: Study.objects.filter(
+            object_id=study_object_id
+        ).values_list('encryption_key', flat=True).get().encode()
+    )
+
+
 def encrypt_for_server(input_string: bytes, study_object_id: str) -> bytes:
     """
     Encrypts config using the ENCRYPTION_KEY, prepends the generated initialization vector.
@@ -88,7 +113,7 @@ def encrypt_for_server(input_string: bytes, study_object_id: str) -> bytes:
     """
     if not isinstance(study_object_id, str):
         raise Exception(f"received non-string object {study_object_id}")
-    encryption_key = Study.objects.get(object_id=study_object_id).encryption_key.encode()  # bytes
+    encryption_key = get_study_encryption_key(study_object_id)
     iv = urandom(16)  # bytes
     return iv + AES.new(encryption_key, AES.MODE_CFB, segment_size=8, IV=iv).encrypt(input_string)
 
@@ -98,9 +123,12 @@ def decrypt_server(data: bytes, study_object_id: str) -> bytes:
     if not isinstance(study_object_id, str):
         raise TypeError(f"received non-string object {study_object_id}")
     
-    encryption_key = Study.objects.filter(
-        object_id=study_object_id
-    ).values_list('encryption_key', flat=True).get().encode()
+    return decrypt_server_with_key(data, get_study_encryption_key(study_object_id))
+
+
+def decrypt_server_with_key(data: bytes, encryption_key: bytes) -> bytes:
+    """ Decrypts config encrypted by the encrypt_for_server function with the study's encryption
+    key, for callers that have already looked the key up. """
     iv = data[:16]
     data = data[16:]  # gr arg, memcopy operation...
     return AES.new(encryption_key, AES.MODE_CFB, segment_size=8, IV=iv).decrypt(data)
@@ -141,11 +169,20 @@ def decrypt_device_file(file_name: str, original_data: bytes, participant: Parti
         file_name, file_data, participant, private_key_cipher, original_data
     )
     
-    for i, line in enumerate(file_data):
-        # we need to skip the first line (the decryption key), but need real index values in i
-        if i == 0:
-            continue
-        
+    def lines_needing_individual_decryption():
+        # Lines are decrypted in batches, which extends good_lines.  A batch containing any line
+        # that does not decrypt cleanly is instead yielded line by line (with real index values for
+        # i) to the error handling below.  Batches are processed in order, so good_lines retains
+        # the order of the file.  We skip the first line, it is the decryption key.
+        for batch_start in range(1, len(file_data), DEVICE_LINE_BATCH_SIZE):
+            batch = file_data[batch_start:batch_start + DEVICE_LINE_BATCH_SIZE]
+            decrypted_batch = decrypt_device_lines(aes_decryption_key, batch)
+            if decrypted_batch is None:
+                yield from enumerate(batch, batch_start)
+            else:
+                good_lines.extend(decrypted_batch)
+    
+    for i, line in lines_needing_individual_decryption():
         if line is None:
             # this case causes weird behavior inside decrypt_device_line, so we test for it instead.
             error_count += 1
@@ -266,6 +303,20 @@ def decrypt_device_file(file_name: str, original_data: bytes, participant: Parti
     return b"\n".join(good_lines)
 
 
+def validate_device_file_key(file_name: str, original_data: bytes, participant: Participant):
+    """ Runs the checks of decrypt_device_file that apply to a file as a whole (the file is empty,
+    the decryption key is invalid) and raises the same errors, without decrypting any lines. """
+    start = 0
+    while original_data[start:start + 1] == b"\n":
+        start += 1
+    if start == len(original_data):
+        raise HandledError("The file had no data in it.  Return 200 to delete file from device.")
+    
+    end = original_data.find(b"\n", start)
+    key_line = original_data[start:] if end == -1 else original_data[start:end]
+    extract_aes_key(file_name, [key_line], participant, participant.get_private_key(), original_data)
+
+
 def extract_aes_key(
         file_name: str, file_data: List[bytes], participant: Participant, private_key_cipher, original_data: bytes
 ) -> bytes:
@@ -340,6 +391,46 @@ def extract_aes_key(
     return decrypted_key
 
 
+def decrypt_device_lines(key: bytes, lines: List[bytes]) -> Optional[List[bytes]]:
+    """ Batch version of decrypt_device_line, returns the decrypted lines, or None if any line in
+    the batch is not a well-formed line (the caller must then decrypt the lines individually to
+    get error handling).  A well-formed line has exactly one colon, valid base64 on both sides,
+    a 16 byte iv, and data that is a nonzero multiple of 16 bytes.
+    
+    CBC decryption of a block is the raw (ECB) decryption of the block xor'd with the previous
+    block of ciphertext (the iv for the first block).  So instead of creating a cipher for every
+    line we concatenate the data of all lines and decrypt it in a single ECB call, then xor that
+    with the concatenation of every line's iv plus ciphertext shifted by one block.  The xor is done
+    on big integers, which is a single linear operation in C. """
+    # urlsafe_b64decode is a translate followed by a2b_base64, this is the same operation in bulk.
+    split_lines = [line.translate(URLSAFE_TO_STANDARD_BASE64).split(b":") for line in lines]
+    if not all(len(split_line) == 2 for split_line in split_lines):
+        return None
+    try:
+        ivs = [a2b_base64(iv) for iv, _ in split_lines]
+        datas = [a2b_base64(data) for _, data in split_lines]
+    except base64_error:
+        return None
+    if not all(len(iv) == 16 for iv in ivs) or not all(len(data) >= 16 and len(data) % 16 == 0 for data in datas):
+        return None
+    
+    ciphertext = b"".join(datas)
+    previous_blocks = b"".join([iv + data[:-16] for iv, data in zip(ivs, datas)])
+    decrypted = AES.new(key, mode=AES.MODE_ECB).decrypt(ciphertext)
+    decrypted = (
+        int.from_bytes(decrypted, "big") ^ int.from_bytes(previous_blocks, "big")
+    ).to_bytes(len(ciphertext), "big")
+    
+    # PKCS5 Padding, see decrypt_device_line.
+    ret = []
+    start = 0
+    for data in datas:
+        end = start + len(data)
+        ret.append(decrypted[start:end - decrypted[end - 1]])
+        start = end
+    return ret
+
+
 def decrypt_device_line(patient_id, key, data: bytes) -> bytes:
     """ Config is expected to be 3 colon separated values.
         value 1 is the symmetric key, encrypted with the patient's public key.
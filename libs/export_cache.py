@@ -0,0 +1,237 @@
+import json
+import os
+from hashlib import sha256
+from os.path import join as path_join
+from time import time
+from typing import Dict, Generator, List, Optional
+from uuid import uuid4
+from zipfile import BadZipFile, ZipFile
+
+from django.db.models import Count, Max, QuerySet
+
+from config.settings import EXPORT_CACHE_DIRECTORY, EXPORT_CACHE_MAX_MB
+from libs.streaming_zip import determine_file_name, zip_generator
+
+
+"""
+The export cache keeps the zip files built by the data access api (get_data) on local disk, so that
+repeated downloads of the same data don't retrieve and decrypt every file from S3 again.
+
+An export is identified by its query (study, participants, data streams, time range, and whether it
+includes a registry file).  It is valid while the number of chunks matching the query and the
+latest last_updated of those chunks are unchanged, a valid export is streamed straight from disk.
+A stale export is rebuilt: files whose chunk_hash is unchanged are copied out of the previous zip
+file, only new and changed files are retrieved from S3.
+
+Each export has three files:
+    <key>.export - json, the version of the data in the export and the build (a random id).
+    <key>.<build>.zip - the zip file.
+    <key>.<build>.files - json, {chunk_path: [chunk_hash, file name in the zip]} of every chunk in
+        the zip file.
+A build is written while it streams to the client, and becomes the export when its .export file is
+renamed into place, an interrupted download leaves nothing behind (except for a crashed process,
+see ORPHAN_SECONDS).  The .export files' modification times are the access times of the exports,
+when the cache is over EXPORT_CACHE_MAX_MB the least recently used exports are deleted.
+"""
+
+EXPORT_SUFFIX = ".export"
+ZIP_SUFFIX = ".zip"
+FILES_SUFFIX = ".files"
+TEMPORARY_SUFFIX = ".tmp"
+READ_SIZE = 1024 * 1024
+# builds that are this old and not an export are from a process that crashed mid-build.
+ORPHAN_SECONDS = 24 * 60 * 60
+
+
+class ExportCache:
+
+    def __init__(self, directory: str, max_megabytes: int):
+        self.directory = directory
+        self.max_bytes = max_megabytes * 1024 * 1024
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @staticmethod
+    def key(study_id: int, query_args: dict, construct_registry: bool) -> str:
+        """ A canonical form of a get_data query. """
+        start, end = query_args.get("start"), query_args.get("end")
+        query = {
+            "study_id": study_id,
+            "user_ids": sorted(query_args.get("user_ids") or []),
+            "data_types": sorted(query_args.get("data_types") or []),
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "registry": construct_registry,
+        }
+        return sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def version(chunks: QuerySet) -> List:
+        stats = chunks.aggregate(count=Count("pk"), last_updated=Max("last_updated"))
+        last_updated = stats["last_updated"].isoformat() if stats["last_updated"] else None
+        return [stats["count"], last_updated]
+
+    def stream(
+        self, study_id: int, query_args: dict, chunks: QuerySet, construct_registry: bool
+    ) -> Generator[bytes, None, None]:
+        """ The zip file of a get_data query, from the cache if it is valid. """
+        os.makedirs(self.directory, exist_ok=True)
+        key = self.key(study_id, query_args, construct_registry)
+        version = self.version(chunks)
+        export = self._read_json(self._path(key, EXPORT_SUFFIX))
+
+        if export is not None and export["version"] == version:
+            try:
+                zip_file = open(self._path(key, export["build"], ZIP_SUFFIX), "rb")
+            except FileNotFoundError:
+                pass  # it was replaced or evicted, build it
+            else:
+                os.utime(self._path(key, EXPORT_SUFFIX))
+                with zip_file:
+                    for data in iter(lambda: zip_file.read(READ_SIZE), b""):
+                        yield data
+                return
+
+        yield from self._build(key, version, export, chunks, construct_registry)
+
+    def _build(
+        self, key: str, version: List, previous_export: Optional[dict], chunks: QuerySet,
+        construct_registry: bool
+    ) -> Generator[bytes, None, None]:
+        previous_zip, previous_files = self._open_build(key, previous_export)
+
+        # the files in this build.  Of files with the same name in the zip, the zip_generator keeps
+        # the first one, it is built in a fixed order (ordered=True, ordered by pk) for this.
+        files: Dict[str, List[str]] = {}
+        file_names = set()
+
+        def record(chunks: QuerySet):
+            for chunk in chunks:
+                file_name = determine_file_name(chunk)
+                if file_name not in file_names:
+                    file_names.add(file_name)
+                    files[chunk["chunk_path"]] = [chunk["chunk_hash"], file_name]
+                yield chunk
+
+        def local_contents(chunk: dict) -> Optional[bytes]:
+            previous = previous_files.get(chunk["chunk_path"])
+            if previous is None or previous[0] != chunk["chunk_hash"]:
+                return None
+            try:
+                return previous_zip.read(previous[1])
+            except KeyError:
+                return None
+
+        build = uuid4().hex
+        zip_path = self._path(key, build, ZIP_SUFFIX)
+        files_path = self._path(key, build, FILES_SUFFIX)
+        export_path = self._path(key, EXPORT_SUFFIX)
+        temporary_export_path = self._path(key, build, EXPORT_SUFFIX, TEMPORARY_SUFFIX)
+        complete = False
+        try:
+            with open(zip_path, "wb") as f:
+                for data in zip_generator(
+                    record(chunks.order_by("pk")),
+                    construct_registry=construct_registry,
+                    ordered=True,
+                    local_contents=local_contents if previous_zip else None,
+                ):
+                    f.write(data)
+                    yield data
+
+            with open(files_path, "w") as f:
+                json.dump(files, f)
+            with open(temporary_export_path, "w") as f:
+                json.dump({"version": version, "build": build}, f)
+            os.rename(temporary_export_path, export_path)
+            complete = True
+        finally:
+            if previous_zip:
+                previous_zip.close()
+            if complete and previous_export:
+                self._remove_build(key, previous_export["build"])
+            if not complete:
+                self._remove_build(key, build)
+                self._remove(temporary_export_path)
+
+        self.evict()
+
+    def _open_build(self, key: str, export: Optional[dict]):
+        """ The zip file and files of a previous build, None and {} if there isn't one. """
+        if export is None:
+            return None, {}
+        files = self._read_json(self._path(key, export["build"], FILES_SUFFIX))
+        if files is None:
+            return None, {}
+        try:
+            return ZipFile(self._path(key, export["build"], ZIP_SUFFIX)), files
+        except (FileNotFoundError, BadZipFile):
+            return None, {}
+
+    def evict(self):
+        """ Deletes the least recently used exports until the cache is within its size limit, and
+        deletes orphaned builds. """
+        exports = []
+        current_builds = set()
+        total_size = 0
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(EXPORT_SUFFIX):
+                continue
+            key = file_name[:-len(EXPORT_SUFFIX)]
+            export_path = self._path(key, EXPORT_SUFFIX)
+            export = self._read_json(export_path)
+            if export is None:
+                continue
+            try:
+                last_used = os.path.getmtime(export_path)
+                size = os.path.getsize(self._path(key, export["build"], ZIP_SUFFIX))
+            except FileNotFoundError:
+                continue
+            current_builds.add(f"{key}.{export['build']}")
+            exports.append((last_used, key, export["build"], size))
+            total_size += size
+
+        for _, key, build, size in sorted(exports):
+            if total_size <= self.max_bytes:
+                break
+            self._remove(self._path(key, EXPORT_SUFFIX))
+            self._remove_build(key, build)
+            total_size -= size
+
+        orphan_time = time() - ORPHAN_SECONDS
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(EXPORT_SUFFIX) or file_name.rsplit(".", 1)[0] in current_builds:
+                continue
+            path = path_join(self.directory, file_name)
+            try:
+                if os.path.getmtime(path) < orphan_time:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _path(self, *parts: str) -> str:
+        return path_join(self.directory, ".".join(part.strip(".") for part in parts))
+
+    def _remove_build(self, key: str, build: str):
+        self._remove(self._path(key, build, ZIP_SUFFIX))
+        self._remove(self._path(key, build, FILES_SUFFIX))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_json(path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+EXPORT_CACHE = ExportCache(EXPORT_CACHE_DIRECTORY, EXPORT_CACHE_MAX_MB)
@@ -3,7 +3,6 @@ import traceback
 from typing import Tuple
 
 from database.data_access_models import ChunkRegistry
-from libs.file_processing.utility_functions_simple import decompress
 from libs.s3 import s3_upload
 
 
@@ -13,14 +12,14 @@ from libs.sentry import make_error_sentry, SentryTypes
 
 
 def batch_upload(upload: Tuple[ChunkRegistry or dict, str, bytes, str]):
-    """ Used for mapping an s3_upload function.  the tuple is unpacked, can only have one parameter. """
+    """ Used for mapping an s3_upload function.  the tuple is unpacked, can only have one parameter.
+    On success 'size_change' is the (time bin, data type, change in bytes) of the chunk. """
 
-    ret = {'exception': None, 'traceback': None}
+    ret = {'exception': None, 'traceback': None, 'size_change': None}
     with make_error_sentry(sentry_type=SentryTypes.data_processing):
         try:
             chunk, chunk_path, new_contents, study_object_id = upload
             del upload
-            new_contents = decompress(new_contents)
 
             if "b'" in chunk_path:
                 raise Exception(chunk_path)
@@ -37,10 +36,13 @@ def batch_upload(upload: Tuple[ChunkRegistry or dict, str, bytes, str]):
             # otherwise we are creating a new one.
             if isinstance(chunk, ChunkRegistry):
                 # If the contents are being appended to an existing ChunkRegistry object
+                previous_file_size = chunk.file_size or 0
                 chunk.file_size = len(new_contents)
                 chunk.update_chunk(new_contents)
             else:
-                ChunkRegistry.register_chunked_data(**chunk, file_contents=new_contents)
+                previous_file_size = 0
+                chunk = ChunkRegistry.register_chunked_data(**chunk, file_contents=new_contents)
+            ret['size_change'] = chunk.time_bin, chunk.data_type, chunk.file_size - previous_file_size
 
         # it broke. print stacktrace for debugging
         except Exception as e:
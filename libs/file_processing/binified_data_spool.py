@@ -0,0 +1,124 @@
+import pickle
+from tempfile import TemporaryFile
+from typing import Dict, Generator, List, Tuple
+
+
+# Rough per-object memory costs (64 bit CPython) used to estimate the size of a parsed csv row, a
+# row is a list of bytes objects.  These don't need to be exact, they only need to be consistent.
+LIST_OVERHEAD = 56
+LIST_ITEM_OVERHEAD = 8
+BYTES_OVERHEAD = 33
+
+
+def estimate_row_size(row: List[bytes]) -> int:
+    """ Approximate memory footprint of a single row of csv data. """
+    return LIST_OVERHEAD + (LIST_ITEM_OVERHEAD + BYTES_OVERHEAD) * len(row) + sum(map(len, row))
+
+
+class BinifiedDataSpool:
+    """ Drop-in replacement for the defaultdict of {data_bin: (rows, ftp_pks)} that data
+    processing assembles for a page of files.
+
+    When a memory budget (in bytes) is provided the spool keeps a running estimate of the size of
+    the rows it holds, and when that estimate exceeds the budget the largest bins are pickled out
+    to a single (anonymous) temporary file.  Spilled runs of rows for a bin are merged back
+    together when that bin is consumed via items(), so only one hourly bin needs to be fully
+    materialized at a time.
+
+    Without a budget this behaves exactly like the old defaultdict. """
+
+    def __init__(self, memory_budget: int = None):
+        self.memory_budget = memory_budget or None
+        self.in_memory_size = 0
+        self.peak_in_memory_size = 0
+        self.spilled_bytes = 0
+
+        self._rows: Dict[tuple, List[List[bytes]]] = {}
+        self._ftps: Dict[tuple, List[int]] = {}
+        self._bin_sizes: Dict[tuple, int] = {}
+        # data_bin: list of (offset, length) pairs of pickled runs of rows in the spool file.
+        self._spilled_runs: Dict[tuple, List[Tuple[int, int]]] = {}
+        self._spool_file = None
+
+    def __len__(self):
+        return len(self._ftps)
+
+    def __bool__(self):
+        return bool(self._ftps)
+
+    def __contains__(self, data_bin: tuple):
+        return data_bin in self._ftps
+
+    def add_rows(self, data_bin: tuple, rows: List[List[bytes]], ftp_pk: int):
+        """ Appends the rows from a single file to a bin, spills to disk if over budget. """
+        if data_bin not in self._ftps:
+            self._rows[data_bin] = []
+            self._ftps[data_bin] = []
+            self._bin_sizes[data_bin] = 0
+
+        self._rows[data_bin].extend(rows)
+        self._ftps[data_bin].append(ftp_pk)
+
+        if self.memory_budget is None:
+            return
+
+        size = sum(map(estimate_row_size, rows))
+        self._bin_sizes[data_bin] += size
+        self.in_memory_size += size
+        self.peak_in_memory_size = max(self.peak_in_memory_size, self.in_memory_size)
+
+        if self.in_memory_size > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """ Writes the largest bins out to the spool file until we are under half the budget, this
+        leaves headroom so that we aren't spilling tiny amounts of data on every add_rows call. """
+        if self._spool_file is None:
+            self._spool_file = TemporaryFile()
+
+        target = self.memory_budget // 2
+        for data_bin in sorted(self._bin_sizes, key=self._bin_sizes.get, reverse=True):
+            if self.in_memory_size <= target:
+                break
+            rows = self._rows[data_bin]
+            if not rows:
+                continue
+
+            self._spool_file.seek(0, 2)  # end of file
+            offset = self._spool_file.tell()
+            pickled = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+            self._spool_file.write(pickled)
+            self._spilled_runs.setdefault(data_bin, []).append((offset, len(pickled)))
+            self.spilled_bytes += len(pickled)
+
+            self._rows[data_bin] = []
+            self.in_memory_size -= self._bin_sizes[data_bin]
+            self._bin_sizes[data_bin] = 0
+
+    def _load_spilled_rows(self, data_bin: tuple) -> List[List[bytes]]:
+        rows = []
+        for offset, length in self._spilled_runs.pop(data_bin, ()):
+            self._spool_file.seek(offset)
+            rows.extend(pickle.loads(self._spool_file.read(length)))
+        return rows
+
+    def items(self) -> Generator[Tuple[tuple, Tuple[List[List[bytes]], List[int]]], None, None]:
+        """ Yields (data_bin, (rows, ftp_pks)) like dict.items(), but consumes the spool as it
+        goes, each bin is released as soon as the next one is requested. """
+        for data_bin in list(self._ftps):
+            rows = self._rows.pop(data_bin)
+            if data_bin in self._spilled_runs:
+                # spilled runs are always older than whatever is left in memory.
+                spilled_rows = self._load_spilled_rows(data_bin)
+                spilled_rows.extend(rows)
+                rows = spilled_rows
+
+            self.in_memory_size -= self._bin_sizes.pop(data_bin)
+            yield data_bin, (rows, self._ftps.pop(data_bin))
+
+        self.close()
+
+    def close(self):
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
@@ -0,0 +1,99 @@
+from heapq import merge
+from operator import itemgetter
+from typing import Generator, Iterable, List, Optional, Tuple
+
+
+"""
+Merging new rows into an existing chunk.
+
+The original approach to updating a chunk was to parse the entire chunk into rows, concatenate the
+new rows, sort everything, deduplicate everything, and then join everything back into a csv.  Chunks
+are written already sorted and deduplicated, so most of that work is redundant, and it happens once
+per upload per hour of data, which is quadratic for participants whose phones upload many small
+files per hour.
+
+There are two strategies here, both produce output identical to the original approach:
+- append: when every new row is newer than the last row of the chunk (the common case, recorded
+  as ChunkRegistry.max_timestamp) the new rows are simply joined onto the end of the old file.
+- merge: the old chunk lines are a sorted run, the sorted new rows are another sorted run, they are
+  streamed through a k-way merge.  Duplicate rows always share a timestamp, so deduplication only
+  needs to track the rows of the current timestamp.
+"""
+
+
+def line_timestamp(line: bytes) -> int:
+    return int(line.split(b",", 1)[0])
+
+
+def sorted_run_from_lines(lines: List[bytes]) -> Optional[List[Tuple[int, bytes]]]:
+    """ Returns a list of (timestamp, line) pairs, or None if the lines are not sorted by timestamp
+    or contain a row without an integer timestamp (e.g. chunks from ancient versions of the code),
+    in which case the caller must use the full re-sort. """
+    run = []
+    previous_timestamp = None
+    for line in lines:
+        try:
+            timestamp = line_timestamp(line)
+        except ValueError:
+            return None
+        if previous_timestamp is not None and timestamp < previous_timestamp:
+            return None
+        previous_timestamp = timestamp
+        run.append((timestamp, line))
+    return run
+
+
+def sorted_run_from_rows(sorted_rows: List[List[bytes]]) -> List[Tuple[int, bytes]]:
+    """ Rows must already be sorted by timestamp (e.g. by ensure_sorted_by_timestamp). """
+    return [(int(row[0]), b",".join(row)) for row in sorted_rows]
+
+
+def merge_sorted_runs(*runs: Iterable[Tuple[int, bytes]]) -> Generator[bytes, None, None]:
+    """ k-way merge of runs of (timestamp, line) pairs, yields deduplicated lines.  Ties are yielded
+    in the order the runs were provided, which matches a stable sort of the concatenated runs. """
+    current_timestamp = None
+    seen_lines = set()
+    for timestamp, line in merge(*runs, key=itemgetter(0)):
+        if timestamp != current_timestamp:
+            current_timestamp = timestamp
+            seen_lines.clear()
+        if line not in seen_lines:
+            seen_lines.add(line)
+            yield line
+
+
+def deduplicated_lines(sorted_rows: List[List[bytes]]) -> List[bytes]:
+    return list(merge_sorted_runs(sorted_run_from_rows(sorted_rows)))
+
+
+def chunk_header(chunk_contents: bytes) -> bytes:
+    newline_index = chunk_contents.find(b"\n")
+    return chunk_contents if newline_index == -1 else chunk_contents[:newline_index]
+
+
+def append_to_chunk(
+    chunk_contents: bytes, max_timestamp: Optional[int], sorted_rows: List[List[bytes]]
+) -> Optional[Tuple[bytes, int]]:
+    """ The append strategy.  Returns the new chunk contents and its max timestamp, or None if the
+    rows are not all newer than the chunk's max timestamp. """
+    if max_timestamp is None or not sorted_rows or int(sorted_rows[0][0]) <= max_timestamp:
+        return None
+    new_lines = deduplicated_lines(sorted_rows)
+    return chunk_contents + b"\n" + b"\n".join(new_lines), int(sorted_rows[-1][0])
+
+
+def merge_into_chunk(
+    chunk_contents: bytes, sorted_rows: List[List[bytes]]
+) -> Optional[Tuple[bytes, Optional[int]]]:
+    """ The merge strategy.  Returns the new chunk contents and its max timestamp, or None if the
+    existing chunk is not a sorted run of rows. """
+    header, *old_lines = chunk_contents.split(b"\n")
+    old_run = sorted_run_from_lines(old_lines)
+    if old_run is None:
+        return None
+    new_run = sorted_run_from_rows(sorted_rows)
+
+    merged_lines = list(merge_sorted_runs(old_run, new_run))
+    last_timestamps = [run[-1][0] for run in (old_run, new_run) if run]
+    max_timestamp = max(last_timestamps) if last_timestamps else None
+    return header + b"\n" + b"\n".join(merged_lines), max_timestamp
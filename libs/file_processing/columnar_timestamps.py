@@ -0,0 +1,169 @@
+from collections import defaultdict
+from typing import DefaultDict, List, Optional
+
+from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM
+from libs.file_processing.utility_functions_csvs import unix_time_to_string
+from libs.file_processing.utility_functions_simple import (
+    convert_unix_to_human_readable_timestamps, ensure_sorted_by_timestamp)
+
+# Numpy is present on data processing servers (it is a dependency of Forest), but not necessarily
+# on frontend servers.  Everything in this file has a pure-python equivalent that is used when
+# numpy is unavailable or when the columnar path declines to handle some input.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNAR_ENABLED = numpy is not None
+
+
+"""
+Columnar versions of the per-row timestamp operations performed on chunkable data.  The timestamp
+column of a list of rows is parsed into an int64 array in one pass, and then binning, sorting, and
+"UTC time" column generation operate on that array.
+
+Output of every function here is identical to its row-at-a-time counterpart.  To guarantee that we
+only take the fast path when every timestamp in the column is a string of ascii digits of the same
+length (e.g. 13 digit unix millisecond timestamps) that fits in an int64, anything else (negative
+numbers, whitespace, junk bytes, a mix of lengths) returns None and the caller falls back to the
+original python code, which has the established error handling behavior.
+"""
+
+# below this many rows numpy overhead is larger than the savings.
+COLUMNAR_MIN_ROWS = 256
+
+# int64 holds any 18 digit number
+MAX_TIMESTAMP_DIGITS = 18
+
+MILLISECOND_SUFFIXES = [b".%03d" % i for i in range(1000)]
+
+NEWLINE = ord(b"\n")
+ZERO = ord(b"0")
+
+
+def columnar_available(rows: list) -> bool:
+    return COLUMNAR_ENABLED and len(rows) >= COLUMNAR_MIN_ROWS
+
+
+def parse_timestamp_digits(rows: List[List[bytes]]) -> Optional["numpy.ndarray"]:
+    """ Returns the first column of the rows as an (rows x digits) uint8 array of digit values, or
+    None if any value in that column is not an ascii digit string of the same length as the first.
+
+    The column is joined into one buffer with a newline after every value and then viewed as a
+    matrix, if any value had a different length the newlines would not line up in the last column
+    of the matrix, and either a newline or a digit would end up in the wrong place. """
+    first_value = rows[0][0]
+    width = len(first_value)
+    if width == 0 or width > MAX_TIMESTAMP_DIGITS:
+        return None
+
+    buffer = b"\n".join([row[0] for row in rows]) + b"\n"
+    if len(buffer) != len(rows) * (width + 1):
+        return None
+
+    matrix = numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(len(rows), width + 1)
+    if not (matrix[:, width] == NEWLINE).all():
+        return None
+    # uint8 subtraction wraps around, so any non-digit character ends up greater than 9.
+    digits = matrix[:, :width] - ZERO
+    if not (digits <= 9).all():
+        return None
+    return digits
+
+
+def digits_to_int64(digits: "numpy.ndarray") -> "numpy.ndarray":
+    """ Converts a matrix of digit values to an array of integers, one column at a time. """
+    values = numpy.zeros(digits.shape[0], dtype=numpy.int64)
+    for column in range(digits.shape[1]):
+        values *= 10
+        values += digits[:, column]
+    return values
+
+
+def binify_rows_columnar(
+    rows: List[List[bytes]], study_id: str, user_id: str, data_type: str, header: bytes
+) -> Optional[DefaultDict[tuple, list]]:
+    """ Columnar binify_csv_rows.  Returns None if the fast path does not apply. """
+    # the original code skips rows with an empty first column (e.g. a trailing newline).
+    rows = [row for row in rows if row and row[0]]
+    if not columnar_available(rows):
+        return None
+    digits = parse_timestamp_digits(rows)
+    if digits is None:
+        return None
+
+    # clean_java_timecode uses the first 10 characters of the timecode.
+    time_bins = digits_to_int64(digits[:, :10]) // CHUNK_TIMESLICE_QUANTUM
+
+    ret = defaultdict(list)
+    unique_bins, first_indexes, bin_of_row = numpy.unique(
+        time_bins, return_index=True, return_inverse=True
+    )
+    if len(unique_bins) == 1:
+        ret[(study_id, user_id, data_type, int(unique_bins[0]), header)] = rows
+        return ret
+
+    # a stable sort on the bin of each row groups rows by bin while retaining their file order.
+    rows_by_bin = numpy.argsort(bin_of_row, kind="stable").tolist()
+    bin_ends = numpy.cumsum(numpy.bincount(bin_of_row)).tolist()
+
+    # insert bins in the order they first appear in the file, like the original code.
+    for bin_index in numpy.argsort(first_indexes, kind="stable").tolist():
+        bin_start = bin_ends[bin_index - 1] if bin_index > 0 else 0
+        ret[(study_id, user_id, data_type, int(unique_bins[bin_index]), header)] = \
+            [rows[i] for i in rows_by_bin[bin_start:bin_ends[bin_index]]]
+    return ret
+
+
+def sort_rows_columnar(rows: List[List[bytes]]) -> bool:
+    """ Columnar ensure_sorted_by_timestamp, sorts in place with a stable sort.
+    Returns False if the fast path does not apply and the list was not modified. """
+    if not columnar_available(rows):
+        return False
+    digits = parse_timestamp_digits(rows)
+    if digits is None:
+        return False
+
+    order = numpy.argsort(digits_to_int64(digits), kind="stable")
+    rows[:] = [rows[i] for i in order.tolist()]
+    return True
+
+
+def add_human_readable_timestamps_columnar(header: bytes, rows: List[List[bytes]]) -> Optional[bytes]:
+    """ Columnar convert_unix_to_human_readable_timestamps.  Returns the updated header, or None if
+    the fast path does not apply and the rows were not modified. """
+    if not columnar_available(rows):
+        return None
+    digits = parse_timestamp_digits(rows)
+    if digits is None:
+        return None
+
+    unix_milliseconds = digits_to_int64(digits)
+    # Data is dense in time, so there are vastly fewer distinct seconds than rows.  Format each
+    # second once, then the per-row work is a lookup and a concatenation.
+    unique_seconds, second_of_row = numpy.unique(unix_milliseconds // 1000, return_inverse=True)
+    second_strings = [unix_time_to_string(second) for second in unique_seconds.tolist()]
+
+    for row, second_index, millisecond in zip(
+        rows, second_of_row.tolist(), (unix_milliseconds % 1000).tolist()
+    ):
+        row.insert(1, second_strings[second_index] + MILLISECOND_SUFFIXES[millisecond])
+
+    header = header.split(b",")
+    header.insert(1, b"UTC time")
+    return b",".join(header)
+
+
+def sort_by_timestamp(rows: List[List[bytes]]):
+    """ Drop-in for ensure_sorted_by_timestamp, uses the columnar path where possible. """
+    if not sort_rows_columnar(rows):
+        ensure_sorted_by_timestamp(rows)
+
+
+def add_human_readable_timestamps(header: bytes, rows: List[List[bytes]]) -> bytes:
+    """ Drop-in for convert_unix_to_human_readable_timestamps, uses the columnar path where
+    possible. """
+    updated_header = add_human_readable_timestamps_columnar(header, rows)
+    if updated_header is None:
+        return convert_unix_to_human_readable_timestamps(header, rows)
+    return updated_header
@@ -1,13 +1,13 @@
 from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import date, datetime, timedelta
+from typing import DefaultDict, Dict, Tuple
 
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from pytz import utc
 
-from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM
 from constants.data_stream_constants import ALL_DATA_STREAMS
-from database.data_access_models import ChunkRegistry
+from database.data_access_models import UNIX_EPOCH, ChunkRegistry, DataExtent
 from database.tableau_api_models import SummaryStatisticDaily
 from database.user_models import Participant
 
@@ -29,40 +29,93 @@ def populate_data_quantity(chunkregistry_query: QuerySet,
     return daily_data_quantities
 
 
-def calculate_data_quantity_stats(
-        participant: Participant,
-        earliest_time_bin_number: Optional[int] = None,
-        latest_time_bin_number: Optional[int] = None,
-):
-    """ Update the SummaryStatisticDaily  stats for a participant, using ChunkRegistry data
-    earliest_time_bin_number -- expressed in hours since 1/1/1970
-    latest_time_bin_number -- expressed in hours since 1/1/1970 """
+def daily_bytes_fields(day_data: Dict[str, int]) -> Dict[str, int]:
+    """ The SummaryStatisticDaily fields of a day of {data type: total bytes}. """
+    return {
+        f"beiwe_{data_type}_bytes": total_bytes
+        for data_type, total_bytes in day_data.items() if data_type in ALL_DATA_STREAMS
+    }
+
+
+class DataQuantityDeltas:
+    """ Accumulates the changes in the sizes of a participant's chunks as data processing creates
+    and resizes them, by (study-local date, data type), and applies them to SummaryStatisticDaily
+    as increments.  This keeps the data quantity statistics exact without re-reading the registry,
+    reconcile_data_quantity_stats verifies them against it.  The first and last time bins of the
+    chunks are applied to the participant's DataExtents. """
+    
+    def __init__(self, participant: Participant):
+        self.participant_id = participant.pk
+        self.study_id = participant.study_id
+        self.study_timezone = participant.study.timezone
+        self.deltas: DefaultDict[Tuple[date, str], int] = defaultdict(int)
+        self.extents: Dict[str, Tuple[datetime, datetime]] = {}
+    
+    def add(self, time_bin: datetime, data_type: str, size_change: int):
+        if time_bin > UNIX_EPOCH:
+            first_time_bin, last_time_bin = self.extents.get(data_type, (time_bin, time_bin))
+            self.extents[data_type] = min(first_time_bin, time_bin), max(last_time_bin, time_bin)
+        if size_change and data_type in ALL_DATA_STREAMS:
+            self.deltas[(time_bin.astimezone(self.study_timezone).date(), data_type)] += size_change
+    
+    def apply(self):
+        """ Adds the accumulated changes to the statistics and extents, in one query per batch. """
+        daily_changes = defaultdict(dict)
+        for (day, data_type), size_change in self.deltas.items():
+            if size_change:
+                daily_changes[day][f"beiwe_{data_type}_bytes"] = size_change
+        SummaryStatisticDaily.bulk_upsert_statistics(
+            ((self.participant_id, day, changes) for day, changes in daily_changes.items()),
+            increment=True,
+        )
+        DataExtent.record(self.study_id, self.participant_id, self.extents)
+        self.deltas.clear()
+        self.extents.clear()
+
+
+def reconcile_data_quantity_stats(participant: Participant, since: datetime) -> int:
+    """ Verifies the data quantity statistics of every day with chunks registered or updated since
+    the provided time against ChunkRegistry, and corrects those that differ.  Returns the number of
+    corrected days. """
     study_timezone = participant.study.timezone
-    query = ChunkRegistry.objects.filter(participant=participant)
+    chunks = ChunkRegistry.objects.filter(participant=participant)
+    days = {
+        time_bin.astimezone(study_timezone).date() for time_bin in
+        chunks.filter(last_updated__gte=since).order_by().values_list("time_bin", flat=True).distinct()
+    }
+    if not days:
+        return 0
     
-    # Filter by date range
-    if earliest_time_bin_number is not None:
-        start_datetime = datetime.utcfromtimestamp(earliest_time_bin_number * CHUNK_TIMESLICE_QUANTUM)
-        # Round down to the beginning of the included day, in the study's timezone
-        start_date = start_datetime.astimezone(study_timezone).date()
-        query = query.filter(time_bin__gte=utc_datetime_of_local_midnight_date(start_date, study_timezone))
-    if latest_time_bin_number is not None:
-        end_datetime = datetime.utcfromtimestamp(latest_time_bin_number * CHUNK_TIMESLICE_QUANTUM)
-        # Round up to the beginning of the next day, in the study's timezone
-        end_date = end_datetime.astimezone(study_timezone).date() + timedelta(days=1)
-        query = query.filter(time_bin__lt=utc_datetime_of_local_midnight_date(end_date, study_timezone))
+    # the expected statistics, from the registry, of those days (not of the range between them, a
+    # late file from months ago shouldn't make this read months of chunks)...
+    day_ranges = Q()
+    for day in days:
+        day_ranges |= Q(
+            time_bin__gte=utc_datetime_of_local_midnight_date(day, study_timezone),
+            time_bin__lt=utc_datetime_of_local_midnight_date(day + timedelta(days=1), study_timezone),
+        )
+    expected = populate_data_quantity(chunks.filter(day_ranges), study_timezone)
+    # ... compared to the stored statistics of those days.
+    fields = [f"beiwe_{data_type}_bytes" for data_type in ALL_DATA_STREAMS]
+    stored = {
+        values[0]: dict(zip(fields, values[1:])) for values in
+        SummaryStatisticDaily.objects.filter(participant=participant, date__in=days)
+            .values_list("date", *fields)
+    }
     
-    # For each date, create a DataQuantity object
-    for day, day_data in populate_data_quantity(query, study_timezone).items():
-        data_quantity = {
-            "participant": participant,
-            "date": day,
-            "defaults": {}
+    corrections = []
+    for day in days:
+        expected_fields = daily_bytes_fields(expected.get(day, {}))
+        stored_fields = stored.get(day, {})
+        differences = {
+            field: expected_fields.get(field) for field in fields
+            if expected_fields.get(field) != stored_fields.get(field)
         }
-        for data_type, total_bytes in day_data.items():
-            if data_type in ALL_DATA_STREAMS:
-                data_quantity["defaults"][f"beiwe_{data_type}_bytes"] = total_bytes
-        SummaryStatisticDaily.objects.update_or_create(**data_quantity)
+        if differences:
+            corrections.append((participant.pk, day, differences))
+    
+    SummaryStatisticDaily.bulk_upsert_statistics(corrections)
+    return len(corrections)
 
 
 def utc_datetime_of_local_midnight_date(local_date, local_timezone):
@@ -1,12 +1,13 @@
 from collections import defaultdict
 from datetime import datetime
-from multiprocessing.pool import ThreadPool
+from time import perf_counter
 from typing import DefaultDict
 
 from cronutils.error_handler import ErrorHandler
-from django.core.exceptions import ValidationError
+from django.utils import timezone
 
-from config.settings import CONCURRENT_NETWORK_OPS, FILE_PROCESS_PAGE_SIZE
+from config.settings import (FILE_PROCESS_DOWNLOAD_CONCURRENCY, FILE_PROCESS_MEMORY_BUDGET_MB,
+    FILE_PROCESS_PAGE_SIZE, FILE_PROCESS_UPLOAD_CONCURRENCY)
 from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM, CHUNKS_FOLDER
 from constants.data_stream_constants import (ACCELEROMETER, ANDROID_LOG_FILE, CALL_LOG, IDENTIFIERS,
     SURVEY_DATA_FILES, SURVEY_TIMINGS, WIFI)
@@ -14,11 +15,14 @@ from database.data_access_models import ChunkRegistry, FileToProcess
 from database.system_models import FileProcessLock
 from database.user_models import Participant
 from libs.file_processing.batched_network_operations import batch_upload
+from libs.file_processing.binified_data_spool import BinifiedDataSpool
+from libs.file_processing.columnar_timestamps import binify_rows_columnar, COLUMNAR_ENABLED
 from libs.file_processing.data_fixes import (fix_app_log_file, fix_call_log_csv, fix_identifier_csv,
     fix_survey_timings, fix_wifi_csv)
-from libs.file_processing.data_qty_stats import calculate_data_quantity_stats
+from libs.file_processing.data_qty_stats import DataQuantityDeltas
 from libs.file_processing.exceptions import BadTimecodeError, ProcessingOverlapError
 from libs.file_processing.file_for_processing import FileForProcessing
+from libs.file_processing.pipeline_stages import bounded_imap, StageStats
 from libs.file_processing.uploader import PrepareDataForeUpload
 from libs.file_processing.utility_functions_csvs import (clean_java_timecode, csv_to_list,
     unix_time_to_string)
@@ -28,15 +32,9 @@ from libs.file_processing.utility_functions_simple import (binify_from_timecode,
 
 """########################## Hourly Update Tasks ###########################"""
 
-# This is useful for testing and profiling behavior. Replaces the imported threadpool with this
-# dummy class and poof! Single-threaded so the "threaded" network operations have real stack traces!
-# class ThreadPool():
-#     def map(self, *args, **kwargs):
-#         # cut off any threadpool kwargs, which is conveniently easy because map does not use kwargs!
-#         return map(*args)
-#     def terminate(self): pass
-#     def close(self): pass
-#     def __init__(self, *args,**kwargs): pass
+# For testing and profiling behavior set FILE_PROCESS_DOWNLOAD_CONCURRENCY,
+# FILE_PROCESS_MERGE_CONCURRENCY, and FILE_PROCESS_UPLOAD_CONCURRENCY to 1, each pipeline stage then
+# runs one item at a time (exceptions from pipeline threads are re-raised with their stack traces).
 
 
 def process_file_chunks():
@@ -110,13 +108,10 @@ def do_process_user_file_chunks(
     (some conflicts can be most easily resolved by just delaying a file until the next processing
     period, and it solves )
     """
-    # Declare a defaultdict of a tuple of 2 lists
-    all_binified_data = defaultdict(lambda: ([], []))
+    # A mapping of data bins to a tuple of 2 lists (rows, ftp pks), parsed rows will be spilled to
+    # disk if they exceed the memory budget.
+    all_binified_data = BinifiedDataSpool(FILE_PROCESS_MEMORY_BUDGET_MB * 1024 * 1024)
     ftps_to_remove = set()
-    # The ThreadPool enables downloading multiple files simultaneously from the network, and continuing
-    # to download files as other files are being processed, making the code as a whole run faster.
-    # In principle we could make a global pool that is free-memory aware.
-    pool = ThreadPool(CONCURRENT_NETWORK_OPS)
     survey_id_dict = {}
     
     # A Django query with a slice (e.g. .all()[x:y]) makes a LIMIT query, so it
@@ -131,32 +126,42 @@ def do_process_user_file_chunks(
     files_to_process = participant.files_to_process \
         .exclude(deleted=True)  #.order_by("s3_file_path", "created_on")
     
-    # This pool pulls in data for each FileForProcessing on a background thread and instantiates it.
-    # Instantiating a FileForProcessing object queries S3 for the File's data. (network request))
-    files_for_processing = pool.map(
-        FileForProcessing, files_to_process[position: position + page_size], chunksize=1
+    # The download stage pulls in data for each FileForProcessing on background threads and
+    # instantiates it. Instantiating a FileForProcessing object queries S3 for the File's data.
+    # (network request)  Files are parsed on this thread as they arrive, while later files are still
+    # downloading, making the code as a whole run faster.
+    download_stats = StageStats("download", FILE_PROCESS_DOWNLOAD_CONCURRENCY)
+    parse_stats = StageStats("parse")
+    files_for_processing = bounded_imap(
+        FileForProcessing, files_to_process[position: position + page_size], download_stats
     )
     
-    for file_for_processing in files_for_processing:
-        with error_handler:
-            process_one_file(
-                file_for_processing, survey_id_dict, all_binified_data, ftps_to_remove
-            )
-    pool.close()
-    pool.terminate()
+    # the changes in the sizes of the participant's chunks, applied to the data quantity stats even
+    # if something fails part way through, whatever was registered has been counted.
+    data_quantity_deltas = DataQuantityDeltas(participant)
+    try:
+        for file_for_processing in files_for_processing:
+            t_start = perf_counter()
+            with error_handler:
+                process_one_file(
+                    file_for_processing, survey_id_dict, all_binified_data, ftps_to_remove,
+                    data_quantity_deltas,
+                )
+            parse_stats.record(perf_counter() - t_start)
+        
+        # there are several failure modes and success modes, information for what to do with
+        # different files percolates back to here.  Delete various database objects accordingly.
+        more_ftps_to_remove, number_bad_files = upload_binified_data(
+            all_binified_data, error_handler, survey_id_dict, data_quantity_deltas, download_stats,
+            parse_stats
+        )
+    finally:
+        data_quantity_deltas.apply()
     
-    # there are several failure modes and success modes, information for what to do with different
-    # files percolates back to here.  Delete various database objects accordingly.
-    more_ftps_to_remove, number_bad_files, earliest_time_bin, latest_time_bin = upload_binified_data(
-        all_binified_data, error_handler, survey_id_dict
-    )
     ftps_to_remove.update(more_ftps_to_remove)
-    
-    # Update the data quantity stats, if it actually processed any files
-    if len(files_to_process) > 0:
-        calculate_data_quantity_stats(participant,
-                                      earliest_time_bin_number=earliest_time_bin,
-                                      latest_time_bin_number=latest_time_bin)
+    if all_binified_data.spilled_bytes:
+        print(f"spilled {all_binified_data.spilled_bytes} bytes of binned data to disk, peak "
+              f"in-memory estimate was {all_binified_data.peak_in_memory_size} bytes.")
     
     # Actually delete the processed FTPs from the database
     FileToProcess.objects.filter(pk__in=ftps_to_remove).delete()
@@ -164,8 +169,9 @@ def do_process_user_file_chunks(
 
 
 def process_one_file(
-        file_for_processing: FileForProcessing, survey_id_dict: dict, all_binified_data: DefaultDict,
-        ftps_to_remove: set
+        file_for_processing: FileForProcessing, survey_id_dict: dict,
+        all_binified_data: BinifiedDataSpool, ftps_to_remove: set,
+        data_quantity_deltas: DataQuantityDeltas
 ):
     """ This function is the inner loop of the chunking process. """
     
@@ -177,12 +183,12 @@ def process_one_file(
     if file_for_processing.chunkable:
         process_chunkable_file(file_for_processing, survey_id_dict, all_binified_data, ftps_to_remove)
     else:
-        process_unchunkable_file(file_for_processing, ftps_to_remove)
+        process_unchunkable_file(file_for_processing, ftps_to_remove, data_quantity_deltas)
 
 
 def process_chunkable_file(
-    file_for_processing: FileForProcessing, survey_id_dict: dict, all_binified_data: DefaultDict,
-    ftps_to_remove: set
+    file_for_processing: FileForProcessing, survey_id_dict: dict,
+    all_binified_data: BinifiedDataSpool, ftps_to_remove: set
 ):
     newly_binified_data, survey_id_hash = process_csv_data(file_for_processing)
     
@@ -199,70 +205,58 @@ def process_chunkable_file(
         ftps_to_remove.add(file_for_processing.file_to_process.id)
 
 
-def process_unchunkable_file(file_for_processing: FileForProcessing, ftps_to_remove: set):
+def process_unchunkable_file(
+    file_for_processing: FileForProcessing, ftps_to_remove: set,
+    data_quantity_deltas: DataQuantityDeltas
+):
     # case: unchunkable data file
     timestamp = clean_java_timecode(
         file_for_processing.file_to_process.s3_file_path.rsplit("/", 1)[-1][:-4]
     )
     # Since we aren't binning the data by hour, just create a ChunkRegistry that
-    # points to the already existing S3 file.
-    try:
-        ChunkRegistry.register_unchunked_data(
-            file_for_processing.data_type,
-            timestamp,
-            file_for_processing.file_to_process.s3_file_path,
-            file_for_processing.file_to_process.study.pk,
-            file_for_processing.file_to_process.participant.pk,
-            file_for_processing.file_contents,
-        )
-        ftps_to_remove.add(file_for_processing.file_to_process.id)
-    except ValidationError as ve:
-        if len(ve.messages) != 1:
-            # case: the error case (below) is very specific, we only want that singular error.
-            raise
-        
-        # case: an unchunkable file was re-uploaded, causing a duplicate file path collision
-        # we detect this specific case and update the registry with the new file size
-        # (hopefully it doesn't actually change)
-        if 'Chunk registry with this Chunk path already exists.' in ve.messages:
-            ChunkRegistry.update_registered_unchunked_data(
-                file_for_processing.data_type,
-                file_for_processing.file_to_process.s3_file_path,
-                file_for_processing.file_contents,
-            )
-            ftps_to_remove.add(file_for_processing.file_to_process.id)
-        else:
-            # any other errors, add
-            raise
+    # points to the already existing S3 file.  (If an unchunkable file was re-uploaded the existing
+    # registry is updated with the new file size, hopefully it doesn't actually change.)
+    size_change = ChunkRegistry.register_unchunked_data(
+        file_for_processing.data_type,
+        timestamp,
+        file_for_processing.file_to_process.s3_file_path,
+        file_for_processing.file_to_process.study.pk,
+        file_for_processing.file_to_process.participant.pk,
+        file_for_processing.file_contents,
+    )
+    data_quantity_deltas.add(
+        timezone.make_aware(datetime.utcfromtimestamp(timestamp), timezone.utc),
+        file_for_processing.data_type,
+        size_change,
+    )
+    ftps_to_remove.add(file_for_processing.file_to_process.id)
 
 
 
 
-def upload_binified_data(binified_data, error_handler, survey_id_dict):
+def upload_binified_data(
+    binified_data, error_handler, survey_id_dict, data_quantity_deltas: DataQuantityDeltas,
+    *previous_stages: StageStats
+):
     """ Takes in binified csv data and handles uploading/downloading+updating
         older data to/from S3 for each chunk.
+        Adds the changes in the sizes of the chunks to data_quantity_deltas.
         Returns a set of concatenations that have succeeded and can be removed.
         Returns the number of failed FTPS so that we don't retry them.
-        Returns the earliest and latest time bins handled
         Raises any errors on the passed in ErrorHandler."""
-    # failed_ftps = set([])
-    # ftps_to_retire = set([])
-    # upload_these = []
-    
-    # # Track the earliest and latest time bins, to return them at the end of the function
-    # earliest_time_bin = None
-    # latest_time_bin = None
     uploads = PrepareDataForeUpload(binified_data, error_handler, survey_id_dict)
     
-    pool = ThreadPool(CONCURRENT_NETWORK_OPS)
-    errors = pool.map(batch_upload, uploads.upload_these, chunksize=1)
-    for err_ret in errors:
+    # chunks are uploaded as they are prepared, while later chunks are still being merged.
+    upload_stats = StageStats("upload", FILE_PROCESS_UPLOAD_CONCURRENCY)
+    for err_ret in bounded_imap(batch_upload, uploads.iterate(), upload_stats):
         if err_ret['exception']:
             print(err_ret['traceback'])
             raise err_ret['exception']
+        data_quantity_deltas.add(*err_ret['size_change'])
+    
+    for stage in (*previous_stages, uploads.merge_stats, upload_stats):
+        print(stage.report())
     
-    pool.close()
-    pool.terminate()
     # The things in ftps to retire that are not in failed ftps.
     # len(failed_ftps) will become the number of files to skip in the next iteration.
     return uploads.get_retirees()
@@ -275,6 +269,15 @@ def binify_csv_rows(rows_list: list, study_id: str, user_id: str, data_type: str
         Sorts data points into the appropriate bin based on the rounded down hour
         value of the entry's unix(ish) timestamp. (based CHUNK_TIMESLICE_QUANTUM)
         Returns a dict of form {(study_id, user_id, data_type, time_bin, header):rows_lists}. """
+    if COLUMNAR_ENABLED:
+        # the columnar path needs the whole timestamp column at once, materializing a generator
+        # here costs no more memory than the returned dict already requires.
+        if not isinstance(rows_list, list):
+            rows_list = list(rows_list)
+        ret = binify_rows_columnar(rows_list, study_id, user_id, data_type, header)
+        if ret is not None:
+            return ret
+    
     ret = defaultdict(list)
     for row in rows_list:
         # discovered August 7 2017, looks like there was an empty line at the end
@@ -288,14 +291,14 @@ def binify_csv_rows(rows_list: list, study_id: str, user_id: str, data_type: str
             ret[(study_id, user_id, data_type, timecode, header)].append(row)
     return ret
 
-def append_binified_csvs(old_binified_rows: DefaultDict[tuple, list],
+def append_binified_csvs(old_binified_rows: BinifiedDataSpool,
                          new_binified_rows: DefaultDict[tuple, list],
                          file_for_processing:  FileToProcess):
     """ Appends binified rows to an existing binified row data structure.
         Should be in-place. """
     for data_bin, rows in new_binified_rows.items():
-        old_binified_rows[data_bin][0].extend(rows)  # Add data rows
-        old_binified_rows[data_bin][1].append(file_for_processing.pk)  # Add ftp
+        # Add data rows and ftp, may spill older rows to disk.
+        old_binified_rows.add_rows(data_bin, rows, file_for_processing.pk)
 
 
 # TODO: stick on FileForProcessing
@@ -0,0 +1,98 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Generator, Iterable, Optional
+
+
+"""
+File processing runs as a pipeline of stages: download -> parse/bin -> merge -> upload.
+
+The network stages (download, merge, upload) run on their own thread pools, each with a bounded
+number of items in flight.  A stage pulls its input lazily from the previous stage, so parsing
+proceeds while files are still downloading, and chunks are uploaded while later chunks are still
+being merged.  The bound on items in flight is the queue between two stages, it keeps a fast
+stage from racing ahead and holding an entire page of files (or chunks) in memory.
+
+Parsing and binning is CPU bound python and runs on the processing thread.
+"""
+
+
+class StageStats:
+    """ Throughput and queue depth of one pipeline stage.  Queue depth is sampled every time the
+    next stage takes an item, it is the number of finished items waiting to be taken. """
+
+    def __init__(self, name: str, concurrency: int = 1):
+        self.name = name
+        self.concurrency = concurrency
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.depth_max = 0
+        self._lock = Lock()
+
+    def timed(self, function: Callable) -> Callable:
+        """ Wraps a function so that its calls are counted as work done by this stage. """
+        def wrapper(*args, **kwargs):
+            t_start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(perf_counter() - t_start)
+        return wrapper
+
+    def record(self, seconds: float):
+        with self._lock:
+            now = perf_counter()
+            if self.started is None:
+                self.started = now - seconds
+            self.finished = now
+            self.items += 1
+            self.busy_seconds += seconds
+
+    def sample_depth(self, depth: int):
+        self.depth_samples += 1
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def report(self) -> str:
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        throughput = self.items / elapsed if elapsed else 0.0
+        mean_depth = self.depth_total / self.depth_samples if self.depth_samples else 0.0
+        return (
+            f"{self.name}: {self.items} items in {elapsed:.2f}s ({throughput:.1f}/s) on "
+            f"{self.concurrency} thread(s), {self.busy_seconds:.2f}s busy, "
+            f"queue depth mean {mean_depth:.1f} max {self.depth_max}"
+        )
+
+
+def bounded_imap(
+    function: Callable, iterable: Iterable, stats: StageStats, max_pending: int = None
+) -> Generator[Any, None, None]:
+    """ Like ThreadPool.imap, but with at most max_pending items submitted and not yet consumed, and
+    with the input iterable consumed lazily on the calling thread.  Results are yielded in input
+    order, an exception raised by function is raised here when its result is reached. """
+    max_pending = max_pending or stats.concurrency * 2
+    timed_function = stats.timed(function)
+    pending = deque()
+
+    with ThreadPoolExecutor(stats.concurrency) as executor:
+        try:
+            for item in iterable:
+                pending.append(executor.submit(timed_function, item))
+                if len(pending) >= max_pending:
+                    yield _next_result(pending, stats)
+            while pending:
+                yield _next_result(pending, stats)
+        finally:
+            # the consumer stopped early (probably an exception), don't start anything new.
+            for future in pending:
+                future.cancel()
+
+
+def _next_result(pending: deque, stats: StageStats) -> Any:
+    stats.sample_depth(sum(1 for future in pending if future.done()))
+    return pending.popleft().result()
@@ -0,0 +1,87 @@
+from time import perf_counter
+from typing import Dict, Iterable, List, Tuple
+
+from config.settings import CONCURRENT_NETWORK_OPS
+from database.data_access_models import FileToProcess
+from database.user_models import Participant
+from libs.file_processing.pipeline_stages import bounded_imap, StageStats
+
+
+"""
+Repair scripts re-queue the original files of chunks for processing, often thousands of chunks (see
+FileToProcess.reprocess_originals_from_chunk_path for one chunk).  Finding the files of a chunk is
+an S3 listing, the listings run concurrently on a bounded thread pool, and the FileToProcess entries
+are created in batches on the calling thread.
+"""
+
+
+class ReprocessOriginals:
+    """ Re-queues the original files of chunks for processing, reporting progress and throughput as
+    it goes.  Chunks without any original files are collected in not_found. """
+
+    def __init__(self, concurrency: int = CONCURRENT_NETWORK_OPS, batch_size: int = 1000):
+        self.listing_stats = StageStats("list", concurrency)
+        self.batch_size = batch_size
+        self.participants: Dict[str, Participant] = {}
+        # {file path: patient id}, the windows of adjacent chunks overlap.
+        self.pending: Dict[str, str] = {}
+        self.chunk_count = 0
+        self.new_file_count = 0
+        self.queued_file_count = 0
+        self.not_found: List[str] = []
+
+    def run(self, chunk_paths: Iterable[str], progress_every: int = 1000):
+        t_start = perf_counter()
+        for chunk_path, patient_id, file_paths in bounded_imap(
+            self.find_original_files, chunk_paths, self.listing_stats
+        ):
+            self.chunk_count += 1
+            if not file_paths:
+                self.not_found.append(chunk_path)
+            self.pending.update((file_path, patient_id) for file_path in file_paths)
+            if len(self.pending) >= self.batch_size:
+                self.append_files_for_processing()
+            if self.chunk_count % progress_every == 0:
+                self.print_progress(perf_counter() - t_start)
+
+        self.append_files_for_processing()
+        self.print_progress(perf_counter() - t_start)
+        print(self.listing_stats.report())
+
+    @staticmethod
+    def find_original_files(chunk_path: str) -> Tuple[str, str, List[str]]:
+        return (chunk_path, *FileToProcess.find_original_files_of_chunk_path(chunk_path))
+
+    def append_files_for_processing(self):
+        if not self.pending:
+            return
+        unknown_patient_ids = set(self.pending.values()) - set(self.participants)
+        self.participants.update(
+            (participant.patient_id, participant)
+            for participant in Participant.objects.filter(patient_id__in=unknown_patient_ids)
+        )
+        new_file_paths = FileToProcess.append_files_for_processing(
+            (file_path, self.participants[patient_id])
+            for file_path, patient_id in self.pending.items()
+        )
+        self.new_file_count += len(new_file_paths)
+        self.queued_file_count += len(self.pending) - len(new_file_paths)
+        self.pending = {}
+
+    def print_progress(self, elapsed: float):
+        throughput = self.chunk_count / elapsed if elapsed else 0.0
+        print(
+            f"{self.chunk_count} chunks ({throughput:.1f}/s): {self.new_file_count} files added "
+            f"for processing, {self.queued_file_count} already queued, {len(self.not_found)} "
+            f"chunks without original files."
+        )
+
+
+def reprocess_originals_from_chunk_paths(
+    chunk_paths: Iterable[str], **kwargs
+) -> ReprocessOriginals:
+    """ Re-queues the original files of many chunks for processing, returns the ReprocessOriginals
+    with the counts. """
+    reprocess = ReprocessOriginals(**kwargs)
+    reprocess.run(chunk_paths)
+    return reprocess
@@ -1,98 +1,108 @@
-from typing import Dict, List, Set, Tuple
+from typing import Dict, Generator, List, Set, Tuple, Union
 
 from botocore.exceptions import ReadTimeoutError
 from cronutils import ErrorHandler
 from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM, CHUNKS_FOLDER
 
+from config.settings import FILE_PROCESS_MERGE_CONCURRENCY
 from constants.data_stream_constants import SURVEY_DATA_FILES
 from database.data_access_models import ChunkRegistry
 from database.study_models import Study
 from database.survey_models import Survey
 from database.user_models import Participant
+from libs.file_processing.binified_data_spool import BinifiedDataSpool
+from libs.file_processing.chunk_merging import append_to_chunk, chunk_header, merge_into_chunk
+from libs.file_processing.columnar_timestamps import add_human_readable_timestamps, sort_by_timestamp
 from libs.file_processing.exceptions import ChunkFailedToExist, HeaderMismatchException
+from libs.file_processing.pipeline_stages import bounded_imap, StageStats
 from libs.file_processing.utility_functions_csvs import construct_csv_string, csv_to_list, unix_time_to_string
-from libs.file_processing.utility_functions_simple import (compress,
-    convert_unix_to_human_readable_timestamps, ensure_sorted_by_timestamp)
 from libs.s3 import s3_retrieve
 
 
+# chunk (a ChunkRegistry, or the parameters to create one), chunk path, file contents, study object id
+# The file contents are not compressed, uploads are handed to the upload stage as soon as they are
+# built and only a few are held at a time.
+Upload = Tuple[Union[ChunkRegistry, dict], str, bytes, str]
+
+
 class PrepareDataForeUpload:
-    """ This class is consumes binified data and  """
+    """ This class consumes binified data and produces the uploads of the chunks it updates. """
     
-    def __init__(self, binified_data: Dict, error_handler: ErrorHandler, survey_id_dict: Dict):
+    def __init__(
+        self, binified_data: BinifiedDataSpool, error_handler: ErrorHandler, survey_id_dict: Dict
+    ):
         self.failed_ftps = set()
         self.ftps_to_retire = set()
         
-        self.upload_these: List[Tuple[ChunkRegistry, str, bytes, str]] = []
-        # chunk, something?, file contents, study object id
-        
-        # Track the earliest and latest time bins, to return them at the end of the function
-        self.earliest_time_bin: int = None
-        self.latest_time_bin: int = None
-        
         self.binified_data = binified_data
         self.error_handler = error_handler
         self.survey_id_dict = survey_id_dict
-        self.iterate()
+        self.merge_stats = StageStats("merge", FILE_PROCESS_MERGE_CONCURRENCY)
     
-    def get_retirees(self) -> Tuple[Set[int], int, int, int]:
-        """ returns the ftp pks that have succeeded, the number of ftps that have failed, 
-        and the earliest and the latest time bins """
-        return self.ftps_to_retire.difference(self. failed_ftps), \
-            len(self.failed_ftps), self.earliest_time_bin, self.latest_time_bin
+    def get_retirees(self) -> Tuple[Set[int], int]:
+        """ returns the ftp pks that have succeeded and the number of ftps that have failed """
+        return self.ftps_to_retire.difference(self.failed_ftps), len(self.failed_ftps)
     
-    def iterate(self):
-        for data_bin, (data_rows_list, ftp_list) in self.binified_data.items():
+    def iterate(self) -> Generator[Upload, None, None]:
+        """ Prepares the chunks of every bin of data on a threadpool, yields the uploads as they are
+        ready.  Errors are raised on the error handler, the bin's ftps are marked as failed. """
+        prepared_bins = bounded_imap(self.prepare_bin, self.binified_data.items(), self.merge_stats)
+        for data_bin, ftp_list, upload, exception in prepared_bins:
             with self.error_handler:
-                self.inner_iterate(data_bin, data_rows_list, ftp_list)
+                if exception is not None:
+                    # Whichever FTPs were in the bin that failed get added to the set of failed FTPs.
+                    self.failed_ftps.update(ftp_list)
+                    raise exception
+            
+            if exception is None:
+                # If no exception was raised, the FTP has completed processing. Add it to the set
+                # of retireable (i.e. completed) FTPs.
+                self.ftps_to_retire.update(ftp_list)
+                yield upload
+    
+    def prepare_bin(self, binned_data: Tuple[tuple, Tuple[List, List]]):
+        """ Runs on a merge thread, returns the upload for the bin or the exception it raised. """
+        data_bin, (data_rows_list, ftp_list) = binned_data
+        try:
+            return data_bin, ftp_list, self.inner_iterate(data_bin, data_rows_list), None
+        except Exception as e:
+            # Here we catch any exceptions that may have arisen, as well as the ones that we raised
+            # ourselves (e.g. HeaderMismatchException), they are raised on the processing thread.
+            return data_bin, ftp_list, None, e
     
-    def inner_iterate(self, data_bin, data_rows_list, ftp_list):
+    def inner_iterate(self, data_bin, data_rows_list) -> Upload:
         """  """
+        study_object_id, user_id, data_type, time_bin, original_header = data_bin
+        updated_header = None
         try:
-            study_object_id, user_id, data_type, time_bin, original_header = data_bin
-            # Update earliest and latest time bins
-            if self.earliest_time_bin is None or time_bin < self.earliest_time_bin:
-                self.earliest_time_bin = time_bin
-            if self.latest_time_bin is None or time_bin > self.latest_time_bin:
-                self.latest_time_bin = time_bin
-            
             # data_rows_list may be a generator; here it is evaluated
-            updated_header = convert_unix_to_human_readable_timestamps(
-                original_header, data_rows_list
-            )
+            updated_header = add_human_readable_timestamps(original_header, data_rows_list)
             chunk_path = construct_s3_chunk_path(study_object_id, user_id, data_type, time_bin)
             
             # two core cases
             if ChunkRegistry.objects.filter(chunk_path=chunk_path).exists():
-                self.chunk_exists_case(chunk_path, study_object_id, updated_header, data_rows_list)
+                return self.chunk_exists_case(
+                    chunk_path, study_object_id, updated_header, data_rows_list
+                )
             else:
-                self.chunk_not_exists_case(
+                return self.chunk_not_exists_case(
                     chunk_path, study_object_id, updated_header, user_id, data_type,
                     original_header, time_bin, data_rows_list
                 )
         
         except Exception as e:
-            # Here we catch any exceptions that may have arisen, as well as the ones that we raised
-            # ourselves (e.g. HeaderMismatchException). Whichever FTP we were processing when the
-            # exception was raised gets added to the set of failed FTPs.
-            self.failed_ftps.update(ftp_list)
             print(e)
             print(
                 "FAILED TO UPDATE: study_id:%s, user_id:%s, data_type:%s, time_bin:%s, header:%s " %
                 (study_object_id, user_id, data_type, time_bin, updated_header)
             )
             raise
-        
-        else:
-            # If no exception was raised, the FTP has completed processing. Add it to the set of
-            # retireable (i.e. completed) FTPs.
-            self.ftps_to_retire.update(ftp_list)
     
     def chunk_not_exists_case(
         self, chunk_path: str, study_object_id: str, updated_header: str, user_id: str,
         data_type: str, original_header: bytes, time_bin: int, rows
-    ):
-        ensure_sorted_by_timestamp(rows)
+    ) -> Upload:
+        sort_by_timestamp(rows)
         new_contents = construct_csv_string(updated_header, rows)
         if data_type in SURVEY_DATA_FILES:
             # We need to keep a mapping of files to survey ids, that is handled here.
@@ -109,14 +119,15 @@ class PrepareDataForeUpload:
             "data_type": data_type,
             "chunk_path": chunk_path,
             "time_bin": time_bin,
-            "survey_id": survey_id
+            "survey_id": survey_id,
+            "max_timestamp": int(rows[-1][0]) if rows else None,
         }
         
-        self.upload_these.append(
-            (chunk_params, chunk_path, compress(new_contents), study_object_id)
-        )
+        return chunk_params, chunk_path, new_contents, study_object_id
     
-    def chunk_exists_case(self, chunk_path: str, study_object_id: str, updated_header: str, rows):
+    def chunk_exists_case(
+        self, chunk_path: str, study_object_id: str, updated_header: str, rows
+    ) -> Upload:
         chunk = ChunkRegistry.objects.get(chunk_path=chunk_path)
         
         try:
@@ -136,7 +147,7 @@ class PrepareDataForeUpload:
                 )
             raise  # Raise original error if not 404 s3 error
         
-        old_header, old_rows = csv_to_list(s3_file_data)
+        old_header = chunk_header(s3_file_data)
         
         if old_header != updated_header:
             # To handle the case where a file was on an hour boundary and placed in
@@ -148,12 +159,22 @@ class PrepareDataForeUpload:
                 '%s\nvs.\n%s\nin\n%s' % (old_header, updated_header, chunk_path)
             )
         
-        old_rows = list(old_rows)
-        old_rows.extend(rows)
-        ensure_sorted_by_timestamp(old_rows)
-        new_contents = construct_csv_string(updated_header, old_rows)
+        # Chunks are already sorted and deduplicated, so new rows can usually be appended to the end
+        # of a chunk or merged into it, the full re-sort is only needed for unusual old chunks.
+        sort_by_timestamp(rows)
+        merged = append_to_chunk(s3_file_data, chunk.max_timestamp, rows) \
+            or merge_into_chunk(s3_file_data, rows)
+        if merged:
+            new_contents, chunk.max_timestamp = merged
+        else:
+            _, old_rows = csv_to_list(s3_file_data)
+            old_rows = list(old_rows)
+            old_rows.extend(rows)
+            sort_by_timestamp(old_rows)
+            new_contents = construct_csv_string(updated_header, old_rows)
+            chunk.max_timestamp = int(old_rows[-1][0]) if old_rows else None
         
-        self.upload_these.append((chunk, chunk_path, compress(new_contents), study_object_id))
+        return chunk, chunk_path, new_contents, study_object_id
 
 
 def construct_s3_chunk_path(
@@ -1,4 +1,7 @@
 from datetime import datetime, timedelta
+from typing import Iterable, List, Set, Tuple
+
+from django.db.models import QuerySet
 
 from database.schedule_models import ArchivedEvent, ScheduledEvent, WeeklySchedule
 from database.study_models import Study
@@ -28,6 +31,45 @@ def set_next_weekly(participant: Participant, survey: Survey) -> None:
         )
 
 
+def bulk_set_next_weekly(participants_and_surveys: Iterable[Tuple[Participant, Survey]]) -> None:
+    """ set_next_weekly for many participants and surveys.  The next weekly event is calculated once
+    per survey, and only the missing ScheduledEvents are created, in one bulk_create. """
+    next_weekly_events = {}
+    wanted_events = {}
+    for participant, survey in participants_and_surveys:
+        if survey.pk not in next_weekly_events:
+            next_weekly_events[survey.pk] = get_next_weekly_event_and_schedule(survey)
+        schedule_date, schedule = next_weekly_events[survey.pk]
+        # this handles the case where the schedule was deleted (see set_next_weekly)
+        if schedule_date is not None and schedule is not None:
+            wanted_events[(participant.pk, survey.pk)] = (schedule_date, schedule)
+
+    if not wanted_events:
+        return
+
+    existing_events = set(
+        ScheduledEvent.objects.filter(
+            participant_id__in={participant_pk for participant_pk, _ in wanted_events},
+            weekly_schedule_id__in={schedule.pk for _, schedule in wanted_events.values()},
+            scheduled_time__in={schedule_date for schedule_date, _ in wanted_events.values()},
+            relative_schedule=None,
+            absolute_schedule=None,
+        ).values_list("participant_id", "weekly_schedule_id", "scheduled_time")
+    )
+    ScheduledEvent.objects.bulk_create([
+        ScheduledEvent(
+            survey_id=survey_pk,
+            participant_id=participant_pk,
+            weekly_schedule=schedule,
+            relative_schedule=None,
+            absolute_schedule=None,
+            scheduled_time=schedule_date,
+        )
+        for (participant_pk, survey_pk), (schedule_date, schedule) in wanted_events.items()
+        if (participant_pk, schedule.pk, schedule_date) not in existing_events
+    ])
+
+
 def repopulate_all_survey_scheduled_events(study: Study, participant: Participant = None):
     """ Runs all the survey scheduled event generations on the provided entities. """
 
@@ -45,7 +87,7 @@ def repopulate_all_survey_scheduled_events(study: Study, participant: Participan
 
 
 def repopulate_weekly_survey_schedule_events(survey: Survey, single_participant: Participant = None) -> None:
-    """ Clear existing schedules, get participants, bulk create schedules Weekly events are
+    """ Updates the weekly events to the next weekly event of every participant.  Weekly events are
     calculated in a way that we don't bother checking for survey archives, because they only
     exist in the future. """
     events = survey.scheduled_events.filter(relative_schedule=None, absolute_schedule=None)
@@ -55,15 +97,16 @@ def repopulate_weekly_survey_schedule_events(survey: Survey, single_participant:
     else:
         participant_ids = survey.study.participants.values_list("pk", flat=True)
 
-    events.delete()
-
     try:
         # get_next_weekly_event forces tz-aware schedule_date datetime object
         schedule_date, schedule = get_next_weekly_event_and_schedule(survey)
     except NoSchedulesException:
+        events.delete()
         return
 
-    ScheduledEvent.objects.bulk_create(
+    update_scheduled_events(
+        events,
+        "weekly_schedule",
         [
             ScheduledEvent(
                 survey=survey,
@@ -78,40 +121,24 @@ def repopulate_weekly_survey_schedule_events(survey: Survey, single_participant:
 
 
 def repopulate_absolute_survey_schedule_events(survey: Survey, single_participant: Participant = None) -> None:
-    """
-    Creates new ScheduledEvents for the survey's AbsoluteSchedules while deleting the old
-    ScheduledEvents related to the survey
-    """
+    """ Updates the ScheduledEvents of the survey's AbsoluteSchedules to match the schedules. """
     # if the event is from an absolute schedule, relative and weekly schedules will be None
     events = survey.scheduled_events.filter(relative_schedule=None, weekly_schedule=None)
     if single_participant:
         events = events.filter(participant=single_participant)
-    events.delete()
+        participant_ids = [single_participant.pk]
+    else:
+        participant_ids = list(survey.study.participants.values_list("pk", flat=True))
+
+    # don't create events for already sent notifications
+    archived_events = get_archived_events(survey, single_participant)
 
     new_events = []
     for abs_sched in survey.absolute_schedules.all():
         scheduled_time = abs_sched.event_time
-        # if one participant
-        if single_participant:
-            archive_exists = ArchivedEvent.objects.filter(
-                survey_archive__survey=survey,
-                scheduled_time=scheduled_time,
-                participant_id=single_participant.pk
-            ).exists()
-            relevant_participants = [] if archive_exists else [single_participant.pk]
-
-        # if many participants
-        else:
-            # don't create events for already sent notifications
-            irrelevant_participants = ArchivedEvent.objects.filter(
-                survey_archive__survey=survey, scheduled_time=scheduled_time,
-            ).values_list("participant_id", flat=True)
-            relevant_participants = survey.study.participants.exclude(
-                pk__in=irrelevant_participants
-            ).values_list("pk", flat=True)
-
-        # populate
-        for participant_id in relevant_participants:
+        for participant_id in participant_ids:
+            if (participant_id, scheduled_time) in archived_events:
+                continue
             new_events.append(ScheduledEvent(
                 survey=survey,
                 weekly_schedule=None,
@@ -120,18 +147,19 @@ def repopulate_absolute_survey_schedule_events(survey: Survey, single_participan
                 scheduled_time=scheduled_time,
                 participant_id=participant_id
             ))
-    # instantiate
-    ScheduledEvent.objects.bulk_create(new_events)
+
+    update_scheduled_events(events, "absolute_schedule", new_events)
 
 
 def repopulate_relative_survey_schedule_events(survey: Survey, single_participant: Participant = None) -> None:
-    """ Creates new ScheduledEvents for the survey's RelativeSchedules while deleting the old
-    ScheduledEvents related to the survey. """
-    # Clear out existing events.
+    """ Updates the ScheduledEvents of the survey's RelativeSchedules to match the schedules and
+    the participants' intervention dates. """
     events = survey.scheduled_events.filter(absolute_schedule=None, weekly_schedule=None)
     if single_participant:
         events = events.filter(participant=single_participant)
-    events.delete()
+
+    # skip if already sent (archived event matching participant, survey, and schedule time)
+    archived_events = get_archived_events(survey, single_participant)
 
     # This is per schedule, and a participant can't have more than one intervention date per
     # intervention per schedule.  It is also per survey and all we really care about is
@@ -148,12 +176,7 @@ def repopulate_relative_survey_schedule_events(survey: Survey, single_participan
             # + below is correct, 'days_after' is negative or 0 for days before and day of.
             scheduled_date = intervention_date + timedelta(days=relative_schedule.days_after)
             schedule_time = relative_schedule.scheduled_time(scheduled_date, survey.study.timezone)
-            # skip if already sent (archived event matching participant, survey, and schedule time)
-            if ArchivedEvent.objects.filter(
-                participant_id=participant_id,
-                survey_archive__survey_id=survey.id,
-                scheduled_time=schedule_time,
-            ).exists():
+            if (participant_id, schedule_time) in archived_events:
                 continue
 
             new_events.append(ScheduledEvent(
@@ -165,7 +188,38 @@ def repopulate_relative_survey_schedule_events(survey: Survey, single_participan
                 scheduled_time=schedule_time,
             ))
 
-    ScheduledEvent.objects.bulk_create(new_events)
+    update_scheduled_events(events, "relative_schedule", new_events)
+
+
+def get_archived_events(survey: Survey, single_participant: Participant = None) -> Set[Tuple[int, datetime]]:
+    """ The (participant id, scheduled time) of every archived event of the survey, in one query. """
+    archived_events = ArchivedEvent.objects.filter(survey_archive__survey_id=survey.id)
+    if single_participant:
+        archived_events = archived_events.filter(participant_id=single_participant.pk)
+    return set(archived_events.values_list("participant_id", "scheduled_time"))
+
+
+def update_scheduled_events(events: QuerySet, schedule_field: str, new_events: List[ScheduledEvent]) -> None:
+    """ Makes the existing events match new_events.  Events are compared by participant, schedule,
+    and scheduled time, only events that are not wanted are deleted, and only the missing events are
+    created, so repopulating schedules that have not changed doesn't write to the database. """
+    schedule_id_field = schedule_field + "_id"
+    missing_events = {}
+    for event in new_events:
+        key = (event.participant_id, getattr(event, schedule_id_field), event.scheduled_time)
+        missing_events.setdefault(key, event)
+
+    unwanted_event_pks = []
+    for pk, participant_id, schedule_id, scheduled_time in events.values_list(
+        "pk", "participant_id", schedule_id_field, "scheduled_time"
+    ):
+        # pop, so that duplicate existing events are deleted.
+        if missing_events.pop((participant_id, schedule_id, scheduled_time), None) is None:
+            unwanted_event_pks.append(pk)
+
+    if unwanted_event_pks:
+        ScheduledEvent.objects.filter(pk__in=unwanted_event_pks).delete()
+    ScheduledEvent.objects.bulk_create(missing_events.values())
 
 
 def get_next_weekly_event_and_schedule(survey: Survey) -> (datetime, WeeklySchedule):
@@ -2,9 +2,10 @@ import boto3
 from Cryptodome.PublicKey import RSA
 
 from config.settings import (BEIWE_SERVER_AWS_ACCESS_KEY_ID, BEIWE_SERVER_AWS_SECRET_ACCESS_KEY,
-    S3_BUCKET, S3_REGION_NAME)
-from libs.encryption import (decrypt_server, encrypt_for_server, generate_key_pairing,
-    get_RSA_cipher, prepare_X509_key_for_java)
+    PRIVATE_KEY_CACHE_SECONDS, PRIVATE_KEY_CACHE_SIZE, S3_BUCKET, S3_REGION_NAME)
+from libs.encryption import (decrypt_server, decrypt_server_with_key, encrypt_for_server,
+    generate_key_pairing, get_RSA_cipher, prepare_X509_key_for_java)
+from libs.utils.cache_utils import ExpiringLRUCache
 
 """
 Research on getting a stream into the decryption code of pycryptodome
@@ -26,6 +27,10 @@ class S3VersionException(Exception): pass
 class NoSuchKeyException(Exception): pass
 
 
+# parsed participant private keys, keyed by (study object id, patient id).
+PRIVATE_KEY_CACHE = ExpiringLRUCache(PRIVATE_KEY_CACHE_SIZE, PRIVATE_KEY_CACHE_SECONDS)
+
+
 conn = boto3.client(
     's3',
     aws_access_key_id=BEIWE_SERVER_AWS_ACCESS_KEY_ID,
@@ -42,13 +47,19 @@ def s3_upload(key_path: str, data_string: bytes, study_object_id: str, raw_path=
     conn.put_object(Body=data, Bucket=S3_BUCKET, Key=key_path)#, ContentType='string')
 
 
-def s3_retrieve(key_path: str, study_object_id: str, raw_path:bool=False, number_retries=3) -> bytes:
+def s3_retrieve(
+    key_path: str, study_object_id: str, raw_path:bool=False, number_retries=3,
+    encryption_key: bytes = None,
+) -> bytes:
     """ Takes an S3 file path (key_path), and a study ID.  Takes an optional argument, raw_path,
     which defaults to false.  When set to false the path is prepended to place the file in the
-    appropriate study_id folder. """
+    appropriate study_id folder.  If the study's encryption_key is provided the database is not
+    queried for it. """
     if not raw_path:
         key_path = study_object_id + "/" + key_path
     encrypted_data = _do_retrieve(S3_BUCKET, key_path, number_retries=number_retries)['Body'].read()
+    if encryption_key is not None:
+        return decrypt_server_with_key(encrypted_data, encryption_key)
     return decrypt_server(encrypted_data, study_object_id)
 
 
@@ -69,11 +80,12 @@ def _do_retrieve(bucket_name, key_path, number_retries=3):
         raise
 
 
-def s3_list_files(prefix, as_generator=False):
-    """ Method fetches a list of filenames with prefix.
+def s3_list_files(prefix, as_generator=False, start_after=None):
+    """ Method fetches a list of filenames with prefix.  Keys are listed in lexicographic order, with
+        start_after only the keys after it are listed.
         note: entering the empty string into this search without later calling
         the object results in a truncated/paginated view."""
-    return _do_list_files(S3_BUCKET, prefix, as_generator=as_generator)
+    return _do_list_files(S3_BUCKET, prefix, as_generator=as_generator, start_after=start_after)
 
 
 def s3_list_versions(prefix, allow_multiple_matches=False):
@@ -108,9 +120,10 @@ def s3_list_versions(prefix, allow_multiple_matches=False):
     return versions
 
 
-def _do_list_files(bucket_name, prefix, as_generator=False):
+def _do_list_files(bucket_name, prefix, as_generator=False, start_after=None):
     paginator = conn.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+    kwargs = {"StartAfter": start_after} if start_after else {}
+    page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=prefix, **kwargs)
     if as_generator:
         return _do_list_files_generator(page_iterator)
     else:
@@ -142,6 +155,7 @@ def create_client_key_pair(patient_id, study_id):
     public, private = generate_key_pairing()
     s3_upload("keys/" + patient_id + "_private", private, study_id)
     s3_upload("keys/" + patient_id + "_public", public, study_id)
+    PRIVATE_KEY_CACHE.invalidate((study_id, patient_id))
 
 
 def get_client_public_key_string(patient_id, study_id) -> str:
@@ -157,6 +171,10 @@ def get_client_public_key(patient_id, study_id) -> RSA.RsaKey:
 
 
 def get_client_private_key(patient_id, study_id) -> RSA.RsaKey:
-    """Grabs a user's private key file from s3."""
+    """Grabs a user's private key file from s3, or from the cache of recently used keys."""
+    return PRIVATE_KEY_CACHE.get((study_id, patient_id), lambda: _get_client_private_key(patient_id, study_id))
+
+
+def _get_client_private_key(patient_id, study_id) -> RSA.RsaKey:
     key = s3_retrieve("keys/" + patient_id +"_private", study_id)
     return get_RSA_cipher(key)
@@ -1,8 +1,12 @@
 import json
 from multiprocessing.pool import ThreadPool
-from typing import Tuple
+from queue import Queue
+from time import perf_counter
+from typing import Callable, Dict, Generator, Iterable, Optional, Tuple
 from zipfile import ZIP_STORED, ZipFile
 
+from config.settings import (ZIP_DOWNLOAD_CONCURRENCY, ZIP_DOWNLOAD_MAX_CONCURRENCY,
+    ZIP_DOWNLOAD_READ_AHEAD_MB)
 from constants.data_stream_constants import (IMAGE_FILE, SURVEY_ANSWERS, SURVEY_TIMINGS,
     VOICE_RECORDING)
 from database.study_models import Study
@@ -55,41 +59,192 @@ def determine_file_name(chunk):
                             str(chunk["time_bin"]).replace(":", "_"), extension)
 
 
-def batch_retrieve_s3(chunk: dict) -> Tuple[dict, bytes]:
+def batch_retrieve_s3(
+    chunk: dict, study_object_id: str, encryption_key: bytes
+) -> Tuple[dict, bytes]:
     """ Data is returned in the form (chunk_object, file_data). """
     return chunk, s3_retrieve(
-        chunk["chunk_path"],
-        study_object_id=Study.objects.get(id=chunk["study_id"]).object_id,
-        raw_path=True,
+        chunk["chunk_path"], study_object_id=study_object_id, raw_path=True,
+        encryption_key=encryption_key,
     )
 
 
+class ChunkDownloader:
+    """ Retrieves chunks from S3 on a thread pool for zip_generator.
+    
+    The number of concurrent downloads adapts to the observed throughput: every
+    ADAPT_INTERVAL_SECONDS the number is moved one step, in the same direction as the last step if
+    throughput improved, and in the other direction if it got worse.  Downloaded files that have not
+    been taken by the consumer (the client) are held in a read-ahead buffer, no new downloads start
+    while it holds read_ahead_bytes or more.
+    
+    Chunks are yielded in the order they finish downloading, or in input order if ordered is True.
+    The database is only ever queried on the calling thread.
+    
+    local_contents, if provided, is called (on the calling thread) with every chunk before it is
+    downloaded, if it returns the contents of the chunk the chunk is not downloaded. """
+    
+    ADAPT_INTERVAL_SECONDS = 2.0
+    
+    def __init__(
+        self,
+        concurrency: int = ZIP_DOWNLOAD_CONCURRENCY,
+        max_concurrency: int = ZIP_DOWNLOAD_MAX_CONCURRENCY,
+        read_ahead_bytes: int = ZIP_DOWNLOAD_READ_AHEAD_MB * 1024 * 1024,
+        ordered: bool = False,
+    ):
+        self.concurrency = max(concurrency, 1)
+        self.max_concurrency = max(max_concurrency, self.concurrency)
+        self.adaptive = self.max_concurrency > self.concurrency
+        self.read_ahead_bytes = read_ahead_bytes
+        self.ordered = ordered
+        self.study_keys: Dict[int, Tuple[str, bytes]] = {}
+        
+        self.files = 0
+        self.bytes = 0
+        self.local_files = 0
+        self.local_bytes = 0
+        self.started = None
+        self.peak_concurrency = self.concurrency
+        self._window_start = perf_counter()
+        self._window_bytes = 0
+        self._last_throughput = None
+        self._direction = 1
+    
+    def get_study_keys(self, study_id: int) -> Tuple[str, bytes]:
+        """ The object id and encryption key of a study, passed to the threads so that they don't
+        query the database. """
+        if study_id not in self.study_keys:
+            object_id, encryption_key = Study.objects.filter(pk=study_id) \
+                .values_list("object_id", "encryption_key").get()
+            self.study_keys[study_id] = object_id, encryption_key.encode()
+        return self.study_keys[study_id]
+    
+    def download(
+        self, chunks: Iterable[dict], local_contents: Callable[[dict], Optional[bytes]] = None
+    ) -> Generator[Tuple[dict, bytes], None, None]:
+        chunks = iter(chunks)
+        finished = Queue()
+        ready: Dict[int, Tuple[dict, bytes]] = {}  # downloaded and not yet yielded, by input index
+        buffered_bytes = 0
+        in_flight = 0
+        submitted = 0
+        yielded = 0
+        exhausted = False
+        
+        pool = ThreadPool(self.max_concurrency)
+        self.started = self._window_start = perf_counter()
+        try:
+            while True:
+                while (not exhausted and in_flight < self.concurrency
+                       and buffered_bytes < self.read_ahead_bytes):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    file_contents = local_contents(chunk) if local_contents else None
+                    if file_contents is not None:
+                        ready[submitted] = (chunk, file_contents)
+                        buffered_bytes += len(file_contents)
+                        self.local_files += 1
+                        self.local_bytes += len(file_contents)
+                    else:
+                        self._submit(pool, finished, submitted, chunk)
+                        in_flight += 1
+                    submitted += 1
+                
+                # take every finished download, and wait for one if there is nothing to yield.
+                while in_flight and (not finished.empty() or not self._can_yield(ready, yielded)):
+                    index, chunk, file_contents, error = finished.get()
+                    in_flight -= 1
+                    if error is not None:
+                        raise error
+                    ready[index] = (chunk, file_contents)
+                    buffered_bytes += len(file_contents)
+                    self._record(len(file_contents), buffered_bytes >= self.read_ahead_bytes)
+                
+                if not self._can_yield(ready, yielded):
+                    if exhausted:  # (and nothing is in flight)
+                        return
+                    continue
+                
+                chunk, file_contents = ready.pop(yielded if self.ordered else next(iter(ready)))
+                buffered_bytes -= len(file_contents)
+                yielded += 1
+                yield chunk, file_contents
+                del chunk, file_contents
+        finally:
+            pool.terminate()
+    
+    def _submit(self, pool: ThreadPool, finished: Queue, index: int, chunk: dict):
+        pool.apply_async(
+            batch_retrieve_s3,
+            (chunk, *self.get_study_keys(chunk["study_id"])),
+            callback=lambda result: finished.put((index, chunk, result[1], None)),
+            error_callback=lambda error: finished.put((index, chunk, None, error)),
+        )
+    
+    def _can_yield(self, ready: Dict[int, Tuple[dict, bytes]], yielded: int) -> bool:
+        return yielded in ready if self.ordered else bool(ready)
+    
+    def _record(self, size: int, buffer_full: bool):
+        self.files += 1
+        self.bytes += size
+        self._window_bytes += size
+        
+        now = perf_counter()
+        elapsed = now - self._window_start
+        if not self.adaptive or elapsed < self.ADAPT_INTERVAL_SECONDS:
+            return
+        
+        throughput = self._window_bytes / elapsed
+        if buffer_full:
+            # the download is waiting on the client, the throughput says nothing about concurrency.
+            self._last_throughput = None
+        else:
+            if self._last_throughput is not None and throughput < self._last_throughput * 0.95:
+                self._direction = -self._direction
+            if not 1 <= self.concurrency + self._direction <= self.max_concurrency:
+                self._direction = -self._direction
+            self.concurrency += self._direction
+            self.peak_concurrency = max(self.peak_concurrency, self.concurrency)
+            self._last_throughput = throughput
+        self._window_start = now
+        self._window_bytes = 0
+    
+    def report(self) -> str:
+        elapsed = perf_counter() - self.started if self.started is not None else 0.0
+        megabytes = self.bytes / 1024 / 1024
+        throughput = megabytes / elapsed if elapsed else 0.0
+        report = (
+            f"downloaded {self.files} files, {megabytes:.1f}MB in {elapsed:.1f}s "
+            f"({throughput:.2f}MB/s), {self.concurrency} threads at the end, peak {self.peak_concurrency}"
+        )
+        if self.local_files:
+            report += f", {self.local_files} files ({self.local_bytes / 1024 / 1024:.1f}MB) not downloaded"
+        return report
+
+
 # Note: you cannot access the request context inside a generator function
-def zip_generator(files_list, construct_registry=False):
+def zip_generator(files_list, construct_registry=False, ordered=False, local_contents=None):
     """ Pulls in data from S3 in a multithreaded network operation, constructs a zip file of that
     data. This is a generator, advantage is it starts returning data (file by file, but wrapped
-    in zip compression) almost immediately. """
+    in zip compression) almost immediately.  Files are added to the zip in the order they finish
+    downloading, or in the order of files_list if ordered is True (only the first of files with the
+    same name in the zip is kept, ordered makes that choice deterministic).  See ChunkDownloader for
+    local_contents. """
     
     processed_files = set()
     duplicate_files = set()
-    pool = ThreadPool(3)
-    # 3 Threads has been heuristically determined to be a good value, it does not cause the server
-    # to be overloaded, and provides more-or-less the maximum data download speed.  This was tested
-    # on an m4.large instance (dual core, 8GB of ram).
+    downloader = ChunkDownloader(ordered=ordered)
     file_registry = {}
     
     zip_output = StreamingBytesIO()
     zip_input = ZipFile(zip_output, mode="w", compression=ZIP_STORED, allowZip64=True)
     
     try:
-        # chunks_and_content is a list of tuples, of the chunk and the content of the file.
-        # chunksize (which is a keyword argument of imap, not to be confused with Beiwe Chunks)
-        # is the size of the batches that are handed to the pool. We always want to add the next
-        # file to retrieve to the pool asap, so we want a chunk size of 1.
-        # (In the documentation there are comments about the timeout, it is irrelevant under this construction.)
-        chunks_and_content = pool.imap_unordered(batch_retrieve_s3, files_list, chunksize=1)
         total_size = 0
-        for chunk, file_contents in chunks_and_content:
+        for chunk, file_contents in downloader.download(files_list, local_contents):
             if construct_registry:
                 file_registry[chunk['chunk_path']] = chunk["chunk_hash"]
             file_name = determine_file_name(chunk)
@@ -104,11 +259,10 @@ def zip_generator(files_list, construct_registry=False):
             
             x = zip_output.getvalue()
             total_size += len(x)
-            # print "%s: %sK, %sM" % (random_id, total_size / 1024, total_size / 1024 / 1024)
             yield x  # yield the (compressed) file information
             del x
             zip_output.empty()
-
+        
         if construct_registry:
             zip_input.writestr("registry", json.dumps(file_registry))
             yield zip_output.getvalue()
@@ -117,16 +271,9 @@ def zip_generator(files_list, construct_registry=False):
         # close, then yield all remaining data in the zip.
         zip_input.close()
         yield zip_output.getvalue()
-    except DummyError:
-        # The try-except-finally block is here to guarantee the Threadpool is closed and terminated.
-        # we don't handle any errors, we just re-raise any error that shows up.
-        # (with statement does not work.)
-        raise
     finally:
-        # We rely on the finally block to ensure that the threadpool will be closed and terminated,
-        # and also to print an error to the log if we need to.
-        pool.close()
-        pool.terminate()
+        if downloader.files or downloader.local_files:
+            print(f"zip download: {downloader.report()}")
 
 
 # delete zip_generator_for_pipeline only by reverting the commit
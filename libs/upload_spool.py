@@ -0,0 +1,268 @@
+import fcntl
+import json
+import os
+import traceback
+from os.path import join as path_join
+from queue import Queue
+from threading import Lock, Thread, Timer
+from time import time, time_ns
+from uuid import uuid4
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.db import close_old_connections, InterfaceError, OperationalError
+
+from config.settings import UPLOAD_SPOOL_DIRECTORY, UPLOAD_SPOOL_MAX_PENDING, UPLOAD_SPOOL_WORKERS
+from database.data_access_models import FileToProcess
+from database.user_models import Participant
+from libs.encryption import decrypt_device_file, DecryptionKeyInvalidError, HandledError
+from libs.s3 import s3_upload
+from libs.sentry import make_sentry_client, SentryTypes
+
+
+"""
+The upload spool moves the expensive part of the mobile upload endpoint off of the request thread.
+
+When enabled (UPLOAD_SPOOL_DIRECTORY is set), the upload endpoint validates an upload and its
+decryption key, writes the raw (still device-encrypted) payload to a file in the spool directory,
+fsyncs it, and returns 200 so the device deletes its copy.  A pool of background threads in each
+server process then decrypts the file, uploads it to S3, and creates the FileToProcess and
+UploadTracking entries, exactly like the synchronous code path.
+
+Spool files are written under a temporary name and renamed into place, so a spool file is either
+complete or absent.  A process claims a spool file before working on it by renaming it to include
+the process's identity, so processes sharing a spool directory never process the same file.  The
+identity is a random token, and the process holds an flock on the lock file of its token for as
+long as it runs.  (Pids are reused, especially after a restart, but a lock is released when its
+process exits.)  The workers are started when the server process starts (see wsgi.py), they replay
+every unclaimed spool file and every file claimed by a process that no longer exists (i.e. it
+crashed or was restarted mid-upload).
+
+Files that fail with a transient error (the database or S3 being unavailable) are retried after a
+growing delay.  Files that fail with any other error are moved to the "failed" subdirectory and
+reported to Sentry.
+
+Backpressure: if a process has UPLOAD_SPOOL_MAX_PENDING uploads waiting, uploads are processed on
+the request thread as if the spool were disabled.
+"""
+
+SPOOL_SUFFIX = ".upload"
+CLAIMED_SUFFIX = ".claimed-"
+TEMPORARY_SUFFIX = ".tmp"
+FAILED_FOLDER = "failed"
+LOCKS_FOLDER = "locks"
+# a temporary file this old is from an interrupted write, the device never received a 200 for it.
+STALE_TEMPORARY_FILE_SECONDS = 60 * 60
+# retries of transient errors wait 10 seconds, doubling up to 10 minutes.
+RETRY_DELAY_SECONDS = 10
+MAX_RETRY_DELAY_SECONDS = 10 * 60
+TRANSIENT_ERRORS = (
+    BotoCoreError, ClientError, ConnectionError, InterfaceError, OperationalError, TimeoutError
+)
+
+
+class UploadSpool:
+
+    def __init__(self, directory: str, number_workers: int, max_pending: int):
+        self.directory = directory
+        self.number_workers = number_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.identity = None
+        self._identity_file = None
+        self._queue = Queue()
+        self._lock = Lock()
+        self._started_pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.number_workers > 0
+
+    def has_capacity(self) -> bool:
+        """ Whether an upload should be spooled, starts the workers if they have not been started. """
+        if not self.enabled:
+            return False
+        self.start()
+        return self.pending < self.max_pending
+
+    def start(self):
+        """ Starts the worker threads and replays the spool directory, once per process. """
+        with self._lock:
+            # web servers fork worker processes, threads are not inherited by the child.
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            os.makedirs(path_join(self.directory, FAILED_FOLDER), exist_ok=True)
+            os.makedirs(path_join(self.directory, LOCKS_FOLDER), exist_ok=True)
+            self._take_identity()
+            for _ in range(self.number_workers):
+                Thread(target=self._work, daemon=True).start()
+        self.replay()
+
+    def _take_identity(self):
+        """ Creates and locks the lock file of a new identity for this process. """
+        # a lock file inherited from a parent process is the parent's, closing our copy of it does
+        # not release the parent's lock.
+        if self._identity_file is not None:
+            self._identity_file.close()
+        self.identity = uuid4().hex
+        # locked before it is renamed into place, so a visible unlocked lock file is always stale.
+        temporary_path = path_join(self.directory, LOCKS_FOLDER, self.identity + TEMPORARY_SUFFIX)
+        self._identity_file = open(temporary_path, "w")
+        fcntl.flock(self._identity_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(temporary_path, path_join(self.directory, LOCKS_FOLDER, self.identity))
+
+    def owner_is_alive(self, identity: str) -> bool:
+        """ Whether the process with this identity is running, i.e. still holds its lock. """
+        if identity == self.identity:
+            return True
+        try:
+            lock_file = open(path_join(self.directory, LOCKS_FOLDER, identity))
+        except FileNotFoundError:
+            return False
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+        return False
+
+    def spool(self, participant: Participant, file_name: str, payload: bytes):
+        """ Durably writes an upload to the spool directory and queues it for processing. """
+        name = f"{time_ns()}_{uuid4().hex}"
+        temporary_path = path_join(self.directory, name + TEMPORARY_SUFFIX)
+        header = json.dumps({"participant_id": participant.pk, "file_name": file_name}).encode()
+
+        with open(temporary_path, "wb") as f:
+            f.write(header + b"\n")
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # the rename is atomic, fsyncing the directory makes the rename itself durable.
+        claimed_path = path_join(self.directory, name + SPOOL_SUFFIX + CLAIMED_SUFFIX + self.identity)
+        os.rename(temporary_path, claimed_path)
+        self._fsync_directory()
+        self._enqueue(claimed_path)
+
+    def replay(self):
+        """ Queues spool files that are unclaimed or were claimed by a process that has exited. """
+        for file_name in sorted(os.listdir(self.directory)):
+            path = path_join(self.directory, file_name)
+
+            if file_name.endswith(TEMPORARY_SUFFIX):
+                if os.path.getmtime(path) < time() - STALE_TEMPORARY_FILE_SECONDS:
+                    os.remove(path)
+                continue
+
+            if CLAIMED_SUFFIX in file_name:
+                unclaimed_name, identity = file_name.rsplit(CLAIMED_SUFFIX, 1)
+                if self.owner_is_alive(identity):
+                    continue
+            elif file_name.endswith(SPOOL_SUFFIX):
+                unclaimed_name = file_name
+            else:
+                continue
+
+            claimed_path = path_join(self.directory, unclaimed_name + CLAIMED_SUFFIX + self.identity)
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue  # another process claimed it first
+            self._enqueue(claimed_path)
+
+        # the files of exited processes have been claimed, their lock files are no longer needed.
+        for identity in os.listdir(path_join(self.directory, LOCKS_FOLDER)):
+            if not identity.endswith(TEMPORARY_SUFFIX) and not self.owner_is_alive(identity):
+                try:
+                    os.remove(path_join(self.directory, LOCKS_FOLDER, identity))
+                except FileNotFoundError:
+                    pass
+
+    def _enqueue(self, claimed_path: str):
+        with self._lock:
+            self.pending += 1
+        self._queue.put((claimed_path, 0))
+
+    def _fsync_directory(self):
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def _work(self):
+        while True:
+            claimed_path, attempt = self._queue.get()
+            try:
+                finished = self._attempt(claimed_path, attempt)
+            except Exception:
+                # nothing may escape, it would end this worker thread.
+                traceback.print_exc()
+                finished = True
+            if finished:
+                with self._lock:
+                    self.pending -= 1
+            close_old_connections()
+
+    def _attempt(self, claimed_path: str, attempt: int) -> bool:
+        """ Processes a spool file, returns False if it will be retried. """
+        try:
+            self._process(claimed_path)
+        except TRANSIENT_ERRORS:
+            traceback.print_exc()
+            # the file stays claimed, if this process exits first another process replays it.
+            delay = min(RETRY_DELAY_SECONDS * 2 ** attempt, MAX_RETRY_DELAY_SECONDS)
+            timer = Timer(delay, self._queue.put, ((claimed_path, attempt + 1),))
+            timer.daemon = True
+            timer.start()
+            return False
+        except Exception:
+            traceback.print_exc()
+            make_sentry_client(
+                SentryTypes.elastic_beanstalk, {"spool_file": claimed_path}
+            ).captureException()
+            try:
+                os.rename(
+                    claimed_path,
+                    path_join(self.directory, FAILED_FOLDER, os.path.basename(claimed_path))
+                )
+            except OSError:
+                traceback.print_exc()
+            return True
+
+        os.remove(claimed_path)
+        return True
+
+    def _process(self, claimed_path: str):
+        with open(claimed_path, "rb") as f:
+            header = json.loads(f.readline())
+            payload = f.read()
+        participant = Participant.objects.get(pk=header["participant_id"])
+        process_upload(participant, header["file_name"], payload)
+
+
+def process_upload(participant: Participant, file_name: str, payload: bytes):
+    """ The background equivalent of the synchronous upload endpoint, after validation. """
+    s3_file_location = file_name.replace("_", "/")
+
+    # these may have changed since the upload was spooled.
+    if participant.unregistered:
+        return
+    if FileToProcess.test_file_path_exists(s3_file_location, participant.study.object_id):
+        return
+
+    try:
+        decrypted = decrypt_device_file(file_name, payload, participant)
+    except (HandledError, DecryptionKeyInvalidError):
+        # the synchronous endpoint returns a 200 for these, the device deletes the file.
+        return
+
+    if not decrypted:
+        return
+
+    s3_upload(s3_file_location, decrypted, participant.study.object_id)
+    # (a concurrent upload of the same file path may have registered it first, which is fine.)
+    FileToProcess.register_uploads([(s3_file_location, participant, len(decrypted))])
+
+
+UPLOAD_SPOOL = UploadSpool(UPLOAD_SPOOL_DIRECTORY, UPLOAD_SPOOL_WORKERS, UPLOAD_SPOOL_MAX_PENDING)
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+
+class ExpiringLRUCache:
+    """ A small thread-safe, process-local cache.  Entries expire after ttl_seconds, and when the
+    cache is full the least recently used entry is evicted.  Hits and misses are counted so that
+    the effectiveness of a cache can be checked from a shell on a running server. """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key: (expiry time, value)
+        self._lock = Lock()
+        # incremented by invalidation, a value loaded before an invalidation is not stored.
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """ Returns the cached value for key, calling load() to populate it if it is missing or has
+        expired.  load is called outside of the lock, so a slow load does not block other keys. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = load()
+        with self._lock:
+            if generation == self._generation:
+                self._set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: Hashable, value: Any):
+        self._entries[key] = (monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
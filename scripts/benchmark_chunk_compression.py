@@ -0,0 +1,56 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import random
+from time import process_time
+
+from libs.file_processing.utility_functions_simple import compress, decompress
+
+
+"""
+Measures the CPU time that compressing every chunk when it is built, and decompressing it again
+right before it is uploaded, cost file processing per page of files.  File processing used to hold
+every chunk of a page in memory (compressed) until all of them were built, chunks are now uploaded as
+soon as they are built and are no longer compressed.
+
+The page is synthetic: one chunk per hour of 10hz accelerometer data, a page of files is assumed to
+touch CHUNKS_PER_PAGE chunks.
+
+Run with `python run_script.py benchmark_chunk_compression`.
+"""
+
+CHUNKS_PER_PAGE = 24
+ROWS_PER_CHUNK = 36_000
+
+
+def make_chunk(hour: int) -> bytes:
+    start = 1_640_995_200_000 + hour * 3_600_000
+    lines = [b"timestamp,UTC time,accuracy,x,y,z"]
+    for i in range(ROWS_PER_CHUNK):
+        lines.append(b"%d,2022-01-01T00:00:00.000,unknown,%.6f,%.6f,%.6f" % (
+            start + i * 100, random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1),
+        ))
+    return b"\n".join(lines)
+
+
+def run():
+    random.seed(0)
+    print(f"generating {CHUNKS_PER_PAGE} chunks of {ROWS_PER_CHUNK} rows...")
+    chunks = [make_chunk(hour) for hour in range(CHUNKS_PER_PAGE)]
+    total_bytes = sum(len(chunk) for chunk in chunks)
+
+    # process_time includes the time of zstd's own threads.
+    t_start = process_time()
+    for chunk in chunks:
+        assert decompress(compress(chunk)) == chunk
+    cpu_seconds = process_time() - t_start
+
+    print(f"{total_bytes / 1024 / 1024:.1f}MB of chunks per page")
+    print(f"compress + decompress: {cpu_seconds:.3f} CPU seconds per page, "
+          f"{cpu_seconds / CHUNKS_PER_PAGE * 1000:.1f}ms per chunk")
+
+
+run()
@@ -0,0 +1,90 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import random
+from copy import deepcopy
+from time import perf_counter
+from unittest.mock import patch
+
+from libs.file_processing.columnar_timestamps import (add_human_readable_timestamps_columnar,
+    binify_rows_columnar, COLUMNAR_ENABLED, sort_rows_columnar)
+from libs.file_processing.file_processing_core import binify_csv_rows
+from libs.file_processing.utility_functions_simple import (
+    convert_unix_to_human_readable_timestamps, ensure_sorted_by_timestamp)
+
+
+"""
+Compares the columnar (numpy) timestamp engine against the row-at-a-time functions used in data
+processing on a synthetic accelerometer file, and asserts that the output is identical.
+
+Run with `python run_script.py benchmark_columnar_timestamps`.
+"""
+
+NUMBER_OF_ROWS = 1_000_000
+HEADER = b"timestamp,accuracy,x,y,z"
+START_MILLISECONDS = 1_640_995_200_000  # 2022-01-01
+
+
+def make_accelerometer_rows():
+    # ~10hz accelerometer data, slightly out of order, spanning ~28 hours.
+    random.seed(0)
+    rows = []
+    timestamp = START_MILLISECONDS
+    for _ in range(NUMBER_OF_ROWS):
+        timestamp += random.randint(80, 120)
+        jitter = random.randint(-500, 0)
+        rows.append([
+            str(timestamp + jitter).encode(),
+            b"unknown",
+            b"%.6f" % random.uniform(-1, 1),
+            b"%.6f" % random.uniform(-1, 1),
+            b"%.6f" % random.uniform(-1, 1),
+        ])
+    return rows
+
+
+def timed(label: str, function, *args):
+    t_start = perf_counter()
+    ret = function(*args)
+    print(f"{label}: {perf_counter() - t_start:.3f} seconds")
+    return ret
+
+
+def run():
+    if not COLUMNAR_ENABLED:
+        print("numpy is not installed, the columnar engine is disabled.")
+        return
+
+    print(f"generating {NUMBER_OF_ROWS} rows...")
+    rows = make_accelerometer_rows()
+    binify_params = ("study", "user", "accelerometer", HEADER)
+
+    print("\nbinning:")
+    # binify_csv_rows takes the columnar path when it is enabled, the baseline is its row loop.
+    with patch("libs.file_processing.file_processing_core.COLUMNAR_ENABLED", False):
+        python_bins = timed("  python", binify_csv_rows, deepcopy(rows), *binify_params)
+    columnar_bins = timed("  columnar", binify_rows_columnar, deepcopy(rows), *binify_params)
+    assert dict(python_bins) == dict(columnar_bins), "binning output differs"
+    assert list(python_bins) == list(columnar_bins), "bin ordering differs"
+
+    print("\nsorting:")
+    python_rows, columnar_rows = deepcopy(rows), deepcopy(rows)
+    timed("  python", ensure_sorted_by_timestamp, python_rows)
+    timed("  columnar", sort_rows_columnar, columnar_rows)
+    assert python_rows == columnar_rows, "sorting output differs"
+
+    print("\nUTC time column:")
+    python_header = timed("  python", convert_unix_to_human_readable_timestamps, HEADER, python_rows)
+    columnar_header = timed(
+        "  columnar", add_human_readable_timestamps_columnar, HEADER, columnar_rows
+    )
+    assert python_header == columnar_header, "header output differs"
+    assert python_rows == columnar_rows, "UTC time column output differs"
+
+    print("\noutput is identical.")
+
+
+run()
@@ -0,0 +1,137 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import pytz
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.dashboard_api import dashboard_chunkregistry_daily_bytes_query
+from constants.data_stream_constants import ACCELEROMETER
+from database.common_models import generate_objectid_string
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+
+
+"""
+Measures the data layer of the data stream dashboard (get_data_for_dashboard_datastream_display) on
+a synthetic study of 500 participants with a year of hourly accelerometer chunks for the first
+hours of every day.  Compares the previous implementation (a query per participant, then a scan of
+that participant's chunks for every date) against the single GROUP BY query, for the default week
+and for the whole year, and asserts that the output is identical.
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.
+
+Run with `python run_script.py benchmark_dashboard_datastream`.
+"""
+
+NUMBER_OF_PARTICIPANTS = 500
+NUMBER_OF_DAYS = 365
+CHUNKS_PER_DAY = 4
+FIRST_DAY = date(2021, 1, 1)
+
+
+class Rollback(Exception): pass
+
+
+def make_study() -> Study:
+    study = Study.create_with_object_id(
+        name=f"dashboard benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    participants = Participant.objects.bulk_create([
+        Participant(
+            patient_id=f"bm{i:06d}", study=study, os_type=Participant.ANDROID_API,
+            password="benchmark", salt="benchmark",
+        ) for i in range(NUMBER_OF_PARTICIPANTS)
+    ])
+    if participants[0].pk is None:  # backends that don't return pks from bulk_create
+        participants = list(study.participants.all())
+
+    first_time_bin = pytz.utc.localize(datetime.combine(FIRST_DAY, datetime.min.time()))
+    for participant in participants:
+        ChunkRegistry.objects.bulk_create([
+            ChunkRegistry(
+                study=study, participant=participant, data_type=ACCELEROMETER, is_chunkable=True,
+                chunk_path=f"{study.object_id}/{participant.patient_id}/{day}/{hour}",
+                chunk_hash="benchmark", file_size=1000 + day + hour,
+                time_bin=first_time_bin + timedelta(days=day, hours=hour),
+            ) for day in range(NUMBER_OF_DAYS) for hour in range(CHUNKS_PER_DAY)
+        ])
+    return study
+
+
+def previous_byte_streams(study: Study, dates):
+    participants = Participant.objects.filter(study=study).order_by("patient_id")
+    stream_data = {
+        participant.patient_id: list(
+            ChunkRegistry.objects.filter(participant__id=participant.id, data_type=ACCELEROMETER)
+            .extra(select={'data_stream': 'data_type', 'bytes': 'file_size'})
+            .values("bytes", "data_stream", "time_bin")
+        )
+        for participant in participants
+    }
+
+    def get_bytes_participant_match(stream_data, date):
+        all_bytes = None
+        for data_point in stream_data:
+            if (data_point["time_bin"]).date() == date:
+                if all_bytes is None:
+                    all_bytes = data_point.get("bytes", 0) or 0
+                else:
+                    all_bytes += data_point.get("bytes", 0) or 0
+        return all_bytes
+
+    return {
+        participant.patient_id:
+            [get_bytes_participant_match(stream_data[participant.patient_id], date) for date in dates]
+        for participant in participants
+    }
+
+
+def grouped_byte_streams(study: Study, dates):
+    participants = Participant.objects.filter(study=study).order_by("patient_id")
+    daily_bytes = dashboard_chunkregistry_daily_bytes_query(study.id, ACCELEROMETER, dates)
+    return {
+        participant.patient_id: [daily_bytes.get((participant.id, date)) for date in dates]
+        for participant in participants
+    }
+
+
+def measure(label: str, function, study: Study, dates):
+    with CaptureQueriesContext(connection) as queries:
+        t_start = perf_counter()
+        byte_streams = function(study, dates)
+        elapsed = perf_counter() - t_start
+    print(f"{label}, {len(dates)} days: {elapsed:.2f} seconds, {len(queries)} queries")
+    return byte_streams
+
+
+def run():
+    try:
+        with transaction.atomic():
+            print(f"creating a study with {NUMBER_OF_PARTICIPANTS} participants and "
+                  f"{NUMBER_OF_DAYS} days of data...")
+            study = make_study()
+            last_day = FIRST_DAY + timedelta(days=NUMBER_OF_DAYS - 1)
+            week = [last_day - timedelta(days=6 - i) for i in range(7)]
+            year = [FIRST_DAY + timedelta(days=i) for i in range(NUMBER_OF_DAYS)]
+
+            for dates in (week, year):
+                previous = measure("previous", previous_byte_streams, study, dates)
+                grouped = measure("grouped", grouped_byte_streams, study, dates)
+                assert previous == grouped, "output differs"
+            print("output is identical.")
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
@@ -0,0 +1,143 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import pytz
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.dashboard_api import (dashboard_chunkregistry_date_query,
+    dashboard_chunkregistry_participant_date_query, dashboard_chunkregistry_stream_daily_bytes_query)
+from constants.data_stream_constants import ALL_DATA_STREAMS
+from database.common_models import generate_objectid_string
+from database.data_access_models import ChunkRegistry, DataExtent
+from database.study_models import Study
+from database.user_models import Participant
+
+
+"""
+Measures the data layer of the participant dashboard (dashboard_participant_page) for a participant
+with 50,000 chunks, hourly chunks of 20 data streams over 104 days, showing a 14 day window.
+Compares the previous implementation (every chunk of the participant and every time bin of the
+study loaded into python, then a scan of the chunks for every data stream and date) against Min/Max
+aggregates and a single GROUP BY query over the window, and asserts that the output is identical.
+(The template rendering that follows is unchanged.)
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.
+
+Run with `python run_script.py benchmark_dashboard_participant`.
+"""
+
+NUMBER_OF_STREAMS = len(ALL_DATA_STREAMS)
+NUMBER_OF_HOURS = 2500
+WINDOW_DAYS = 14
+FIRST_DAY = date(2021, 1, 1)
+
+
+class Rollback(Exception): pass
+
+
+def make_participant() -> Participant:
+    study = Study.create_with_object_id(
+        name=f"dashboard benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    participant = Participant.objects.create(
+        patient_id="bmaaaaaa", study=study, os_type=Participant.ANDROID_API,
+        password="benchmark", salt="benchmark",
+    )
+    first_time_bin = pytz.utc.localize(datetime.combine(FIRST_DAY, datetime.min.time()))
+    for data_type in ALL_DATA_STREAMS:
+        ChunkRegistry.objects.bulk_create([
+            ChunkRegistry(
+                study=study, participant=participant, data_type=data_type, is_chunkable=True,
+                chunk_path=f"{study.object_id}/{participant.patient_id}/{data_type}/{hour}",
+                chunk_hash="benchmark", file_size=1000 + hour,
+                time_bin=first_time_bin + timedelta(hours=hour),
+            ) for hour in range(NUMBER_OF_HOURS)
+        ])
+    # bulk_create bypasses the file processing that keeps the extents of the data
+    last_time_bin = first_time_bin + timedelta(hours=NUMBER_OF_HOURS - 1)
+    DataExtent.record(study.pk, participant.pk, {
+        data_type: (first_time_bin, last_time_bin) for data_type in ALL_DATA_STREAMS
+    })
+    return participant
+
+
+def previous_byte_streams(participant: Participant, start: date, end: date):
+    chunks = list(
+        ChunkRegistry.objects.filter(participant__id=participant.id)
+        .extra(select={'data_stream': 'data_type', 'bytes': 'file_size'})
+        .values("bytes", "data_stream", "time_bin")
+    )
+    all_time_bins = list(
+        ChunkRegistry.objects.filter(study_id=participant.study_id)
+        .exclude(time_bin__lt=pytz.utc.localize(datetime(1970, 1, 2)))
+        .order_by("time_bin").values_list("time_bin", flat=True)
+    )
+    first_day = all_time_bins[0].date()
+    all_dates = sorted(
+        chunk["time_bin"].date() for chunk in chunks if chunk["time_bin"].date() >= first_day
+    )
+    extent = all_dates[0], all_dates[-1]
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    def get_bytes_data_stream_match(chunks, date, stream):
+        all_bytes = None
+        for chunk in chunks:
+            if (chunk["time_bin"]).date() == date and chunk["data_stream"] == stream:
+                if all_bytes is None:
+                    all_bytes = chunk.get("bytes", 0) or 0
+                else:
+                    all_bytes += chunk.get("bytes", 0) or 0
+        return all_bytes
+
+    return extent, {
+        stream: [get_bytes_data_stream_match(chunks, date, stream) for date in dates]
+        for stream in ALL_DATA_STREAMS
+    }
+
+
+def grouped_byte_streams(participant: Participant, start: date, end: date):
+    first_day, _ = dashboard_chunkregistry_date_query(participant.study_id)
+    extent = dashboard_chunkregistry_participant_date_query(participant.id, first_day)
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    daily_bytes = dashboard_chunkregistry_stream_daily_bytes_query(participant.id, dates)
+    return extent, {
+        stream: [daily_bytes.get((stream, date)) for date in dates] for stream in ALL_DATA_STREAMS
+    }
+
+
+def measure(label: str, function, participant: Participant, start: date, end: date):
+    with CaptureQueriesContext(connection) as queries:
+        t_start = perf_counter()
+        result = function(participant, start, end)
+        elapsed = perf_counter() - t_start
+    print(f"{label}: {elapsed:.3f} seconds, {len(queries)} queries")
+    return result
+
+
+def run():
+    try:
+        with transaction.atomic():
+            print(f"creating a participant with {NUMBER_OF_STREAMS * NUMBER_OF_HOURS} chunks...")
+            participant = make_participant()
+            end = FIRST_DAY + timedelta(days=(NUMBER_OF_HOURS - 1) // 24)
+            start = end - timedelta(days=WINDOW_DAYS - 1)
+
+            previous = measure("previous", previous_byte_streams, participant, start, end)
+            grouped = measure("aggregated", grouped_byte_streams, participant, start, end)
+            assert previous == grouped, "output differs"
+            print("output is identical.")
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
@@ -0,0 +1,168 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import argv, path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import operator
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from api.dashboard_api import dashboard_chunkregistry_date_query
+from constants.data_stream_constants import ACCELEROMETER, GPS, GYRO, POWER_STATE, WIFI
+from database.common_models import generate_objectid_string
+from database.data_access_models import ChunkRegistry, DataExtent
+from database.study_models import Study
+from database.user_models import Participant
+
+
+"""
+Measures the queries for the first and last time bins of a study's data on a study with 20,000,000
+ChunkRegistry rows (Study.get_earliest_data_time_bin and get_latest_data_time_bin, called by the
+Forest analysis progress page, and dashboard_chunkregistry_date_query of the dashboard), comparing:
+    the previous implementation (every time bin of the study is loaded and compared in python, the
+        dashboard used an aggregate over every chunk of the study),
+    an aggregate over the chunks of the study, which the (study, time_bin) index makes an index
+        lookup (the fallback for data from the future),
+    the DataExtent lookup.
+It also measures DataExtent.recalculate of every participant, the cost of the migration's backfill.
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.  Creating the rows takes a while, a smaller study can be measured by
+passing the number of chunks.
+
+Run with `python run_script.py benchmark_data_extent [number of chunks]`.
+"""
+
+# through run_script.py the script name is the first argument
+ARGUMENTS = argv[2:] if argv[0].endswith("run_script.py") else argv[1:]
+NUMBER_OF_CHUNKS = int(ARGUMENTS[0]) if ARGUMENTS else 20_000_000
+NUMBER_OF_PARTICIPANTS = 200
+DATA_TYPES = [ACCELEROMETER, GPS, GYRO, POWER_STATE, WIFI]
+FIRST_TIME_BIN = datetime(2019, 1, 1, tzinfo=timezone.utc)
+BATCH_SIZE = 10000
+
+
+class Rollback(Exception): pass
+
+
+def make_study() -> Study:
+    study = Study.create_with_object_id(
+        name=f"data extent benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    Participant.objects.bulk_create([
+        Participant(
+            patient_id=f"e{i:07d}", study=study, os_type=Participant.ANDROID_API,
+            password="benchmark", salt="benchmark",
+        ) for i in range(NUMBER_OF_PARTICIPANTS)
+    ])
+    return study
+
+
+def chunks(study: Study):
+    """ Hourly chunks of every data type for every participant, and a chunk from 1970 and one from
+    the future (devices with broken clocks) for each participant. """
+    participant_ids = list(study.participants.values_list("pk", flat=True))
+    hours = NUMBER_OF_CHUNKS // (len(participant_ids) * len(DATA_TYPES))
+    for participant_id in participant_ids:
+        for data_type in DATA_TYPES:
+            for hour in range(hours):
+                yield participant_id, data_type, FIRST_TIME_BIN + timedelta(hours=hour)
+        yield participant_id, GPS, datetime(1970, 1, 1, 1, tzinfo=timezone.utc)
+        yield participant_id, GPS, timezone.now() + timedelta(days=365)
+
+
+def populate(study: Study):
+    t_start = perf_counter()
+    batch = []
+    count = 0
+    for participant_id, data_type, time_bin in chunks(study):
+        batch.append(ChunkRegistry(
+            is_chunkable=True, chunk_path=f"{study.object_id}/{count}", chunk_hash="",
+            data_type=data_type, time_bin=time_bin, study_id=study.pk,
+            participant_id=participant_id, file_size=100,
+        ))
+        count += 1
+        if len(batch) == BATCH_SIZE:
+            ChunkRegistry.objects.bulk_create(batch)
+            batch = []
+            if count % 1_000_000 == 0:
+                print(f"{count} chunks created, {perf_counter() - t_start:.0f} seconds")
+    ChunkRegistry.objects.bulk_create(batch)
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ChunkRegistry._meta.db_table}")
+    print(f"{count} chunks created, {perf_counter() - t_start:.0f} seconds")
+
+
+def previous_get_data_time_bin(study: Study, earliest: bool):
+    # the previous implementation of Study._get_data_time_bin, with its default arguments.
+    comparator = operator.lt if earliest else operator.gt
+    now = timezone.now()
+    desired_time_bin = None
+    for time_bin in study.chunk_registries.values_list("time_bin", flat=True):
+        if time_bin.timestamp() <= 0 or time_bin > now:
+            continue
+        if desired_time_bin is None or not comparator(desired_time_bin, time_bin):
+            desired_time_bin = time_bin
+    return desired_time_bin
+
+
+def previous_dashboard_date_query(study: Study):
+    extent = ChunkRegistry.objects.filter(study_id=study.pk) \
+        .exclude(time_bin__lt=datetime(1970, 1, 2, tzinfo=timezone.utc)) \
+        .aggregate(first=Min("time_bin"), last=Max("time_bin"), count=Count("id"))
+    return extent["first"].date(), extent["last"].date()
+
+
+def indexed_get_data_time_bin(study: Study, earliest: bool):
+    # the fallback of Study._get_data_time_bin
+    time_bins = ChunkRegistry.objects.filter(
+        study_id=study.pk, time_bin__gt=datetime(1970, 1, 1, tzinfo=timezone.utc),
+        time_bin__lte=timezone.now(),
+    )
+    return time_bins.aggregate(
+        time_bin=Min("time_bin") if earliest else Max("time_bin")
+    )["time_bin"]
+
+
+def measure(label: str, function, *args):
+    t_start = perf_counter()
+    result = function(*args)
+    print(f"{label}: {(perf_counter() - t_start) * 1000:.1f}ms")
+    return result
+
+
+def run():
+    try:
+        with transaction.atomic():
+            study = make_study()
+            populate(study)
+            measure("DataExtent.recalculate (backfill)", DataExtent.recalculate,
+                    study.participants.values_list("pk", flat=True))
+
+            for earliest, label in ((True, "earliest"), (False, "latest")):
+                expected = measure(f"{label}, previous", previous_get_data_time_bin, study, earliest)
+                indexed = measure(
+                    f"{label}, indexed aggregate", indexed_get_data_time_bin, study, earliest
+                )
+                current = measure(f"{label}, current", study._get_data_time_bin, earliest)
+                assert expected == indexed == current, "output differs"
+
+            expected = measure("dashboard dates, previous", previous_dashboard_date_query, study)
+            current = measure(
+                "dashboard dates, current", dashboard_chunkregistry_date_query, study.pk
+            )
+            assert expected == current, "output differs"
+            print("output is identical.")
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
@@ -0,0 +1,64 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import random
+from os import urandom
+from time import perf_counter
+
+from Cryptodome.Cipher import AES
+
+from libs.encryption import DEVICE_LINE_BATCH_SIZE, decrypt_device_line, decrypt_device_lines
+from libs.security import encode_base64
+
+
+"""
+Compares line-by-line decryption of a device file (decrypt_device_line) against batched decryption
+(decrypt_device_lines) on a synthetic 50k line file, and asserts that the output is identical.
+
+Run with `python run_script.py benchmark_device_decryption`.
+"""
+
+NUMBER_OF_LINES = 50_000
+
+
+def make_device_lines(key: bytes):
+    random.seed(0)
+    lines = []
+    for i in range(NUMBER_OF_LINES):
+        # roughly the shape of a line of accelerometer data
+        data = b"%d,unknown,%.6f,%.6f,%.6f" % (
+            1_640_995_200_000 + i * 100,
+            random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1),
+        )
+        padding = 16 - len(data) % 16
+        iv = urandom(16)
+        encrypted = AES.new(key, AES.MODE_CBC, iv=iv).encrypt(data + bytes([padding]) * padding)
+        lines.append(encode_base64(iv) + b":" + encode_base64(encrypted))
+    return lines
+
+
+def run():
+    key = urandom(16)
+    print(f"generating {NUMBER_OF_LINES} lines...")
+    lines = make_device_lines(key)
+
+    t_start = perf_counter()
+    line_by_line = [decrypt_device_line("benchmark", key, line) for line in lines]
+    print(f"line by line: {perf_counter() - t_start:.3f} seconds")
+
+    t_start = perf_counter()
+    batched = []
+    for batch_start in range(0, len(lines), DEVICE_LINE_BATCH_SIZE):
+        batched.extend(
+            decrypt_device_lines(key, lines[batch_start:batch_start + DEVICE_LINE_BATCH_SIZE])
+        )
+    print(f"batched: {perf_counter() - t_start:.3f} seconds")
+
+    assert line_by_line == batched, "output differs"
+    print("output is identical.")
+
+
+run()
@@ -0,0 +1,219 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import json
+import re
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import perf_counter, sleep
+
+from Cryptodome.PublicKey import RSA
+from django.db import connection, transaction
+from django.utils import timezone
+from firebase_admin import messaging
+
+from constants.celery_constants import BACKEND_FIREBASE_CREDENTIALS
+from database.common_models import generate_objectid_string
+from database.schedule_models import AbsoluteSchedule, ArchivedEvent, ScheduledEvent
+from database.study_models import Study
+from database.survey_models import Survey
+from database.system_models import FileAsText
+from database.user_models import Participant, ParticipantFCMHistory
+from libs.celery_control import FalseCeleryApp
+from services.celery_push_notifications import (celery_send_push_notification,
+    celery_send_push_notification_batch)
+
+
+"""
+Compares the push notification send tasks end to end: celery_send_push_notification, one task and
+one request to firebase per notification, against celery_send_push_notification_batch, one task and
+one request per batch of 500 with bulk database updates.  The tasks run in this process (not through
+celery) against a local stand-in for the FCM endpoints.  The stand-in answers the oauth token, single
+send, and batch send endpoints, and waits SIMULATED_LATENCY_SECONDS before answering each http
+request to approximate the round trip to Google.  Reports the throughput and the database queries of
+each, including the credential check, the participant and schedule lookups, archiving the events,
+and the participant and fcm history updates.
+
+The synthetic study (a participant with an fcm token and a due survey per notification) is created
+in the configured database inside a transaction that is rolled back, nothing is left behind.
+
+Run with `python run_script.py benchmark_push_notification_batching`.
+"""
+
+NUMBER_OF_NOTIFICATIONS = 2000
+BATCH_SIZE = 500
+SIMULATED_LATENCY_SECONDS = 0.03
+PROJECT_ID = "benchmark-project"
+
+
+class Rollback(Exception): pass
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    message_count = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        sleep(SIMULATED_LATENCY_SECONDS)
+        if self.path == "/token":
+            self.respond("application/json", json.dumps(
+                {"access_token": "benchmark", "expires_in": 3600, "token_type": "Bearer"}
+            ).encode())
+        elif self.path == "/batch":
+            self.respond_to_batch(body)
+        else:
+            self.respond("application/json", json.dumps({"name": self.message_name()}).encode())
+
+    def respond_to_batch(self, body: bytes):
+        # every part of a batch request is an http request with a Content-ID, the response part for
+        # it has the Content-ID "response-" + the request's Content-ID.
+        parts = []
+        for content_id in re.findall(rb"Content-ID: <(.+?)>", body):
+            response_json = json.dumps({"name": self.message_name()})
+            parts.append(
+                b"Content-Type: application/http\r\n"
+                b"Content-ID: <response-" + content_id + b">\r\n\r\n"
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" +
+                response_json.encode() + b"\r\n"
+            )
+        boundary = b"batch_benchmark"
+        response = b"".join(b"--" + boundary + b"\r\n" + part for part in parts)
+        self.respond(
+            "multipart/mixed; boundary=" + boundary.decode(), response + b"--" + boundary + b"--\r\n"
+        )
+
+    def message_name(self) -> str:
+        FakeFCMHandler.message_count += 1
+        return f"projects/{PROJECT_ID}/messages/{FakeFCMHandler.message_count}"
+
+    def respond(self, content_type: str, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_fcm() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeFCMHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def fake_credentials(base_url: str) -> str:
+    """ Firebase credentials whose oauth token is requested from the stand-in. """
+    messaging._MessagingService.FCM_URL = base_url + "/v1/projects/{0}/messages:send"
+    messaging._MessagingService.FCM_BATCH_URL = base_url + "/batch"
+    return json.dumps({
+        "type": "service_account",
+        "project_id": PROJECT_ID,
+        "private_key": RSA.generate(2048).export_key().decode(),
+        "client_email": f"benchmark@{PROJECT_ID}.iam.gserviceaccount.com",
+        "token_uri": base_url + "/token",
+    })
+
+
+def make_notifications():
+    """ A participant with an fcm token and a due survey per notification, returns the arguments
+    that the tasks are queued with. """
+    study = Study.create_with_object_id(
+        name=f"push notification benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    survey = Survey.objects.create(
+        study=study, survey_type=Survey.TRACKING_SURVEY, object_id=generate_objectid_string()
+    )
+    schedule = AbsoluteSchedule.objects.create(survey=survey, date=date.today(), hour=0, minute=0)
+    Participant.objects.bulk_create([
+        Participant(
+            patient_id=f"pn{i}".replace("0", "a"), study=study, os_type=Participant.ANDROID_API,
+            password="benchmark", salt="benchmark",
+        ) for i in range(NUMBER_OF_NOTIFICATIONS)
+    ])
+    participants = list(study.participants.order_by("pk"))
+    ParticipantFCMHistory.objects.bulk_create([
+        ParticipantFCMHistory(participant=participant, token=f"benchmark_token_{participant.pk}")
+        for participant in participants
+    ])
+    ScheduledEvent.objects.bulk_create([
+        ScheduledEvent(
+            survey=survey, participant=participant, absolute_schedule=schedule,
+            scheduled_time=timezone.now() - timedelta(minutes=1),
+        ) for participant in participants
+    ])
+    events = ScheduledEvent.objects.filter(survey=survey).values_list("participant_id", "pk")
+    return [
+        (f"benchmark_token_{participant_id}", [survey.object_id], [pk])
+        for participant_id, pk in events
+    ]
+
+
+def task_function(task):
+    # without a celery configuration tasks are FalseCeleryApps, see libs/celery_control.py
+    return task.an_function if isinstance(task, FalseCeleryApp) else task.run
+
+
+class QueryCounter:
+    # (django's query log keeps only the last 9000 queries, too few for a benchmark of this size)
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(label: str, send):
+    try:
+        with transaction.atomic():
+            notifications = make_notifications()
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                t_start = perf_counter()
+                send(notifications)
+                elapsed = perf_counter() - t_start
+            sent = ArchivedEvent.objects.filter(
+                participant__study__name__startswith="push notification benchmark",
+                status=ArchivedEvent.SUCCESS,
+            ).count()
+            assert sent == NUMBER_OF_NOTIFICATIONS, f"{sent} notifications sent"
+            print(f"{label}: {NUMBER_OF_NOTIFICATIONS / elapsed:.0f} notifications/second, "
+                  f"{queries.count / NUMBER_OF_NOTIFICATIONS:.2f} queries per notification")
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+def send_one_at_a_time(notifications):
+    send = task_function(celery_send_push_notification)
+    for notification in notifications:
+        send(*notification)
+
+
+def send_batched(notifications):
+    send = task_function(celery_send_push_notification_batch)
+    for i in range(0, len(notifications), BATCH_SIZE):
+        send(notifications[i:i + BATCH_SIZE])
+
+
+def run():
+    try:
+        with transaction.atomic():
+            FileAsText.objects.create(
+                tag=BACKEND_FIREBASE_CREDENTIALS, text=fake_credentials(start_fake_fcm())
+            )
+            measure("one at a time", send_one_at_a_time)
+            measure(f"batches of {BATCH_SIZE}", send_batched)
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
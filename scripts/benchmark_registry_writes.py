@@ -0,0 +1,164 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from datetime import datetime
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM
+from constants.data_stream_constants import GPS, SURVEY_ANSWERS
+from database.common_models import generate_objectid_string
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+from libs.security import chunk_hash
+
+
+"""
+Counts the database queries of the ChunkRegistry writes made by data processing, per processed
+file, comparing the previous implementation (every write runs full_clean, which queries the database
+for the unique chunk_path and for every foreign key) against the current one (unvalidated writes
+that rely on the database constraints, an upsert for unchunkable files).
+
+Three kinds of file are measured: a chunkable file that creates new chunks, a chunkable file that is
+appended to existing chunks, and an unchunkable file that is uploaded twice.
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.
+
+Run with `python run_script.py benchmark_registry_writes`.
+"""
+
+NUMBER_OF_FILES = 200
+CHUNKS_PER_FILE = 3
+CONTENTS = b"timestamp,value\n" + b"1600000000000,1\n" * 100
+
+
+class Rollback(Exception): pass
+
+
+def make_participant() -> Participant:
+    study = Study.create_with_object_id(
+        name=f"registry benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    return Participant.objects.create(
+        patient_id="bmaaaaaa", study=study, os_type=Participant.ANDROID_API,
+        password="benchmark", salt="benchmark",
+    )
+
+
+def time_bin_number(file_number: int, chunk_number: int) -> int:
+    return 444444 + file_number * CHUNKS_PER_FILE + chunk_number
+
+
+def time_bin_datetime(time_bin: int) -> datetime:
+    return timezone.make_aware(
+        datetime.utcfromtimestamp(time_bin * CHUNK_TIMESLICE_QUANTUM), timezone.utc
+    )
+
+
+def chunk_path(participant: Participant, label: str, file_number: int, chunk_number: int) -> str:
+    return f"{label}/{participant.patient_id}/gps/{file_number}/{chunk_number}.csv"
+
+
+def previous_register_chunked_data(participant: Participant, file_number: int):
+    for chunk_number in range(CHUNKS_PER_FILE):
+        ChunkRegistry.objects.create(  # full_clean
+            is_chunkable=True,
+            chunk_path=chunk_path(participant, "previous", file_number, chunk_number),
+            chunk_hash=chunk_hash(CONTENTS).decode(),
+            data_type=GPS,
+            time_bin=time_bin_datetime(time_bin_number(file_number, chunk_number)),
+            study_id=participant.study_id,
+            participant_id=participant.pk,
+            file_size=len(CONTENTS),
+        )
+
+
+def current_register_chunked_data(participant: Participant, file_number: int):
+    for chunk_number in range(CHUNKS_PER_FILE):
+        ChunkRegistry.register_chunked_data(
+            data_type=GPS,
+            time_bin=time_bin_number(file_number, chunk_number),
+            chunk_path=chunk_path(participant, "current", file_number, chunk_number),
+            file_contents=CONTENTS,
+            study_id=participant.study_id,
+            participant_id=participant.pk,
+        )
+
+
+def update_chunks(label: str, validate: bool):
+    def update(participant: Participant, file_number: int):
+        for chunk_number in range(CHUNKS_PER_FILE):
+            path = chunk_path(participant, label, file_number, chunk_number)
+            chunk = ChunkRegistry.objects.get(chunk_path=path)  # the uploader's lookup
+            chunk.file_size = len(CONTENTS) * 2
+            if validate:
+                chunk.chunk_hash = chunk_hash(CONTENTS * 2).decode()
+                chunk.save()  # full_clean
+            else:
+                chunk.update_chunk(CONTENTS * 2)
+    return update
+
+
+def previous_register_unchunked_data(participant: Participant, file_number: int):
+    # the previous implementation detected a re-upload through the ValidationError of full_clean.
+    path = f"previous/{participant.patient_id}/surveyAnswers/{file_number}.csv"
+    for _ in range(2):
+        try:
+            ChunkRegistry.objects.create(
+                is_chunkable=False, chunk_path=path, chunk_hash="", data_type=SURVEY_ANSWERS,
+                time_bin=time_bin_datetime(time_bin_number(file_number, 0)),
+                study_id=participant.study_id, participant_id=participant.pk,
+                file_size=len(CONTENTS),
+            )
+        except ValidationError:
+            chunk = ChunkRegistry.objects.get(chunk_path=path)
+            chunk.file_size = len(CONTENTS)
+            chunk.save()
+
+
+def current_register_unchunked_data(participant: Participant, file_number: int):
+    path = f"current/{participant.patient_id}/surveyAnswers/{file_number}.csv"
+    for _ in range(2):
+        ChunkRegistry.register_unchunked_data(
+            SURVEY_ANSWERS, time_bin_number(file_number, 0) * CHUNK_TIMESLICE_QUANTUM, path,
+            participant.study_id, participant.pk, CONTENTS,
+        )
+
+
+def measure(label: str, function, participant: Participant):
+    with CaptureQueriesContext(connection) as queries:
+        t_start = perf_counter()
+        for file_number in range(NUMBER_OF_FILES):
+            function(participant, file_number)
+        elapsed = perf_counter() - t_start
+    print(f"{label}: {len(queries) / NUMBER_OF_FILES:.1f} queries per file, "
+          f"{elapsed / NUMBER_OF_FILES * 1000:.2f}ms per file")
+
+
+def run():
+    try:
+        with transaction.atomic():
+            participant = make_participant()
+            print(f"{NUMBER_OF_FILES} files, {CHUNKS_PER_FILE} chunks per chunkable file")
+            measure("new chunks, previous", previous_register_chunked_data, participant)
+            measure("new chunks, current", current_register_chunked_data, participant)
+            measure("appended chunks, previous", update_chunks("previous", True), participant)
+            measure("appended chunks, current", update_chunks("current", False), participant)
+            measure("unchunkable re-upload, previous", previous_register_unchunked_data, participant)
+            measure("unchunkable re-upload, current", current_register_unchunked_data, participant)
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
@@ -0,0 +1,103 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from datetime import date, timedelta
+from time import perf_counter
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from database.common_models import generate_objectid_string
+from database.schedule_models import (AbsoluteSchedule, Intervention, InterventionDate,
+    RelativeSchedule, ScheduledEvent, WeeklySchedule)
+from database.study_models import Study
+from database.survey_models import Survey
+from database.user_models import Participant
+from libs.push_notification_helpers import repopulate_all_survey_scheduled_events
+
+
+"""
+Measures survey schedule repopulation on a synthetic study of 5,000 participants and 20 surveys
+(weekly, absolute, and relative schedules, every participant has an intervention date).  Reports the
+time and number of queries of populating every event, of repopulating the study when nothing has
+changed (e.g. saving a survey without changing its schedule), and of repopulating one participant
+(what register_user does).
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.
+
+Run with `python run_script.py benchmark_schedule_repopulation`.
+"""
+
+NUMBER_OF_PARTICIPANTS = 5000
+NUMBER_OF_SURVEYS = 20
+
+
+class Rollback(Exception): pass
+
+
+def make_study() -> Study:
+    study = Study.create_with_object_id(
+        name=f"schedule benchmark {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+        timezone_name="America/New_York",
+    )
+    intervention = Intervention.objects.create(study=study, name="benchmark intervention")
+    participants = Participant.objects.bulk_create([
+        Participant(
+            patient_id=f"bm{i:06d}", study=study, os_type=Participant.ANDROID_API,
+            password="benchmark", salt="benchmark",
+        ) for i in range(NUMBER_OF_PARTICIPANTS)
+    ])
+    if participants[0].pk is None:  # backends that don't return pks from bulk_create
+        participants = list(study.participants.all())
+    InterventionDate.objects.bulk_create([
+        InterventionDate(
+            participant=participant, intervention=intervention,
+            date=date.today() + timedelta(days=i % 30),
+        ) for i, participant in enumerate(participants)
+    ])
+
+    for i in range(NUMBER_OF_SURVEYS):
+        survey = Survey(study=study, survey_type=Survey.TRACKING_SURVEY, object_id=generate_objectid_string())
+        survey.save()
+        if i % 3 == 0:
+            WeeklySchedule.objects.create(survey=survey, day_of_week=i % 7, hour=9, minute=0)
+        elif i % 3 == 1:
+            AbsoluteSchedule.objects.create(
+                survey=survey, date=date.today() + timedelta(days=i), hour=9, minute=0
+            )
+        else:
+            RelativeSchedule.objects.create(
+                survey=survey, intervention=intervention, days_after=i, hour=9, minute=0
+            )
+    return study
+
+
+def measure(label: str, study: Study, participant: Participant = None):
+    with CaptureQueriesContext(connection) as queries:
+        t_start = perf_counter()
+        repopulate_all_survey_scheduled_events(study, participant)
+        elapsed = perf_counter() - t_start
+    print(f"{label}: {elapsed:.2f} seconds, {len(queries)} queries, "
+          f"{ScheduledEvent.objects.filter(survey__study=study).count()} events")
+
+
+def run():
+    try:
+        with transaction.atomic():
+            print(f"creating a study with {NUMBER_OF_PARTICIPANTS} participants and "
+                  f"{NUMBER_OF_SURVEYS} surveys...")
+            study = make_study()
+            measure("populating every event", study)
+            measure("repopulating, nothing changed", study)
+            measure("repopulating one participant", study, study.participants.first())
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
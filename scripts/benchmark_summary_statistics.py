@@ -0,0 +1,117 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from datetime import date, timedelta
+from time import perf_counter
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from constants.data_stream_constants import ACCELEROMETER, GPS, POWER_STATE
+from database.common_models import generate_objectid_string
+from database.study_models import Study
+from database.tableau_api_models import SummaryStatisticDaily
+from database.user_models import Participant
+from libs.file_processing.data_qty_stats import daily_bytes_fields
+
+
+"""
+Measures the SummaryStatisticDaily writes of a data quantity backfill
+(scripts/populate_tableau_daily_bytes.py) for 1,000 participants with 30 days of data each.
+Compares the previous implementation (update_or_create per participant-day: a SELECT, full_clean,
+and an INSERT or UPDATE) against bulk_upsert_statistics, both for a first backfill (every
+statistic is new) and for a second one (every statistic exists), and asserts that the resulting
+rows are identical.
+
+The synthetic study is created in the configured database inside a transaction that is rolled back,
+nothing is left behind.
+
+Run with `python run_script.py benchmark_summary_statistics`.
+"""
+
+NUMBER_OF_PARTICIPANTS = 1000
+NUMBER_OF_DAYS = 30
+FIRST_DAY = date(2021, 1, 1)
+FIELDS = [f"beiwe_{data_type}_bytes" for data_type in (ACCELEROMETER, GPS, POWER_STATE)]
+
+
+class Rollback(Exception): pass
+
+
+def make_participants(label: str):
+    study = Study.create_with_object_id(
+        name=f"summary statistics benchmark {label} {generate_objectid_string()}",
+        encryption_key="thequickbrownfoxjumpsoverthelazy",
+    )
+    Participant.objects.bulk_create([
+        Participant(
+            patient_id=f"{label[0]}{i:07d}", study=study, os_type=Participant.ANDROID_API,
+            password="benchmark", salt="benchmark",
+        ) for i in range(NUMBER_OF_PARTICIPANTS)
+    ])
+    return list(study.participants.order_by("patient_id"))
+
+
+def daily_bytes(participant_number: int, day: int, generation: int):
+    return daily_bytes_fields({
+        ACCELEROMETER: 1000 * generation + participant_number + day,
+        GPS: 2000 * generation + day,
+        POWER_STATE: 300 * generation + participant_number,
+    })
+
+
+def previous_backfill(participants, generation: int):
+    for i, participant in enumerate(participants):
+        for day in range(NUMBER_OF_DAYS):
+            SummaryStatisticDaily.objects.update_or_create(
+                participant=participant,
+                date=FIRST_DAY + timedelta(days=day),
+                defaults=daily_bytes(i, day, generation),
+            )
+
+
+def bulk_backfill(participants, generation: int):
+    for i, participant in enumerate(participants):
+        SummaryStatisticDaily.bulk_upsert_statistics(
+            (participant.pk, FIRST_DAY + timedelta(days=day), daily_bytes(i, day, generation))
+            for day in range(NUMBER_OF_DAYS)
+        )
+
+
+def measure(label: str, function, participants, generation: int):
+    with CaptureQueriesContext(connection) as queries:
+        t_start = perf_counter()
+        function(participants, generation)
+        elapsed = perf_counter() - t_start
+    print(f"{label}: {elapsed:.2f} seconds, {len(queries)} queries")
+
+
+def rows(participants):
+    return [
+        tuple(row[1:]) for row in SummaryStatisticDaily.objects
+        .filter(participant__in=participants).order_by("participant__patient_id", "date")
+        .values_list("participant__patient_id", "date", *FIELDS)
+    ]
+
+
+def run():
+    try:
+        with transaction.atomic():
+            print(f"{NUMBER_OF_PARTICIPANTS} participants, {NUMBER_OF_DAYS} days...")
+            previous_participants = make_participants("previous")
+            bulk_participants = make_participants("bulk")
+
+            for generation, label in ((1, "new statistics"), (2, "existing statistics")):
+                measure(f"{label}, previous", previous_backfill, previous_participants, generation)
+                measure(f"{label}, bulk", bulk_backfill, bulk_participants, generation)
+                assert rows(previous_participants) == rows(bulk_participants), "output differs"
+            print("output is identical.")
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+run()
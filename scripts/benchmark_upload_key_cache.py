@@ -0,0 +1,81 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import argv, path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+from os import urandom
+from statistics import median
+from time import perf_counter
+
+from Cryptodome.Cipher import AES
+
+from database.user_models import Participant
+from libs.encryption import decrypt_device_file
+from libs.s3 import get_client_public_key, PRIVATE_KEY_CACHE
+from libs.security import encode_base64
+
+
+"""
+Measures the decryption stage of the mobile upload endpoint (api/mobile_api.upload) under a burst
+of uploads from one device, with and without the participant private key cache.  The rest of the
+upload endpoint (the S3 upload of the decrypted file, the FileToProcess entry) is unaffected by the
+cache and is not exercised, so this script does not write any data.
+
+Requires a working environment with S3 access and a participant with a key pair.
+
+Run with `python run_script.py benchmark_upload_key_cache <patient_id>`.
+"""
+
+BURST_SIZE = 50
+LINES_PER_FILE = 100
+
+
+def make_device_file(participant: Participant) -> bytes:
+    """ Builds a file in the format devices upload: the first line is the AES key, base64 encoded,
+    RSA encrypted with the participant's public key, base64 encoded again.  Every other line is
+    base64(iv):base64(AES CBC encrypted, PKCS5 padded data). """
+    public_key = get_client_public_key(participant.patient_id, participant.study.object_id)
+    aes_key = urandom(16)
+    lines = [encode_base64(public_key.encrypt(encode_base64(aes_key), 0)[0])]
+    for i in range(LINES_PER_FILE):
+        data = b"%d,some,row,of,data" % (1_600_000_000_000 + i)
+        padding = 16 - len(data) % 16
+        iv = urandom(16)
+        encrypted = AES.new(aes_key, AES.MODE_CBC, iv=iv).encrypt(data + bytes([padding]) * padding)
+        lines.append(encode_base64(iv) + b":" + encode_base64(encrypted))
+    return b"\n".join(lines)
+
+
+def run_burst(participant: Participant, device_file: bytes, clear_cache: bool):
+    latencies = []
+    for i in range(BURST_SIZE):
+        if clear_cache:
+            PRIVATE_KEY_CACHE.clear()
+        t_start = perf_counter()
+        decrypt_device_file(f"benchmark_{i}.csv", device_file, participant)
+        latencies.append(perf_counter() - t_start)
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"  p50: {median(latencies) * 1000:.1f}ms, p99: {p99 * 1000:.1f}ms")
+
+
+def run():
+    # through run_script.py the script name is the first argument
+    arguments = argv[2:] if argv[0].endswith("run_script.py") else argv[1:]
+    if len(arguments) != 1:
+        print("usage: python run_script.py benchmark_upload_key_cache <patient_id>")
+        return
+
+    participant = Participant.objects.get(patient_id=arguments[0])
+    device_file = make_device_file(participant)
+
+    print(f"{BURST_SIZE} uploads of {LINES_PER_FILE} lines, key retrieved on every upload:")
+    run_burst(participant, device_file, clear_cache=True)
+    print(f"{BURST_SIZE} uploads of {LINES_PER_FILE} lines, with the private key cache:")
+    run_burst(participant, device_file, clear_cache=False)
+    print(PRIVATE_KEY_CACHE.stats())
+
+
+run()
@@ -8,7 +8,8 @@ from typing import List
 from collections import Counter
 
 from constants.data_stream_constants import CHUNKABLE_FILES
-from database.data_access_models import ChunkRegistry, FileToProcess
+from database.data_access_models import ChunkRegistry
+from libs.file_processing.reprocess_originals import reprocess_originals_from_chunk_paths
 
 print("""
 This script can take quite a while to run, it depends on the size of the ChunkRegistry database table.
@@ -71,6 +72,7 @@ def get_duplicates() -> (List[str], List[str]):
 
 
 def fix_duplicates(duplicate_chunks):
+    chunkable_paths = []
     for path in duplicate_chunks:
 
         # deconstruct relevant information from chunk path, clean it
@@ -86,16 +88,13 @@ def fix_duplicates(duplicate_chunks):
         # not all files are chunkable, they will require different logic.
         if data_stream not in CHUNKABLE_FILES:
             remove_all_but_one_chunk(path)
-            continue
         else:
-            try:
-                FileToProcess.reprocess_originals_from_chunk_path(path)
-            except Exception as e:
-                if "did not find any matching files" in str(e):
-                    pass
-                else:
-                    raise
-            remove_all_but_one_chunk(path)
+            chunkable_paths.append(path)
+
+    # the original files of the chunks are found concurrently and queued for processing in batches.
+    reprocess_originals_from_chunk_paths(chunkable_paths)
+    for path in chunkable_paths:
+        remove_all_but_one_chunk(path)
 
 
 
@@ -30,19 +30,21 @@ def calculate_data_quantity_stats(participant: Participant):
     # days_readable = ",".join(day.isoformat() for day in days)
     # print(f"updating {len(days)} daily summaries: {days_readable}")
     
-    # For each date, create a DataQuantity object
-    for day, day_data in daily_data_quantities.items():
-        data_quantity = {"participant": participant, "date": day, "defaults": {}}
-        for data_type, total_bytes in day_data.items():
-            data_quantity["defaults"][f"beiwe_{data_type}_bytes"] = total_bytes
-        
-        # if something fails we need the data_quantity dict contents
-        try:
-            SummaryStatisticDaily.objects.update_or_create(**data_quantity)
-        except Exception:
-            from pprint import pprint
-            pprint(data_quantity)
-            raise
+    # Create or update a SummaryStatisticDaily for every date
+    statistics = [
+        (participant.pk, day, {
+            f"beiwe_{data_type}_bytes": total_bytes for data_type, total_bytes in day_data.items()
+        })
+        for day, day_data in daily_data_quantities.items()
+    ]
+    
+    # if something fails we need the statistics
+    try:
+        SummaryStatisticDaily.bulk_upsert_statistics(statistics)
+    except Exception:
+        from pprint import pprint
+        pprint(statistics)
+        raise
 
 
 for participant in Participant.objects.all():
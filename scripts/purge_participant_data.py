@@ -19,7 +19,7 @@ from config.settings import S3_BUCKET
 from constants.data_processing_constants import CHUNKS_FOLDER
 from constants.datetime_constants import API_TIME_FORMAT
 from database.user_models import Participant
-from database.data_access_models import ChunkRegistry
+from database.data_access_models import ChunkRegistry, DataExtent
 from libs.s3 import s3_list_files, s3_list_versions, conn as s3_conn
 
 UNIX_EPOCH_START = datetime(1970,1,1)
@@ -115,6 +115,7 @@ def delete_chunk_registries(sorted_data):
         date = convert_date(date)
         participant = Participant.objects.filter(patient_id=patient_id)
         ChunkRegistry.objects.filter(participant=participant, time_bin__gte=date).delete()
+        DataExtent.recalculate(participant.values_list("pk", flat=True))
 
 
 def assemble_deletable_files(sorted_data):
@@ -9,6 +9,7 @@ from libs.http_utils import easy_url
 
 
 class ForestTaskBaseSerializer(serializers.ModelSerializer):
+    cache_hit_rate_display = serializers.SerializerMethodField()
     created_on_display = serializers.SerializerMethodField()
     forest_tree_display = serializers.SerializerMethodField()
     forest_output_exists_display = serializers.SerializerMethodField()
@@ -20,6 +21,8 @@ class ForestTaskBaseSerializer(serializers.ModelSerializer):
     class Meta:
         model = ForestTask
         fields = [
+            "cache_hit_rate_display",
+            "cached_file_size",
             "created_on_display",
             "data_date_end",
             "data_date_start",
@@ -39,6 +42,11 @@ class ForestTaskBaseSerializer(serializers.ModelSerializer):
         ]
 
 
+    def get_cache_hit_rate_display(self, instance):
+        if instance.cache_hit_rate is None:
+            return None
+        return f"{instance.cache_hit_rate:.0%}"
+
     def get_created_on_display(self, instance):
         return instance.created_on.strftime(DEV_TIME_FORMAT)
 
@@ -1,10 +1,14 @@
 from datetime import datetime, timedelta
 
+from django.utils import timezone
+
 from config.settings import FILE_PROCESS_PAGE_SIZE
 from constants.celery_constants import DATA_PROCESSING_CELERY_QUEUE
+from database.data_access_models import ChunkRegistry
 from database.user_models import Participant
 from libs.celery_control import (get_processing_active_job_ids, processing_celery_app,
     safe_apply_async)
+from libs.file_processing.data_qty_stats import reconcile_data_quantity_stats
 from libs.file_processing.file_processing_core import do_process_user_file_chunks
 from libs.sentry import make_error_sentry, SentryTypes
 
@@ -58,6 +62,25 @@ def create_file_processing_tasks():
         print(f"{len(participants_to_process)} users queued for processing")
 
 
+def reconcile_data_quantity_statistics():
+    """ Data processing keeps the data quantity statistics up to date incrementally.  This runs
+    daily and verifies the statistics of every day with chunks registered or updated in the last
+    day (with an hour of overlap) against the chunk registry, correcting any that have drifted
+    (e.g. after a failure between an upload and its statistics update).  Days are found through
+    their chunks, so the statistics of a day whose chunks were deleted are not revisited. """
+    since = timezone.now() - timedelta(hours=25)
+    with make_error_sentry(sentry_type=SentryTypes.data_processing):
+        participant_ids = list(
+            ChunkRegistry.objects.filter(last_updated__gte=since)
+            .order_by().values_list("participant_id", flat=True).distinct()
+        )
+        corrected_days = 0
+        for participant in Participant.objects.filter(pk__in=participant_ids):
+            corrected_days += reconcile_data_quantity_stats(participant, since)
+        print(f"reconciled data quantity statistics of {len(participant_ids)} participants, "
+              f"{corrected_days} days corrected")
+
+
 @processing_celery_app.task(queue=DATA_PROCESSING_CELERY_QUEUE)
 def celery_process_file_chunks(participant_id):
     """ This is the function is queued up, it runs through all new uploads from a specific user and
@@ -16,6 +16,7 @@ from constants.forest_constants import ForestTaskStatus, ForestTree
 from database.data_access_models import ChunkRegistry
 from database.tableau_api_models import ForestTask
 from libs.celery_control import forest_celery_app, safe_apply_async
+from libs.chunk_cache import FOREST_CHUNK_CACHE
 from libs.s3 import s3_retrieve
 from libs.sentry import make_error_sentry, SentryTypes
 from libs.streaming_zip import determine_file_name
@@ -109,7 +110,10 @@ def celery_run_forest(forest_task_id):
         # Download data
         create_local_data_files(task, chunks)
         task.process_download_end_time = timezone.now()
-        task.save(update_fields=["process_download_end_time"])
+        task.save(update_fields=[
+            "process_download_end_time", "cached_file_count", "downloaded_file_count",
+            "cached_file_size",
+        ])
         log("task.process_download_end_time:", task.process_download_end_time.isoformat())
         
         # Run Forest
@@ -167,25 +171,43 @@ def celery_run_forest(forest_task_id):
 def create_local_data_files(task, chunks):
     # downloading data is highly threadable and can be the majority of the run time. 4 works for
     # most files, a very high small file count can make use of 10+ before we are cpu limited.
+    cached_file_count = downloaded_file_count = cached_file_size = 0
     with ThreadPool(4) as pool:
-        for _ in pool.imap_unordered(
+        for cached_size in pool.imap_unordered(
             func=batch_create_file,
             iterable=[(task, chunk) for chunk in chunks
             .values("study__object_id", *CHUNK_FIELDS)],
         ):
-            pass
+            if cached_size is None:
+                downloaded_file_count += 1
+            else:
+                cached_file_count += 1
+                cached_file_size += cached_size
+    
+    task.cached_file_count = cached_file_count
+    task.downloaded_file_count = downloaded_file_count
+    task.cached_file_size = cached_file_size
+    log(f"{cached_file_count} files ({cached_file_size} bytes) from the chunk cache, "
+        f"{downloaded_file_count} files downloaded")
+    FOREST_CHUNK_CACHE.evict()
+
 
 def batch_create_file(singular_task_chunk):
+    """ Places a chunk in the task's input folder, returns its size if it came from the chunk cache,
+    None if it was downloaded. """
     task: ForestTask  # chunk is a values dict
     task, chunk = singular_task_chunk
-    contents = s3_retrieve(chunk["chunk_path"], chunk["study__object_id"], raw_path=True)
     file_name = os.path.join(
         task.data_input_path,
         determine_file_name(chunk),
     )
     os.makedirs(os.path.dirname(file_name), exist_ok=True)
-    with open(file_name, "xb") as f:
-        f.write(contents)
+    cached_size = FOREST_CHUNK_CACHE.place(chunk, file_name)
+    if cached_size is not None:
+        return cached_size
+    contents = s3_retrieve(chunk["chunk_path"], chunk["study__object_id"], raw_path=True)
+    FOREST_CHUNK_CACHE.store(chunk, contents, file_name)
+    return None
 
 
 def enqueue_forest_task(**kwargs):
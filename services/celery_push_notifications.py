@@ -1,14 +1,18 @@
 import json
 import random
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, Iterable, List, Tuple
 
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from firebase_admin.messaging import (AndroidConfig, Message, Notification, QuotaExceededError,
-    send as send_notification, SenderIdMismatchError, ThirdPartyAuthError, UnregisteredError)
+    send as send_notification, send_all as send_notifications, SenderIdMismatchError,
+    ThirdPartyAuthError, UnregisteredError)
 
-from config.settings import BLOCK_QUOTA_EXCEEDED_ERROR, PUSH_NOTIFICATION_ATTEMPT_COUNT
+from config.settings import (BLOCK_QUOTA_EXCEEDED_ERROR, PUSH_NOTIFICATION_ATTEMPT_COUNT,
+    PUSH_NOTIFICATION_BATCH_SIZE, PUSH_NOTIFICATION_SCHEDULER_ENABLED)
 from constants.celery_constants import PUSH_NOTIFICATION_SEND_QUEUE, ScheduleTypes
 from constants.datetime_constants import API_TIME_FORMAT
 from constants.security_constants import OBJECT_ID_ALLOWED_CHARS
@@ -16,7 +20,7 @@ from database.schedule_models import ArchivedEvent, ScheduledEvent
 from database.user_models import Participant, ParticipantFCMHistory, PushNotificationDisabledEvent
 from libs.celery_control import push_send_celery_app, safe_apply_async
 from libs.firebase_config import check_firebase_instance
-from libs.push_notification_helpers import set_next_weekly
+from libs.push_notification_helpers import bulk_set_next_weekly
 from libs.sentry import make_error_sentry, SentryTypes
 
 
@@ -24,8 +28,9 @@ from libs.sentry import make_error_sentry, SentryTypes
 ############################# PUSH NOTIFICATIONS ###############################
 ################################################################################
 
-def get_surveys_and_schedules(now):
-    """ Mostly this function exists to reduce namespace clutter. """
+def get_surveys_and_schedules(now, schedule_pks: Iterable[int] = None):
+    """ Mostly this function exists to reduce namespace clutter.  schedule_pks optionally restricts
+    the query to those ScheduledEvents. """
     # get: schedule time is in the past for participants that have fcm tokens.
     # need to filter out unregistered fcms, database schema sucks for that, do it in python. its fine.
     query = ScheduledEvent.objects.filter(
@@ -35,7 +40,10 @@ def get_surveys_and_schedules(now):
         participant__deleted=False, survey__deleted=False,
         # Shouldn't be necessary, placeholder containing correct lte count.
         # participant__push_notification_unreachable_count__lte=PUSH_NOTIFICATION_ATTEMPT_COUNT
-    ).values_list(
+    )
+    if schedule_pks is not None:
+        query = query.filter(pk__in=schedule_pks)
+    query = query.values_list(
         "survey__object_id",
         "participant__fcm_tokens__token",
         "pk",
@@ -60,7 +68,10 @@ def get_surveys_and_schedules(now):
 
 def create_push_notification_tasks():
     # we reuse the high level strategy from data processing celery tasks, see that documentation.
-    expiry = (datetime.utcnow() + timedelta(minutes=5)).replace(second=30, microsecond=0)
+    if PUSH_NOTIFICATION_SCHEDULER_ENABLED:
+        print("The push notification scheduler is enabled, it queues notifications.")
+        return
+    
     now = timezone.now()
     surveys, schedules, patient_ids = get_surveys_and_schedules(now)
     print("Surveys:", surveys, sep="\n\t")
@@ -71,20 +82,42 @@ def create_push_notification_tasks():
         if not check_firebase_instance():
             print("Firebase is not configured, cannot queue notifications.")
             return
-        
-        # surveys and schedules are guaranteed to have the same keys, assembling the data structures
-        # is a pain, so it is factored out. sorry, but not sorry. it was a mess.
-        for fcm_token in surveys.keys():
-            print(f"Queueing up push notification for user {patient_ids[fcm_token]} for {surveys[fcm_token]}")
+        queue_push_notifications(surveys, schedules, patient_ids)
+
+
+def queue_push_notifications(surveys: dict, schedules: dict, patient_ids: dict):
+    """ Queues the celery tasks that send the notifications from get_surveys_and_schedules. """
+    expiry = (datetime.utcnow() + timedelta(minutes=5)).replace(second=30, microsecond=0)
+    
+    # surveys and schedules are guaranteed to have the same keys, assembling the data structures
+    # is a pain, so it is factored out. sorry, but not sorry. it was a mess.
+    if PUSH_NOTIFICATION_BATCH_SIZE:
+        fcm_tokens = list(surveys.keys())
+        for i in range(0, len(fcm_tokens), PUSH_NOTIFICATION_BATCH_SIZE):
+            batch = fcm_tokens[i:i + PUSH_NOTIFICATION_BATCH_SIZE]
+            print(f"Queueing up push notifications for users {[patient_ids[fcm_token] for fcm_token in batch]}")
             safe_apply_async(
-                celery_send_push_notification,
-                args=[fcm_token, surveys[fcm_token], schedules[fcm_token]],
+                celery_send_push_notification_batch,
+                args=[[[fcm_token, surveys[fcm_token], schedules[fcm_token]] for fcm_token in batch]],
                 max_retries=0,
                 expires=expiry,
                 task_track_started=True,
                 task_publish_retry=False,
                 retry=False,
             )
+        return
+    
+    for fcm_token in surveys.keys():
+        print(f"Queueing up push notification for user {patient_ids[fcm_token]} for {surveys[fcm_token]}")
+        safe_apply_async(
+            celery_send_push_notification,
+            args=[fcm_token, surveys[fcm_token], schedules[fcm_token]],
+            max_retries=0,
+            expires=expiry,
+            task_track_started=True,
+            task_publish_retry=False,
+            retry=False,
+        )
 
 
 @push_send_celery_app.task(queue=PUSH_NOTIFICATION_SEND_QUEUE)
@@ -101,7 +134,7 @@ def celery_send_push_notification(fcm_token: str, survey_obj_ids: List[str], sch
         
         # use the earliest timed schedule as our reference for the sent_time parameter.  (why?)
         participant = Participant.objects.get(patient_id=patient_id)
-        schedules = ScheduledEvent.objects.filter(pk__in=schedule_pks)
+        schedules = ScheduledEvent.objects.filter(pk__in=schedule_pks).select_related("survey")
         reference_schedule = schedules.order_by("scheduled_time").first()
         survey_obj_ids = list(set(survey_obj_ids))  # already deduped; whatever.
         
@@ -150,7 +183,7 @@ def celery_send_push_notification(fcm_token: str, survey_obj_ids: List[str], sch
             # This case occurs ever? is tested for in check_firebase_instance... weird race condition?
             # Error should be transient, and like all other cases we enqueue the next weekly surveys regardless.
             if "The default Firebase app does not exist" in str(e):
-                enqueue_weekly_surveys(participant, schedules)
+                enqueue_weekly_surveys([(participant, schedules)])
                 return
             else:
                 raise
@@ -162,11 +195,100 @@ def celery_send_push_notification(fcm_token: str, survey_obj_ids: List[str], sch
         success_send_handler(participant, fcm_token, schedules)
 
 
+@push_send_celery_app.task(queue=PUSH_NOTIFICATION_SEND_QUEUE)
+def celery_send_push_notification_batch(notifications: List[Tuple[str, List[str], List[int]]]):
+    """ Celery task that sends a batch of push notifications in one request to firebase.  Each
+    notification is a list of fcm token, survey object ids, schedule pks; the outcome of each is
+    handled exactly like celery_send_push_notification, with bulk database updates. """
+    with make_error_sentry(sentry_type=SentryTypes.data_processing):
+        if not check_firebase_instance():
+            print("Firebase credentials are not configured.")
+            return
+        
+        # one query for all the participants and one for all the schedules in the batch.
+        participants = {
+            fcm_history.token: fcm_history.participant for fcm_history in
+            ParticipantFCMHistory.objects.filter(token__in=[n[0] for n in notifications])
+            .select_related("participant")
+        }
+        all_schedules = ScheduledEvent.objects.select_related("survey").in_bulk(
+            [pk for _, _, schedule_pks in notifications for pk in schedule_pks]
+        )
+        
+        sends = []
+        messages = []
+        for fcm_token, survey_obj_ids, schedule_pks in notifications:
+            schedules = [all_schedules[pk] for pk in set(schedule_pks) if pk in all_schedules]
+            if fcm_token not in participants or not schedules:
+                continue  # the token or the schedules have been removed since the task was queued.
+            participant = participants[fcm_token]
+            # use the earliest timed schedule as our reference for the sent_time parameter.
+            reference_schedule = min(schedules, key=lambda schedule: schedule.scheduled_time)
+            sends.append((participant, fcm_token, schedules))
+            messages.append(build_push_notification_message(
+                participant, reference_schedule, list(set(survey_obj_ids)), fcm_token
+            ))
+        
+        if not messages:
+            return
+        
+        print(f"Sending {len(messages)} push notifications...")
+        try:
+            exceptions = [response.exception for response in send_notifications(messages).responses]
+        except Exception as e:
+            # the batch request itself failed, every notification in it failed with this error.
+            exceptions = [e] * len(messages)
+        
+        # error types are documented at firebase.google.com/docs/reference/fcm/rest/v1/ErrorCode
+        # see celery_send_push_notification for the details of each case.
+        successes, failures, unregistered_tokens, weekly_only, errors = [], [], [], [], []
+        for (participant, fcm_token, schedules), e in zip(sends, exceptions):
+            if e is None:
+                successes.append((participant, fcm_token, schedules))
+            elif isinstance(e, UnregisteredError):
+                unregistered_tokens.append(fcm_token)
+            elif isinstance(e, QuotaExceededError) and not BLOCK_QUOTA_EXCEEDED_ERROR:
+                errors.append(e)
+            elif isinstance(e, ValueError):
+                if "The default Firebase app does not exist" in str(e):
+                    weekly_only.append((participant, schedules))
+                else:
+                    errors.append(e)
+            else:
+                failures.append((participant, fcm_token, str(e), schedules))
+                if isinstance(e, ThirdPartyAuthError) \
+                        and str(e) != "Auth error from APNS or Web Push Service":
+                    errors.append(e)
+        
+        if unregistered_tokens:
+            ParticipantFCMHistory.objects.filter(token__in=unregistered_tokens) \
+                .update(unregistered=timezone.now())
+        if successes:
+            batch_success_send_handler(successes)
+        if failures:
+            batch_failed_send_handler(failures)
+        if weekly_only:
+            enqueue_weekly_surveys(weekly_only)
+        
+        # errors that require attention are raised once the whole batch has been handled.
+        if errors:
+            raise errors[0]
+
+
 def send_push_notification(
         participant: Participant, reference_schedule: ScheduledEvent, survey_obj_ids: List[str],
         fcm_token: str
 ):
     """ Contains the body of the code to send a notification  """
+    send_notification(
+        build_push_notification_message(participant, reference_schedule, survey_obj_ids, fcm_token)
+    )
+
+
+def build_push_notification_message(
+        participant: Participant, reference_schedule: ScheduledEvent, survey_obj_ids: List[str],
+        fcm_token: str
+) -> Message:
     # we include a nonce in case of notification deduplication.
     data_kwargs = {
         'nonce': ''.join(random.choice(OBJECT_ID_ALLOWED_CHARS) for _ in range(32)),
@@ -187,7 +309,7 @@ def send_push_notification(
             token=fcm_token,
             notification=Notification(title="Beiwe", body=display_message),
         )
-    send_notification(message)
+    return message
 
 
 def success_send_handler(participant: Participant, fcm_token: str, schedules: List[ScheduledEvent]):
@@ -204,8 +326,7 @@ def success_send_handler(participant: Participant, fcm_token: str, schedules: Li
     participant.push_notification_unreachable_count = 0
     participant.save()
     
-    create_archived_events(schedules, success=True, status=ArchivedEvent.SUCCESS)
-    enqueue_weekly_surveys(participant, schedules)
+    archive_and_enqueue_weekly_surveys([(participant, schedules, ArchivedEvent.SUCCESS)], success=True)
 
 
 def failed_send_handler(
@@ -238,24 +359,113 @@ def failed_send_handler(
         print(f"Participant {participant.patient_id} has had push notifications failures "
               f"incremented to {participant.push_notification_unreachable_count}.")
     
-    create_archived_events(schedules, success=False, created_on=now, status=error_message)
-    enqueue_weekly_surveys(participant, schedules)
+    archive_and_enqueue_weekly_surveys(
+        [(participant, schedules, error_message)], success=False, created_on=now
+    )
+
+
+def batch_success_send_handler(successes: List[Tuple[Participant, str, List[ScheduledEvent]]]):
+    """ success_send_handler for many sends, the participant and fcm history updates are bulk. """
+    print(f"Push notification send succeeded for {[s[0].patient_id for s in successes]}.")
+    
+    ParticipantFCMHistory.objects.filter(
+        token__in=[fcm_token for _, fcm_token, _ in successes], unregistered__isnull=False
+    ).update(unregistered=None)
+    Participant.objects.filter(pk__in=[participant.pk for participant, _, _ in successes]) \
+        .update(push_notification_unreachable_count=0)
+    
+    archive_and_enqueue_weekly_surveys(
+        [(participant, schedules, ArchivedEvent.SUCCESS) for participant, _, schedules in successes],
+        success=True,
+    )
+
+
+def batch_failed_send_handler(failures: List[Tuple[Participant, str, str, List[ScheduledEvent]]]):
+    """ failed_send_handler for many sends, the participant and fcm history updates are bulk.  A
+    participant's failures are handled in order, as if they were sent one at a time. """
+    now = timezone.now()
+    disabled, incremented = [], []
+    unreachable_counts: Dict[int, int] = {}  # participant pk: count after the failures so far
+    for failure in failures:
+        participant = failure[0]
+        count = unreachable_counts.get(
+            participant.pk, participant.push_notification_unreachable_count
+        )
+        if count >= PUSH_NOTIFICATION_ATTEMPT_COUNT:
+            disabled.append((failure, count))
+            unreachable_counts[participant.pk] = 0
+        else:
+            incremented.append(failure)
+            unreachable_counts[participant.pk] = count + 1
+    
+    if disabled:
+        ParticipantFCMHistory.objects.filter(
+            token__in=[fcm_token for (_, fcm_token, _, _), _ in disabled]
+        ).update(unregistered=now)
+        PushNotificationDisabledEvent.objects.bulk_create([
+            PushNotificationDisabledEvent(participant=participant, timestamp=now, count=count)
+            for (participant, _, _, _), count in disabled
+        ])
+        # disable the credential, the count restarts from the failures after it.
+        reset_pks = {participant.pk for (participant, _, _, _), _ in disabled}
+        for count in {unreachable_counts[pk] for pk in reset_pks}:
+            Participant.objects.filter(
+                pk__in=[pk for pk in reset_pks if unreachable_counts[pk] == count]
+            ).update(push_notification_unreachable_count=count)
+        print(f"Participants {[f[0].patient_id for f, _ in disabled]} have had push notifications "
+              f"disabled after {PUSH_NOTIFICATION_ATTEMPT_COUNT} failed attempts to send.")
+    else:
+        reset_pks = set()
+    
+    # the other participants' counts are incremented by their number of failures, atomically.
+    increments = Counter(f[0].pk for f in incremented if f[0].pk not in reset_pks)
+    for increment in set(increments.values()):
+        Participant.objects.filter(
+            pk__in=[pk for pk, amount in increments.items() if amount == increment]
+        ).update(
+            push_notification_unreachable_count=F("push_notification_unreachable_count") + increment
+        )
+    if incremented:
+        print(f"Participants {[f[0].patient_id for f in incremented]} have had push notifications "
+              f"failures incremented.")
+    
+    archive_and_enqueue_weekly_surveys(
+        [(participant, schedules, error_message)
+         for (participant, _, error_message, schedules), _ in disabled],
+        success=False,
+        created_on=now,
+    )
+    archive_and_enqueue_weekly_surveys(
+        [(participant, schedules, error_message)
+         for participant, _, error_message, schedules in incremented],
+        success=False,
+    )
 
 
-def create_archived_events(
-        schedules: List[ScheduledEvent], success: bool, status: str, created_on: datetime = None,
-    ):
-    """ Populates event history, successes will delete source ScheduledEvents. """
-    for schedule in schedules:
-        schedule.archive(self_delete=success, status=status, created_on=created_on)
+def archive_and_enqueue_weekly_surveys(
+        sends: List[Tuple[Participant, List[ScheduledEvent], str]], success: bool,
+        created_on: datetime = None,
+):
+    """ Populates event history for (participant, schedules, status) sends, successes will delete
+    source ScheduledEvents, then enqueues the next weekly surveys.  Done in bulk in one transaction. """
+    with transaction.atomic():
+        ScheduledEvent.bulk_archive(
+            [(schedule, status) for _, schedules, status in sends for schedule in schedules],
+            self_delete=success,
+            created_on=created_on,
+        )
+        enqueue_weekly_surveys([(participant, schedules) for participant, schedules, _ in sends])
 
 
-def enqueue_weekly_surveys(participant: Participant, schedules: List[ScheduledEvent]):
+def enqueue_weekly_surveys(participants_and_schedules: List[Tuple[Participant, List[ScheduledEvent]]]):
     # set_next_weekly is idempotent until the next weekly event passes.
     # its perfectly safe (commit time) to have many of the same weekly survey be scheduled at once.
-    for schedule in schedules:
-        if schedule.get_schedule_type() == ScheduleTypes.weekly:
-            set_next_weekly(participant, schedule.survey)
+    bulk_set_next_weekly(
+        (participant, schedule.survey)
+        for participant, schedules in participants_and_schedules for schedule in schedules
+        if schedule.get_schedule_type() == ScheduleTypes.weekly
+    )
 
 
 celery_send_push_notification.max_retries = 0  # requires the celerytask function object.
+celery_send_push_notification_batch.max_retries = 0
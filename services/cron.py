@@ -7,7 +7,8 @@ path.insert(0, abspath(__file__).rsplit('/', 2)[0])
 # start actual cron-related code here
 from sys import argv
 from cronutils import run_tasks
-from services.celery_data_processing import create_file_processing_tasks
+from services.celery_data_processing import (create_file_processing_tasks,
+    reconcile_data_quantity_statistics)
 from services.celery_push_notifications import create_push_notification_tasks
 from services.celery_forest import create_forest_celery_tasks
 
@@ -23,7 +24,7 @@ TASKS = {
     FIVE_MINUTES: [create_file_processing_tasks, create_push_notification_tasks, create_forest_celery_tasks],
     HOURLY: [],
     FOUR_HOURLY: [],
-    DAILY: [],
+    DAILY: [reconcile_data_quantity_statistics],
     WEEKLY: [],
     MONTHLY: [],
 }
@@ -0,0 +1,156 @@
+# add the root of the project into the path to allow cd-ing into this folder and running the script.
+from os.path import abspath
+from sys import path
+
+path.insert(0, abspath(__file__).rsplit('/', 2)[0])
+
+import traceback
+from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from statistics import mean, median
+from time import monotonic, sleep
+from typing import Dict, List, Set, Tuple
+
+from django.db import close_old_connections
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from database.schedule_models import ScheduledEvent
+from libs.firebase_config import check_firebase_instance
+from libs.sentry import make_sentry_client, SentryTypes
+from services.celery_push_notifications import get_surveys_and_schedules, queue_push_notifications
+
+
+"""
+The push notification scheduler is a long running alternative to queueing push notifications from
+the five minute cron task (create_push_notification_tasks), it sends notifications within seconds of
+their scheduled time.  Run it with `python services/push_notification_scheduler.py` and set
+PUSH_NOTIFICATION_SCHEDULER_ENABLED so that the cron task stops queueing notifications.
+
+ScheduledEvents due before the end of a horizon (HORIZON, 24 hours) are held in a heap ordered by
+scheduled time.  Every REFRESH_SECONDS the heap is refreshed incrementally from two watermarks:
+events created since the last refresh, and events whose scheduled time has entered the horizon.
+Every TICK_SECONDS the due events are popped and queued exactly like the cron task queues them
+(get_surveys_and_schedules restricted to the due events, then queue_push_notifications).
+
+A successful send deletes a ScheduledEvent, a failed send (or a participant without a push
+notification token) leaves it in place.  Dispatched events that still exist are retried after
+RETRY_DELAY, which is the cadence of the cron task.
+
+Every refresh prints the delay between the scheduled time and the first dispatch of the
+notifications dispatched since the previous refresh.
+"""
+
+HORIZON = timedelta(hours=24)
+REFRESH_SECONDS = 60
+TICK_SECONDS = 1
+RETRY_DELAY = timedelta(minutes=6)
+# events created by other servers are found even if their clocks are a little ahead of this one.
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+
+class PushNotificationScheduler:
+
+    def __init__(self):
+        self.heap: List[Tuple[datetime, int]] = []  # (dispatch time, ScheduledEvent pk)
+        self.queued_pks: Set[int] = set()
+        self.retrying_pks: Set[int] = set()
+        self.created_watermark: datetime = None
+        self.horizon_end: datetime = None
+        self.delays: List[float] = []  # seconds, since the last report
+
+    def load(self, now: datetime):
+        """ Loads every event due before the end of the horizon. """
+        self.created_watermark = now - WATERMARK_OVERLAP
+        self.horizon_end = now + HORIZON
+        self.add(ScheduledEvent.objects.filter(scheduled_time__lte=self.horizon_end))
+
+    def refresh(self, now: datetime):
+        """ Adds the events created since the last refresh, and the events that entered the horizon. """
+        created_watermark = now - WATERMARK_OVERLAP
+        horizon_end = now + HORIZON
+        self.add(ScheduledEvent.objects.filter(
+            Q(created_on__gte=self.created_watermark, scheduled_time__lte=horizon_end)
+            | Q(scheduled_time__gt=self.horizon_end, scheduled_time__lte=horizon_end)
+        ))
+        self.created_watermark = created_watermark
+        self.horizon_end = horizon_end
+
+    def add(self, events: QuerySet):
+        events = events.filter(participant__deleted=False, survey__deleted=False)
+        for pk, scheduled_time in events.values_list("pk", "scheduled_time"):
+            if pk not in self.queued_pks:
+                self.queued_pks.add(pk)
+                heappush(self.heap, (scheduled_time, pk))
+
+    def dispatch(self, now: datetime):
+        """ Queues the notifications of every due event. """
+        due: Dict[int, datetime] = {}
+        while self.heap and self.heap[0][0] <= now:
+            dispatch_time, pk = heappop(self.heap)
+            due[pk] = dispatch_time
+        if not due:
+            return
+
+        retry_time = now + RETRY_DELAY
+        try:
+            surveys, schedules, patient_ids = get_surveys_and_schedules(now, schedule_pks=list(due))
+            if surveys:
+                if check_firebase_instance():
+                    queue_push_notifications(surveys, schedules, patient_ids)
+                else:
+                    print("Firebase is not configured, cannot queue notifications.")
+            existing_pks = set(ScheduledEvent.objects.filter(pk__in=list(due)).values_list("pk", flat=True))
+        except Exception:
+            # try again later rather than losing track of the events.
+            for pk in due:
+                heappush(self.heap, (retry_time, pk))
+            raise
+
+        for schedule_pks in schedules.values():
+            for pk in schedule_pks:
+                if pk not in self.retrying_pks:
+                    self.delays.append((now - due[pk]).total_seconds())
+
+        # events that still exist are retried, deleted events are forgotten.
+        for pk in due:
+            if pk in existing_pks:
+                self.retrying_pks.add(pk)
+                heappush(self.heap, (retry_time, pk))
+            else:
+                self.queued_pks.discard(pk)
+                self.retrying_pks.discard(pk)
+
+    def report(self):
+        if self.delays:
+            self.delays.sort()
+            p99 = self.delays[min(len(self.delays) - 1, int(len(self.delays) * 0.99))]
+            print(f"{timezone.now()}: dispatched {len(self.delays)} scheduled events, "
+                  f"schedule-to-send delay mean {mean(self.delays):.1f}s, p50 "
+                  f"{median(self.delays):.1f}s, p99 {p99:.1f}s, max {self.delays[-1]:.1f}s; "
+                  f"{len(self.heap)} events in the next {HORIZON}.")
+        self.delays = []
+
+    def run_forever(self):
+        self.load(timezone.now())
+        next_refresh = monotonic() + REFRESH_SECONDS
+        while True:
+            try:
+                close_old_connections()
+                if monotonic() >= next_refresh:
+                    next_refresh = monotonic() + REFRESH_SECONDS
+                    self.refresh(timezone.now())
+                    self.report()
+                self.dispatch(timezone.now())
+            except Exception:
+                traceback.print_exc()
+                make_sentry_client(SentryTypes.data_processing).captureException()
+            sleep(TICK_SECONDS)
+
+
+def run():
+    PushNotificationScheduler().run_forever()
+
+
+if __name__ == "__main__":
+    run()
@@ -11,6 +11,7 @@ from django.urls.base import resolve
 
 from constants.tableau_api_constants import X_ACCESS_KEY_ID, X_ACCESS_KEY_SECRET
 from constants.testing_constants import ALL_ROLE_PERMUTATIONS, REAL_ROLES, ResearcherRole
+from database.data_access_models import STUDY_OBJECT_ID_CACHE
 from database.security_models import ApiKey
 from database.study_models import Study
 from database.user_models import Researcher, StudyRelation
@@ -58,6 +59,8 @@ class CommonTestCase(TestCase, ReferenceObjectMixin):
     def setUp(self) -> None:
         if VERBOSE_2_OR_3:
             print("\n==")
+        # primary keys are reused between tests (by studies with different object ids)
+        STUDY_OBJECT_ID_CACHE.clear()
         return super().setUp()
     
     def tearDown(self) -> None:
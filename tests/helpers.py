@@ -11,7 +11,7 @@ from constants.forest_constants import ForestTree
 from constants.researcher_constants import ResearcherRole
 from constants.testing_constants import REAL_ROLES, ResearcherRole
 from database.common_models import generate_objectid_string
-from database.data_access_models import ChunkRegistry, FileToProcess
+from database.data_access_models import ChunkRegistry, DataExtent, FileToProcess
 from database.schedule_models import AbsoluteSchedule, ArchivedEvent, Intervention, InterventionDate, RelativeSchedule, WeeklySchedule
 from database.study_models import DeviceSettings, Study, StudyField
 from database.survey_models import Survey
@@ -277,6 +277,7 @@ class ReferenceObjectMixin:
             survey=survey or self.default_survey,
             day_of_week=day_of_week,
             hour=hour,
+            minute=minute,
         )
         weekly.save()
         return weekly
@@ -375,6 +376,10 @@ class ReferenceObjectMixin:
             survey=survey,
         )
         chunk_reg.save()
+        # data processing maintains the extents of the data it registers
+        DataExtent.record(
+            study.pk, participant.pk, {data_type: (chunk_reg.time_bin, chunk_reg.time_bin)}
+        )
         return chunk_reg
 
 
@@ -427,6 +432,18 @@ class DummyThreadPool():
         # does not use kwargs
         return map(func, iterable)
     
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        # runs immediately, on the calling thread
+        try:
+            result = func(*args, **(kwds or {}))
+        except Exception as e:
+            if error_callback is None:
+                raise
+            error_callback(e)
+        else:
+            if callback is not None:
+                callback(result)
+    
     # @staticmethod
     def terminate(self):
         pass
@@ -1,24 +1,36 @@
 import json
 from copy import copy
-from datetime import datetime
+from datetime import datetime, timedelta
 from io import BytesIO
+from fcntl import flock, LOCK_EX
+from os import listdir, makedirs, urandom, utime
+from os.path import exists, join as path_join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep, time
 from typing import List
 from unittest.mock import MagicMock, patch
+from zipfile import ZipFile
 
+from Cryptodome.Cipher import AES
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import models
+from django.db import models, OperationalError
 from django.forms.fields import NullBooleanField
 from django.http.response import FileResponse, HttpResponse, HttpResponseRedirect
 from django.urls import reverse
 from django.utils import timezone
 
+from api.dashboard_api import (dashboard_chunkregistry_daily_bytes_query,
+    dashboard_chunkregistry_date_query, dashboard_chunkregistry_participant_date_query,
+    dashboard_chunkregistry_stream_daily_bytes_query)
+from api.data_access_api import handle_database_query
 from api.tableau_api import FINAL_SERIALIZABLE_FIELD_NAMES
 from config.jinja2 import easy_url
 from constants.celery_constants import (ANDROID_FIREBASE_CREDENTIALS, BACKEND_FIREBASE_CREDENTIALS,
     IOS_FIREBASE_CREDENTIALS)
 from constants.common_constants import BEIWE_PROJECT_ROOT
 from constants.dashboard_constants import COMPLETE_DATA_STREAM_DICT
-from constants.data_stream_constants import ALL_DATA_STREAMS, SURVEY_TIMINGS
+from constants.data_stream_constants import ACCELEROMETER, ALL_DATA_STREAMS, GPS, SURVEY_TIMINGS
 from constants.datetime_constants import API_DATE_FORMAT
 from constants.message_strings import (NEW_PASSWORD_8_LONG, NEW_PASSWORD_MISMATCH,
     NEW_PASSWORD_RULES_FAIL, PASSWORD_RESET_SUCCESS, TABLEAU_API_KEY_IS_DISABLED,
@@ -35,8 +47,14 @@ from database.survey_models import Survey
 from database.system_models import FileAsText
 from database.user_models import Participant, ParticipantFCMHistory, Researcher
 from libs.copy_study import format_study
-from libs.encryption import get_RSA_cipher
-from libs.security import generate_easy_alphanumeric_string
+from libs.chunk_cache import ChunkCache
+from libs.encryption import (decrypt_device_file, decrypt_device_line, decrypt_device_lines,
+    DEVICE_LINE_BATCH_SIZE, get_RSA_cipher)
+from libs.export_cache import ExportCache
+from libs.s3 import create_client_key_pair, PRIVATE_KEY_CACHE, PRIVATE_KEY_CACHE_SECONDS
+from libs.security import encode_base64, generate_easy_alphanumeric_string
+from libs.streaming_zip import ChunkDownloader
+from libs.upload_spool import RETRY_DELAY_SECONDS, STALE_TEMPORARY_FILE_SECONDS, UploadSpool
 from tests.common import (BasicSessionTestCase, CommonTestCase, DataApiTest, ParticipantSessionTest,
     RedirectSessionApiTest, ResearcherSessionTest, SmartRequestsTestCase)
 from tests.helpers import DummyThreadPool
@@ -341,6 +359,29 @@ class TestDashboardStream(ResearcherSessionTest):
             resp = self.smart_get_status_code(200, self.session_study.id, data_stream)
             self.assert_present(COMPLETE_DATA_STREAM_DICT[data_stream], resp.content)
 
+    def test_daily_bytes_query(self):
+        study, participant = self.session_study, self.default_participant
+        day_1 = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        day_2 = datetime(2022, 1, 2, tzinfo=timezone.utc)
+        self.generate_chunk_registry(study, participant, ACCELEROMETER, time_bin=day_1, file_size=10)
+        self.generate_chunk_registry(
+            study, participant, ACCELEROMETER, time_bin=day_1 + timedelta(hours=23), file_size=5
+        )
+        self.generate_chunk_registry(study, participant, ACCELEROMETER, time_bin=day_2, file_size=0)
+        self.generate_chunk_registry(study, participant, GPS, time_bin=day_2, file_size=7)
+        # outside of the requested dates
+        self.generate_chunk_registry(
+            study, participant, ACCELEROMETER, time_bin=day_2 + timedelta(days=1), file_size=3
+        )
+
+        daily_bytes = dashboard_chunkregistry_daily_bytes_query(
+            study.id, ACCELEROMETER, [day_1.date(), day_2.date()]
+        )
+        self.assertEqual(
+            daily_bytes, {(participant.id, day_1.date()): 15, (participant.id, day_2.date()): 0}
+        )
+        self.assertEqual(dashboard_chunkregistry_daily_bytes_query(study.id, ACCELEROMETER, []), {})
+
 
 # FIXME: this page renders with almost no data
 class TestPatientDisplay(ResearcherSessionTest):
@@ -350,6 +391,37 @@ class TestPatientDisplay(ResearcherSessionTest):
         self.set_session_study_relation()
         self.smart_get_status_code(200, self.session_study.id, self.default_participant.patient_id)
 
+    def test_patient_display_queries(self):
+        self.set_session_study_relation()
+        study, participant = self.session_study, self.default_participant
+        day_1 = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        day_2 = datetime(2022, 1, 2, tzinfo=timezone.utc)
+        # the dashboard ignores data from before 1970-01-02
+        self.generate_chunk_registry(
+            study, participant, ACCELEROMETER, time_bin=datetime(1970, 1, 1, tzinfo=timezone.utc)
+        )
+        self.generate_chunk_registry(study, participant, ACCELEROMETER, time_bin=day_1, file_size=10)
+        self.generate_chunk_registry(
+            study, participant, ACCELEROMETER, time_bin=day_1 + timedelta(hours=1), file_size=5
+        )
+        self.generate_chunk_registry(study, participant, GPS, time_bin=day_2, file_size=7)
+
+        first_day, last_day = dashboard_chunkregistry_date_query(study.id)
+        self.assertEqual((first_day, last_day), (day_1.date(), day_2.date()))
+        self.assertEqual(
+            dashboard_chunkregistry_participant_date_query(participant.id, first_day),
+            (day_1.date(), day_2.date()),
+        )
+        self.assertEqual(
+            dashboard_chunkregistry_stream_daily_bytes_query(
+                participant.id, [day_1.date(), day_2.date()]
+            ),
+            {(ACCELEROMETER, day_1.date()): 15, (GPS, day_2.date()): 7},
+        )
+        # a single time bin is not enough data to display
+        self.assertEqual(dashboard_chunkregistry_date_query(study.id, GPS), (None, None))
+        self.smart_get_status_code(200, study.id, participant.patient_id)
+
 
 # system_admin_pages.manage_researchers
 class TestManageResearchers(ResearcherSessionTest):
@@ -1855,13 +1927,424 @@ class TestDownloadStudyInterventions(DataApiTest):
         self.assertDictEqual(json_unpacked, correct_output)
 
 
+class TestChunkDownloader(CommonTestCase):
+    
+    def chunks(self, count: int) -> List[dict]:
+        return [{"chunk_path": str(i), "study_id": self.session_study.id} for i in range(count)]
+    
+    @patch("libs.streaming_zip.s3_retrieve")
+    def test_ordering(self, s3_retrieve: MagicMock):
+        # the first file finishes downloading last
+        def slow_first_file(chunk_path, **kwargs):
+            if chunk_path == "0":
+                sleep(0.2)
+            return chunk_path.encode()
+        s3_retrieve.side_effect = slow_first_file
+        
+        unordered = [chunk["chunk_path"] for chunk, _ in ChunkDownloader().download(self.chunks(4))]
+        self.assertEqual(unordered[-1], "0")
+        self.assertEqual(sorted(unordered), ["0", "1", "2", "3"])
+        
+        downloader = ChunkDownloader(ordered=True)
+        ordered = list(downloader.download(self.chunks(4)))
+        self.assertEqual([(chunk["chunk_path"], content) for chunk, content in ordered],
+                         [("0", b"0"), ("1", b"1"), ("2", b"2"), ("3", b"3")])
+        self.assertEqual(downloader.files, 4)
+        self.assertEqual(downloader.bytes, 4)
+    
+    @patch("libs.streaming_zip.s3_retrieve")
+    def test_encryption_key_passed_to_threads(self, s3_retrieve: MagicMock):
+        s3_retrieve.return_value = b"0123456789"
+        list(ChunkDownloader().download(self.chunks(2)))
+        for call in s3_retrieve.call_args_list:
+            self.assertEqual(call[1]["study_object_id"], self.session_study.object_id)
+            self.assertEqual(call[1]["encryption_key"], self.session_study.encryption_key.encode())
+    
+    @patch("libs.streaming_zip.ThreadPool")
+    @patch("libs.streaming_zip.s3_retrieve")
+    def test_read_ahead_limit(self, s3_retrieve: MagicMock, threadpool: MagicMock):
+        threadpool.return_value = DummyThreadPool()
+        s3_retrieve.return_value = b"0123456789"
+        downloader = ChunkDownloader(concurrency=4, max_concurrency=4, read_ahead_bytes=20)
+        downloads = downloader.download(self.chunks(10))
+        next(downloads)
+        self.assertEqual(s3_retrieve.call_count, 4)
+        # the files left in the read-ahead buffer are over its limit, nothing new is downloaded.
+        next(downloads)
+        next(downloads)
+        self.assertEqual(s3_retrieve.call_count, 4)
+        self.assertEqual(len(list(downloads)), 7)
+    
+    def test_adapts_to_throughput(self):
+        downloader = ChunkDownloader(concurrency=3, max_concurrency=5)
+        
+        def record(size: int, buffer_full: bool = False):
+            downloader._window_start -= downloader.ADAPT_INTERVAL_SECONDS * 2
+            downloader._record(size, buffer_full)
+        
+        record(1000)
+        self.assertEqual(downloader.concurrency, 4)
+        record(2000)  # better, keep going
+        self.assertEqual(downloader.concurrency, 5)
+        record(2000)  # at the maximum
+        self.assertEqual(downloader.concurrency, 4)
+        record(1000)  # worse, turn around
+        self.assertEqual(downloader.concurrency, 5)
+        record(10, buffer_full=True)  # waiting on the client
+        self.assertEqual(downloader.concurrency, 5)
+        self.assertEqual(downloader.peak_concurrency, 5)
+        
+        fixed = ChunkDownloader(concurrency=3, max_concurrency=3)
+        fixed._window_start -= fixed.ADAPT_INTERVAL_SECONDS * 2
+        fixed._record(1000, False)
+        self.assertEqual(fixed.concurrency, 3)
+
+
+class TestExportCache(CommonTestCase):
+    
+    def setUp(self):
+        self.directory = mkdtemp()
+        super().setUp()
+    
+    def tearDown(self):
+        rmtree(self.directory, ignore_errors=True)
+        super().tearDown()
+    
+    def export(self, cache: ExportCache) -> bytes:
+        chunks = handle_database_query(self.session_study.pk, {})
+        return b"".join(cache.stream(self.session_study.pk, {}, chunks, True))
+    
+    @patch("libs.streaming_zip.ThreadPool")
+    @patch("libs.streaming_zip.s3_retrieve")
+    def test_export_cache(self, s3_retrieve: MagicMock, threadpool: MagicMock):
+        threadpool.return_value = DummyThreadPool()
+        s3_retrieve.return_value = b"some data"
+        cache = ExportCache(self.directory, 10)
+        first = self.generate_chunk_registry(
+            self.session_study, self.default_participant, GPS, path="first.csv",
+            time_bin=datetime(2020, 1, 1, tzinfo=timezone.utc),
+        )
+        self.generate_chunk_registry(
+            self.session_study, self.default_participant, GPS, path="second.csv",
+            time_bin=datetime(2020, 1, 2, tzinfo=timezone.utc),
+        )
+        zip_file = self.export(cache)
+        self.assertEqual(s3_retrieve.call_count, 2)
+        
+        # unchanged, from the cache
+        self.assertEqual(self.export(cache), zip_file)
+        self.assertEqual(s3_retrieve.call_count, 2)
+        
+        # a changed file is downloaded again, the unchanged file is reused
+        first.update(chunk_hash="changed")
+        s3_retrieve.return_value = b"new data"
+        zip_file = self.export(cache)
+        self.assertEqual(s3_retrieve.call_count, 3)
+        self.assertEqual(s3_retrieve.call_args[0][0], "first.csv")
+        with ZipFile(BytesIO(zip_file)) as zipped:
+            contents = sorted(zipped.read(name) for name in zipped.namelist() if name != "registry")
+        self.assertEqual(contents, [b"new data", b"some data"])
+        self.assertEqual(len(listdir(self.directory)), 3)
+        
+        # over the size limit, evicted
+        ExportCache(self.directory, 0).evict()
+        self.assertEqual(listdir(self.directory), [])
+
+
+class TestChunkCache(CommonTestCase):
+    
+    def setUp(self):
+        self.directory = mkdtemp()
+        super().setUp()
+    
+    def tearDown(self):
+        rmtree(self.directory, ignore_errors=True)
+        super().tearDown()
+    
+    def test_chunk_cache(self):
+        cache = ChunkCache(path_join(self.directory, "cache"), 10)
+        chunk = {"chunk_path": "a/b/c.csv", "chunk_hash": "hash"}
+        first, second, third = (path_join(self.directory, name) for name in ("1", "2", "3"))
+        
+        self.assertIsNone(cache.place(chunk, first))
+        cache.store(chunk, b"some data", first)
+        self.assertEqual(cache.place(chunk, second), 9)
+        with open(second, "rb") as f:
+            self.assertEqual(f.read(), b"some data")
+        
+        # a changed chunk is a different file, a chunk without a hash is not cached
+        self.assertIsNone(cache.place({**chunk, "chunk_hash": "changed"}, third))
+        cache.store({**chunk, "chunk_hash": ""}, b"no hash", third)
+        self.assertIsNone(cache.place({**chunk, "chunk_hash": ""}, path_join(self.directory, "4")))
+        
+        # over the size limit, evicted, files already placed are unaffected
+        ChunkCache(cache.directory, 0).evict()
+        self.assertIsNone(cache.place(chunk, path_join(self.directory, "5")))
+        with open(first, "rb") as f:
+            self.assertEqual(f.read(), b"some data")
+
+
+class TestUploadSpool(CommonTestCase):
+    
+    def setUp(self):
+        self.directory = mkdtemp()
+        super().setUp()
+    
+    def tearDown(self):
+        rmtree(self.directory, ignore_errors=True)
+        super().tearDown()
+    
+    @patch("libs.upload_spool.Thread")  # the tests run the queued work themselves
+    def started_spool(self, _thread: MagicMock) -> UploadSpool:
+        spool = UploadSpool(self.directory, number_workers=1, max_pending=2)
+        spool.start()
+        return spool
+    
+    @staticmethod
+    def run_queued(spool: UploadSpool):
+        while not spool._queue.empty():
+            claimed_path, attempt = spool._queue.get()
+            if spool._attempt(claimed_path, attempt):
+                spool.pending -= 1
+    
+    def spool_files(self) -> List[str]:
+        return sorted(name for name in listdir(self.directory) if name.endswith(".upload"))
+    
+    def write_spool_file(self, name: str, file_name: str = "a_gps_1.csv") -> str:
+        with open(path_join(self.directory, name), "wb") as f:
+            f.write(json.dumps({
+                "participant_id": self.default_participant.pk, "file_name": file_name
+            }).encode() + b"\n" + b"payload")
+        return path_join(self.directory, name)
+    
+    @patch("libs.upload_spool.process_upload")
+    def test_spool_round_trip(self, process_upload: MagicMock):
+        spool = self.started_spool()
+        spool.spool(self.default_participant, "a_gps_1.csv", b"some payload")
+        self.assertEqual(spool.pending, 1)
+        self.run_queued(spool)
+        process_upload.assert_called_once_with(
+            self.default_participant, "a_gps_1.csv", b"some payload"
+        )
+        self.assertEqual(spool.pending, 0)
+        # processed files are removed
+        self.assertEqual(
+            [name for name in listdir(self.directory) if name not in ("failed", "locks")], []
+        )
+    
+    @patch("libs.upload_spool.process_upload")
+    def test_backpressure(self, process_upload: MagicMock):
+        spool = self.started_spool()
+        self.assertTrue(spool.has_capacity())
+        spool.spool(self.default_participant, "a_gps_1.csv", b"1")
+        spool.spool(self.default_participant, "a_gps_2.csv", b"2")
+        self.assertFalse(spool.has_capacity())
+        self.run_queued(spool)
+        self.assertTrue(spool.has_capacity())
+        self.assertFalse(UploadSpool("", number_workers=1, max_pending=2).has_capacity())
+    
+    @patch("libs.upload_spool.process_upload")
+    def test_replay_of_exited_process_claims(self, process_upload: MagicMock):
+        unclaimed = self.write_spool_file("1.upload", "a_gps_1.csv")
+        # claimed by a process that has exited, its lock file was not released by a restart...
+        dead = self.write_spool_file("2.upload.claimed-deadprocess", "a_gps_2.csv")
+        # ...and claimed by a running process (one that holds its lock).
+        live = self.write_spool_file("3.upload.claimed-liveprocess", "a_gps_3.csv")
+        makedirs(path_join(self.directory, "locks"))
+        open(path_join(self.directory, "locks", "deadprocess"), "w").close()
+        live_lock = open(path_join(self.directory, "locks", "liveprocess"), "w")
+        flock(live_lock, LOCK_EX)
+        try:
+            spool = self.started_spool()
+            self.assertEqual(spool.pending, 2)
+            self.run_queued(spool)
+        finally:
+            live_lock.close()
+        
+        self.assertEqual(
+            sorted(call[0][1] for call in process_upload.call_args_list),
+            ["a_gps_1.csv", "a_gps_2.csv"],
+        )
+        self.assertFalse(exists(unclaimed))
+        self.assertFalse(exists(dead))
+        self.assertTrue(exists(live))
+        self.assertEqual(sorted(listdir(path_join(self.directory, "locks"))),
+                         sorted(["liveprocess", spool.identity]))
+    
+    def test_stale_temporary_files(self):
+        stale = self.write_spool_file("1.tmp")
+        utime(stale, (time() - STALE_TEMPORARY_FILE_SECONDS - 1,) * 2)
+        recent = self.write_spool_file("2.tmp")
+        spool = self.started_spool()
+        self.assertEqual(spool.pending, 0)
+        self.assertFalse(exists(stale))
+        self.assertTrue(exists(recent))  # it may still be being written
+    
+    @patch("libs.upload_spool.make_sentry_client")
+    @patch("libs.upload_spool.process_upload")
+    def test_failure_moves_file_to_failed(
+        self, process_upload: MagicMock, make_sentry_client: MagicMock
+    ):
+        process_upload.side_effect = ValueError("broken")
+        spool = self.started_spool()
+        spool.spool(self.default_participant, "a_gps_1.csv", b"some payload")
+        self.run_queued(spool)
+        self.assertEqual(self.spool_files(), [])
+        self.assertEqual(len(listdir(path_join(self.directory, "failed"))), 1)
+        make_sentry_client.return_value.captureException.assert_called_once()
+        self.assertEqual(spool.pending, 0)
+    
+    @patch("libs.upload_spool.Timer")
+    @patch("libs.upload_spool.process_upload")
+    def test_transient_failure_is_retried(self, process_upload: MagicMock, timer: MagicMock):
+        process_upload.side_effect = OperationalError("database unavailable")
+        spool = self.started_spool()
+        spool.spool(self.default_participant, "a_gps_1.csv", b"some payload")
+        self.run_queued(spool)
+        # the file stays claimed and pending, and is queued again after a delay.
+        self.assertEqual(len(listdir(path_join(self.directory, "failed"))), 0)
+        self.assertEqual(spool.pending, 1)
+        delay, put, ((claimed_path, attempt),) = timer.call_args[0]
+        self.assertEqual((delay, attempt), (RETRY_DELAY_SECONDS, 1))
+        self.assertTrue(exists(claimed_path))
+        
+        process_upload.side_effect = None
+        put((claimed_path, attempt))
+        self.run_queued(spool)
+        self.assertEqual(process_upload.call_count, 2)
+        self.assertEqual(spool.pending, 0)
+        self.assertFalse(exists(claimed_path))
+
+
+class TestDecryptDeviceLines(CommonTestCase):
+    
+    def setUp(self):
+        self.key = urandom(16)
+        super().setUp()
+    
+    def encrypt_line(self, plaintext: bytes) -> bytes:
+        """ The format of an encrypted line of a device file, see decrypt_device_line. """
+        iv = urandom(16)
+        padding = 16 - len(plaintext) % 16
+        data = AES.new(self.key, mode=AES.MODE_CBC, IV=iv).encrypt(plaintext + bytes([padding]) * padding)
+        return encode_base64(iv) + b":" + encode_base64(data)
+    
+    def malformed_lines(self) -> List[bytes]:
+        valid = self.encrypt_line(b"malformed")
+        iv, data = valid.split(b":")
+        return [
+            b"no colon",
+            valid + b":" + data,  # two colons
+            iv + b":",  # no data
+            b":" + data,  # no iv
+            iv[:-4] + b":" + data,  # short iv
+            iv + b":" + data[:-1],  # bad base64 padding
+            iv + b":" + data[:10] + b"$%" + data[10:],  # corrupt base64
+            iv + b":" + encode_base64(urandom(20)),  # data is not a multiple of 16 bytes
+        ]
+    
+    def individually(self, lines: List[bytes]) -> List[bytes]:
+        return [decrypt_device_line(self.default_participant.patient_id, self.key, line) for line in lines]
+    
+    def test_matches_decrypt_device_line(self):
+        # every length of the last block, including a block that is entirely padding
+        lines = [self.encrypt_line(urandom(i % 50)) for i in range(DEVICE_LINE_BATCH_SIZE + 10)]
+        self.assertEqual(decrypt_device_lines(self.key, lines), self.individually(lines))
+    
+    def test_malformed_lines(self):
+        lines = [self.encrypt_line(urandom(i)) for i in range(20)]
+        for malformed_line in self.malformed_lines():
+            batch = lines[:10] + [malformed_line] + lines[10:]
+            decrypted = decrypt_device_lines(self.key, batch)
+            # either the batch falls back to decrypt_device_line or its output is identical
+            if decrypted is not None:
+                self.assertEqual(decrypted, self.individually(batch))
+    
+    def test_decrypt_device_file(self):
+        # valid lines with malformed and empty lines around batch boundaries, compared with
+        # decrypting every line individually (a batch that always falls back).
+        plaintexts = [b"line %d" % i for i in range(DEVICE_LINE_BATCH_SIZE * 2 + 500)]
+        lines = [self.encrypt_line(plaintext) for plaintext in plaintexts]
+        for i, malformed_line in enumerate(self.malformed_lines()):
+            lines.insert(DEVICE_LINE_BATCH_SIZE - 2 + i * 150, malformed_line)
+        lines.insert(DEVICE_LINE_BATCH_SIZE, b"")
+        lines.insert(20, b"")
+        original_data = b"\n".join([b"the key line"] + lines + [b""])
+        
+        with patch("libs.encryption.extract_aes_key", return_value=self.key), \
+                patch.object(Participant, "get_private_key"):
+            batched = decrypt_device_file("file_name", original_data, self.default_participant)
+            with patch("libs.encryption.decrypt_device_lines", return_value=None):
+                individual = decrypt_device_file("file_name", original_data, self.default_participant)
+        
+        self.assertEqual(batched, individual)
+        batched_lines = batched.split(b"\n")
+        self.assertEqual([line for line in batched_lines if line.startswith(b"line ")], plaintexts)
+        # the base64 decoder skips invalid characters, a line with extra data is truncated to whole
+        # blocks, the other malformed lines are dropped.
+        others = [line for line in batched_lines if not line.startswith(b"line ")]
+        self.assertEqual(len(others), 2)
+        self.assertIn(b"malformed", others)
+
+
+@patch("libs.s3.get_RSA_cipher", lambda key: ("cipher", key))
+@patch("libs.s3.s3_retrieve")
+class TestPrivateKeyCache(CommonTestCase):
+    
+    def setUp(self):
+        PRIVATE_KEY_CACHE.clear()
+        self.clock = time()
+        super().setUp()
+    
+    def tearDown(self):
+        PRIVATE_KEY_CACHE.clear()
+        super().tearDown()
+    
+    def get_private_key(self):
+        with patch("libs.utils.cache_utils.monotonic", lambda: self.clock):
+            return self.default_participant.get_private_key()
+    
+    def test_cache_hits(self, s3_retrieve: MagicMock):
+        s3_retrieve.return_value = b"private key"
+        self.assertEqual(self.get_private_key(), ("cipher", b"private key"))
+        self.assertEqual(self.get_private_key(), ("cipher", b"private key"))
+        s3_retrieve.assert_called_once_with(
+            "keys/" + self.default_participant.patient_id + "_private", self.session_study.object_id
+        )
+        # a different participant is a different key
+        self.default_participant.patient_id = "other"
+        self.get_private_key()
+        self.assertEqual(s3_retrieve.call_count, 2)
+    
+    def test_cache_expiry(self, s3_retrieve: MagicMock):
+        self.get_private_key()
+        self.clock += PRIVATE_KEY_CACHE_SECONDS - 1
+        self.get_private_key()
+        self.assertEqual(s3_retrieve.call_count, 1)
+        self.clock += 1
+        self.get_private_key()
+        self.assertEqual(s3_retrieve.call_count, 2)
+    
+    @patch("libs.s3.s3_upload")
+    @patch("libs.s3.generate_key_pairing", return_value=(b"public", b"new private key"))
+    def test_new_key_pair_invalidates(
+        self, generate_key_pairing: MagicMock, s3_upload: MagicMock, s3_retrieve: MagicMock
+    ):
+        s3_retrieve.return_value = b"private key"
+        self.get_private_key()
+        s3_retrieve.return_value = b"new private key"
+        create_client_key_pair(self.default_participant.patient_id, self.session_study.object_id)
+        self.assertEqual(self.get_private_key(), ("cipher", b"new private key"))
+        self.assertEqual(s3_retrieve.call_count, 2)
+
+
 class TestGetData(DataApiTest):
     """ WARNING: there are heisenbugs in debugging the download data api endpoint.
 
     There is a generator that is conditionally present (`handle_database_query`), it can swallow
     errors. As a generater iterating over it consumes it, so printing it breaks the code.
     
-    You Must Patch libs.streaming_zip.ThreadPool
+    You Must Patch libs.streaming_zip.ThreadPool (or never query the database on the pool)
         The database connection breaks throwing errors on queries that should succeed.
         The iterator inside the zip file generator generally fails, and the zip file is empty.
 
@@ -1967,26 +2450,35 @@ class TestGetData(DataApiTest):
     
     # but don't patch ThreadPool for this one
     def test_downloads_and_file_naming_heisenbug(self):
-        # As far as I can tell the ThreadPool seems to screw up the connection to the test
-        # database, and queries on the non-main thread either find no data or connect to the wrong
-        # database (presumably your normal database?).
-        # Please retain this behavior and consult me (Eli, Biblicabeebli) during review.  This means a
-        # change has occurred to the multithreading, and is probably related to an obscure but known
-        # memory leak in the data access api download enpoint that is relevant on large downloads. """
-        try:
-            self._test_downloads_and_file_naming()
-        except AssertionError as e:
-            # this will happen on the first file it tests, accelerometer.
-            literal_string_of_error_message = f"b'{self.PATIENT_NAME}/accelerometer/2020-10-05 " \
-                "02_00_00+00_00.csv' not found in b'PK\\x05\\x06\\x00\\x00\\x00\\x00\\x00" \
-                "\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00'"
-            
-            if str(e) != literal_string_of_error_message:
-                raise Exception(
-                    f"\n'{literal_string_of_error_message}'\nwas not equal to\n'{str(e)}'\n"
-                     "\n  You have changed something that is possibly related to "
-                     "threading via a ThreadPool or DummyThreadPool"
-                )
+        # The ThreadPool used to screw up the connection to the test database, queries on a thread
+        # of the pool found no data and the zip file was empty.  The ChunkDownloader only queries
+        # the database on the calling thread, so this works with a real ThreadPool.  If this breaks
+        # then a change has occurred to the multithreading, and the database is being queried from
+        # the pool again.
+        self._test_downloads_and_file_naming()
+    
+    @patch("libs.streaming_zip.ThreadPool")
+    @patch("libs.streaming_zip.s3_retrieve")
+    def test_manifest_range(self, s3_retrieve: MagicMock, threadpool: MagicMock):
+        threadpool.return_value = DummyThreadPool()
+        s3_retrieve.return_value = self.SIMPLE_FILE_CONTENTS
+        self.set_session_study_relation(ResearcherRole.researcher)
+        chunks = [
+            self.generate_chunk_registry(
+                self.session_study, self.default_participant, ACCELEROMETER, path=f"{i}.csv",
+                time_bin=datetime(2020, 10, 5, i, tzinfo=timezone.utc),
+            ) for i in range(3)
+        ]
+        resp = self.smart_post(
+            study_pk=self.session_study.id, web_form="", after=chunks[0].pk, until=chunks[1].pk
+        )
+        file_contents = b"".join(resp.streaming_content)
+        self.assertNotIn(b"2020-10-05 00_00_00", file_contents)
+        self.assertIn(b"2020-10-05 01_00_00", file_contents)
+        self.assertNotIn(b"2020-10-05 02_00_00", file_contents)
+        
+        resp = self.smart_post(study_pk=self.session_study.id, web_form="", after="first")
+        self.assertEqual(resp.status_code, 400)
     
     def _test_basics(self, as_site_admin: bool):
         if as_site_admin:
@@ -2282,6 +2774,74 @@ class TestGetData(DataApiTest):
         return b"".join(bytes_list)
 
 
+class TestGetDataManifest(DataApiTest):
+    ENDPOINT_NAME = "data_access_api.get_data_manifest"
+    
+    def test_pages(self):
+        self.set_session_study_relation(ResearcherRole.researcher)
+        chunks = [
+            self.generate_chunk_registry(
+                self.session_study, self.default_participant, ACCELEROMETER, path=f"{i}.csv",
+                time_bin=datetime(2020, 10, 5, i, tzinfo=timezone.utc), file_size=i + 1,
+            ) for i in range(5)
+        ]
+        
+        resp = self.smart_post(study_pk=self.session_study.id, page_size=2)
+        self.assertEqual(resp.status_code, 200)
+        page = json.loads(resp.content)
+        self.assertEqual([c["pk"] for c in page["chunks"]], [chunks[0].pk, chunks[1].pk])
+        self.assertEqual(page["next"], chunks[1].pk)
+        self.assertEqual(page["chunks"][0], {
+            "pk": chunks[0].pk,
+            "chunk_path": "0.csv",
+            "chunk_hash": chunks[0].chunk_hash,
+            "file_size": 1,
+            "file_name": f"{self.default_participant.patient_id}/accelerometer/2020-10-05 00_00_00+00_00.csv",
+            "data_type": ACCELEROMETER,
+            "patient_id": self.default_participant.patient_id,
+            "time_bin": "2020-10-05T00:00:00",
+        })
+        
+        resp = self.smart_post(study_pk=self.session_study.id, page_size=2, after=page["next"])
+        page = json.loads(resp.content)
+        self.assertEqual([c["pk"] for c in page["chunks"]], [chunks[2].pk, chunks[3].pk])
+        resp = self.smart_post(study_pk=self.session_study.id, page_size=2, after=page["next"])
+        page = json.loads(resp.content)
+        self.assertEqual([c["pk"] for c in page["chunks"]], [chunks[4].pk])
+        self.assertIsNone(page["next"])
+    
+    def test_bad_page_size(self):
+        self.set_session_study_relation(ResearcherRole.researcher)
+        self.assertEqual(self.smart_post(study_pk=self.session_study.id, page_size=0).status_code, 400)
+        self.assertEqual(self.smart_post(study_pk=self.session_study.id, page_size="a").status_code, 400)
+
+
+class TestGetDataFile(DataApiTest):
+    ENDPOINT_NAME = "data_access_api.get_data_file"
+    
+    @patch("api.data_access_api.s3_retrieve")
+    def test_get_data_file(self, s3_retrieve: MagicMock):
+        s3_retrieve.return_value = b"file contents"
+        self.set_session_study_relation(ResearcherRole.researcher)
+        chunk = self.generate_chunk_registry(
+            self.session_study, self.default_participant, ACCELEROMETER, path="some/file.csv",
+            time_bin=datetime(2020, 10, 5, 2, tzinfo=timezone.utc),
+        )
+        resp = self.smart_post(study_pk=self.session_study.id, chunk_path=chunk.chunk_path)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"file contents")
+        self.assertIn("2020-10-05 02_00_00+00_00.csv", resp["Content-Disposition"])
+        s3_retrieve.assert_called_once_with(
+            chunk.chunk_path, self.session_study.object_id, raw_path=True
+        )
+    
+    def test_bad_chunk_path(self):
+        self.set_session_study_relation(ResearcherRole.researcher)
+        self.assertEqual(self.smart_post(study_pk=self.session_study.id).status_code, 400)
+        resp = self.smart_post(study_pk=self.session_study.id, chunk_path="not/a/chunk.csv")
+        self.assertEqual(resp.status_code, 404)
+
+
 class TestParticipantSetPassword(ParticipantSessionTest):
     ENDPOINT_NAME = "mobile_api.set_password"
     
@@ -2434,6 +2994,32 @@ class TestMobileUpload(ParticipantSessionTest):
         self.assertEqual(ftp.last_updated, should_be_identical.last_updated)
         self.assert_one_file_to_process
     
+    @patch("api.mobile_api.validate_device_file_key")
+    @patch("api.mobile_api.UPLOAD_SPOOL")
+    def test_upload_is_spooled(self, upload_spool: MagicMock, validate_device_file_key: MagicMock):
+        upload_spool.has_capacity.return_value = True
+        self.smart_post_status_code(200, file_name="whatever.csv", file="some_content")
+        validate_device_file_key.assert_called_once()
+        upload_spool.spool.assert_called_once_with(
+            self.session_participant, "whatever.csv", b"some_content"
+        )
+        # the spool's workers register the file
+        self.assert_no_files_to_process
+    
+    @patch("api.mobile_api.s3_upload")
+    @patch("api.mobile_api.decrypt_device_file")
+    @patch("api.mobile_api.UPLOAD_SPOOL")
+    def test_upload_without_spool_capacity(
+        self, upload_spool: MagicMock, decrypt_device_file: MagicMock, s3_upload: MagicMock
+    ):
+        # the spool is disabled or full, the upload is processed on the request thread.
+        upload_spool.has_capacity.return_value = False
+        decrypt_device_file.return_value = b"decrypted content"
+        self.smart_post_status_code(200, file_name="whatever.csv", file="some_content")
+        upload_spool.spool.assert_not_called()
+        s3_upload.assert_called_once()
+        self.assert_one_file_to_process
+    
     @patch("libs.encryption.STORE_DECRYPTION_KEY_ERRORS")  # Variable's boolean value becomes True
     def test_no_file_content(self, STORE_DECRYPTION_KEY_ERRORS: MagicMock):
         # this test will fail with the s3 invalid bucket
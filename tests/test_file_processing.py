@@ -0,0 +1,271 @@
+from copy import deepcopy
+from datetime import datetime, timedelta
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
+
+from django.utils import timezone
+
+from constants.data_processing_constants import CHUNK_TIMESLICE_QUANTUM, CHUNKS_FOLDER
+from constants.data_stream_constants import GPS
+from constants.datetime_constants import API_TIME_FORMAT
+from database.data_access_models import ChunkRegistry, FileToProcess
+from database.tableau_api_models import SummaryStatisticDaily
+from libs.file_processing.batched_network_operations import batch_upload
+from libs.file_processing.binified_data_spool import BinifiedDataSpool
+from libs.file_processing.chunk_merging import append_to_chunk, merge_into_chunk
+from libs.file_processing.columnar_timestamps import (add_human_readable_timestamps_columnar,
+    binify_rows_columnar, COLUMNAR_ENABLED, parse_timestamp_digits, sort_rows_columnar)
+from libs.file_processing.data_qty_stats import DataQuantityDeltas, reconcile_data_quantity_stats
+from libs.file_processing.file_processing_core import binify_csv_rows
+from libs.file_processing.pipeline_stages import bounded_imap, StageStats
+from libs.file_processing.reprocess_originals import reprocess_originals_from_chunk_paths
+from libs.file_processing.utility_functions_csvs import construct_csv_string
+from libs.file_processing.utility_functions_simple import (
+    convert_unix_to_human_readable_timestamps, ensure_sorted_by_timestamp)
+from tests.common import CommonTestCase
+
+
+class TestBinifiedDataSpool(CommonTestCase):
+
+    @staticmethod
+    def make_rows(start: int, count: int):
+        return [[str(1_600_000_000_000 + i).encode(), b"1.0", b"2.0", b"3.0"]
+                for i in range(start, start + count)]
+
+    def test_no_budget_never_spills(self):
+        spool = BinifiedDataSpool()
+        spool.add_rows(("study", "user", "accel", 1, b"header"), self.make_rows(0, 1000), 1)
+        self.assertEqual(spool.spilled_bytes, 0)
+        self.assertEqual(len(spool), 1)
+
+    def test_spilled_rows_are_returned_in_order(self):
+        spool = BinifiedDataSpool(memory_budget=5000)
+        bin_a = ("study", "user", "accel", 1, b"header")
+        bin_b = ("study", "user", "accel", 2, b"header")
+        expected_a, expected_b = [], []
+        for ftp_pk in range(10):
+            rows_a, rows_b = self.make_rows(ftp_pk * 100, 50), self.make_rows(ftp_pk * 100 + 50, 10)
+            expected_a.extend(rows_a)
+            expected_b.extend(rows_b)
+            spool.add_rows(bin_a, rows_a, ftp_pk)
+            spool.add_rows(bin_b, rows_b, ftp_pk)
+
+        self.assertGreater(spool.spilled_bytes, 0)
+        self.assertLessEqual(spool.in_memory_size, 5000)
+
+        output = dict(spool.items())
+        self.assertEqual(output[bin_a], (expected_a, list(range(10))))
+        self.assertEqual(output[bin_b], (expected_b, list(range(10))))
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.in_memory_size, 0)
+
+
+@skipUnless(COLUMNAR_ENABLED, "numpy is not installed")
+class TestColumnarTimestamps(CommonTestCase):
+
+    def test_mixed_length_timestamps_decline_fast_path(self):
+        rows = [[b"1640995200000", b"a"]] * 300 + [[b"164099520000", b"b"]]
+        self.assertIsNone(parse_timestamp_digits(rows))
+
+    def test_junk_timestamps_decline_fast_path(self):
+        rows = [[b"1640995200000", b"a"]] * 300 + [[b"164099520000x", b"b"]]
+        self.assertIsNone(parse_timestamp_digits(rows))
+
+    def test_sort_matches_python(self):
+        rows = [[str(1640995200000 + (i * 7919) % 1000).encode(), str(i).encode()] for i in range(1000)]
+        python_rows, columnar_rows = deepcopy(rows), deepcopy(rows)
+        ensure_sorted_by_timestamp(python_rows)
+        self.assertTrue(sort_rows_columnar(columnar_rows))
+        self.assertEqual(python_rows, columnar_rows)
+
+    def test_human_readable_timestamps_match_python(self):
+        rows = [[str(1640995200000 + i * 37).encode(), b"x"] for i in range(1000)]
+        python_rows, columnar_rows = deepcopy(rows), deepcopy(rows)
+        python_header = convert_unix_to_human_readable_timestamps(b"timestamp,x", python_rows)
+        columnar_header = add_human_readable_timestamps_columnar(b"timestamp,x", columnar_rows)
+        self.assertEqual(python_header, columnar_header)
+        self.assertEqual(python_rows, columnar_rows)
+
+    def test_binify_matches_python(self):
+        rows = [[str(1640995200000 + i * 9000).encode(), b"x"] for i in range(1000)] + [[b""]]
+        params = ("study", "user", "accelerometer", b"timestamp,x")
+        with patch("libs.file_processing.file_processing_core.COLUMNAR_ENABLED", False):
+            python_bins = binify_csv_rows(deepcopy(rows), *params)
+        columnar_bins = binify_rows_columnar(deepcopy(rows), *params)
+        self.assertEqual(list(python_bins.items()), list(columnar_bins.items()))
+
+
+class TestChunkMerging(CommonTestCase):
+    HEADER = b"timestamp,UTC time,x"
+
+    def old_chunk(self):
+        return construct_csv_string(self.HEADER, [[b"100", b"a", b"1"], [b"200", b"a", b"1"]])
+
+    def test_append_newer_rows(self):
+        new_rows = [[b"300", b"a", b"1"], [b"300", b"a", b"1"], [b"400", b"a", b"2"]]
+        contents, max_timestamp = append_to_chunk(self.old_chunk(), 200, new_rows)
+        self.assertEqual(contents, b"timestamp,UTC time,x\n100,a,1\n200,a,1\n300,a,1\n400,a,2")
+        self.assertEqual(max_timestamp, 400)
+
+    def test_append_declines_older_rows(self):
+        self.assertIsNone(append_to_chunk(self.old_chunk(), 200, [[b"200", b"a", b"2"]]))
+        self.assertIsNone(append_to_chunk(self.old_chunk(), None, [[b"300", b"a", b"2"]]))
+
+    def test_merge_deduplicates_on_boundary(self):
+        new_rows = [[b"150", b"a", b"1"], [b"200", b"a", b"2"], [b"200", b"a", b"1"]]
+        contents, max_timestamp = merge_into_chunk(self.old_chunk(), new_rows)
+        self.assertEqual(contents, b"timestamp,UTC time,x\n100,a,1\n150,a,1\n200,a,1\n200,a,2")
+        self.assertEqual(max_timestamp, 200)
+
+    def test_merge_declines_unsorted_chunk(self):
+        unsorted_chunk = construct_csv_string(self.HEADER, [[b"200", b"a", b"1"], [b"100", b"a", b"1"]])
+        self.assertIsNone(merge_into_chunk(unsorted_chunk, [[b"150", b"a", b"1"]]))
+
+
+class TestPipelineStages(CommonTestCase):
+
+    def test_bounded_imap_preserves_order(self):
+        stats = StageStats("test", 4)
+        self.assertEqual(list(bounded_imap(lambda x: x * 2, range(50), stats)), list(range(0, 100, 2)))
+        self.assertEqual(stats.items, 50)
+
+    def test_bounded_imap_consumes_input_lazily(self):
+        consumed = []
+
+        def source():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        results = bounded_imap(lambda x: x, source(), StageStats("test", 2), max_pending=3)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(consumed), 4)
+        results.close()
+
+    def test_bounded_imap_raises_exceptions(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        results = bounded_imap(fail_on_three, range(10), StageStats("test", 2))
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            next(results)
+
+
+class TestDataQuantityDeltas(CommonTestCase):
+
+    def test_deltas_and_reconciliation(self):
+        participant = self.default_participant
+        day = datetime(2021, 1, 1, 12, tzinfo=timezone.utc)
+        self.generate_chunk_registry(
+            self.session_study, participant, GPS, time_bin=day, file_size=100
+        )
+        chunk = self.generate_chunk_registry(
+            self.session_study, participant, GPS, time_bin=day + timedelta(days=1), file_size=10
+        )
+        deltas = DataQuantityDeltas(participant)
+        deltas.add(day, GPS, 100)
+        deltas.add(day + timedelta(days=1), GPS, 10)
+        deltas.apply()
+        # a resized chunk
+        chunk.update(file_size=25)
+        deltas.add(day + timedelta(days=1), GPS, 15)
+        deltas.apply()
+        self.assertEqual(self.gps_bytes(), [(day.date(), 100), (day.date() + timedelta(days=1), 25)])
+
+        # statistics that have drifted from the registry are corrected
+        SummaryStatisticDaily.objects.filter(date=day.date()).update(beiwe_gps_bytes=1)
+        corrected = reconcile_data_quantity_stats(participant, timezone.now() - timedelta(hours=1))
+        self.assertEqual(corrected, 1)
+        self.assertEqual(self.gps_bytes(), [(day.date(), 100), (day.date() + timedelta(days=1), 25)])
+
+    def gps_bytes(self):
+        return list(
+            SummaryStatisticDaily.objects.order_by("date").values_list("date", "beiwe_gps_bytes")
+        )
+
+
+@patch("libs.file_processing.batched_network_operations.s3_upload")
+class TestBatchUpload(CommonTestCase):
+
+    def test_new_chunk(self, s3_upload: MagicMock):
+        participant = self.default_participant
+        time_bin = datetime(2021, 1, 1, 12, tzinfo=timezone.utc)
+        chunk = {
+            "data_type": GPS,
+            "time_bin": int(time_bin.timestamp()) // CHUNK_TIMESLICE_QUANTUM,
+            "chunk_path": "CHUNKED_DATA/a/b/gps/2021-01-01T12:00:00.csv",
+            "study_id": self.session_study.pk,
+            "participant_id": participant.pk,
+        }
+        ret = batch_upload((chunk, chunk["chunk_path"], b"header\nnew contents", "study object id"))
+
+        self.assertIsNone(ret["exception"])
+        self.assertEqual(ret["size_change"], (time_bin, GPS, 19))
+        # chunks are stored uncompressed, the contents are uploaded as they are.
+        s3_upload.assert_called_once_with(
+            chunk["chunk_path"], b"header\nnew contents", "study object id", raw_path=True
+        )
+        registered = ChunkRegistry.objects.get(chunk_path=chunk["chunk_path"])
+        self.assertEqual((registered.time_bin, registered.file_size), (time_bin, 19))
+
+    def test_append_to_chunk(self, s3_upload: MagicMock):
+        time_bin = datetime(2021, 1, 1, 12, tzinfo=timezone.utc)
+        chunk = self.generate_chunk_registry(
+            self.session_study, self.default_participant, GPS, path="a/chunk.csv",
+            hash_value="old hash", time_bin=time_bin, file_size=10, is_chunkable=True,
+        )
+        ret = batch_upload((chunk, chunk.chunk_path, b"header\nold\nappended", "study object id"))
+
+        self.assertIsNone(ret["exception"])
+        self.assertEqual(ret["size_change"], (time_bin, GPS, 9))
+        s3_upload.assert_called_once_with(
+            "a/chunk.csv", b"header\nold\nappended", "study object id", raw_path=True
+        )
+        chunk.refresh_from_db()
+        self.assertEqual(chunk.file_size, 19)
+        self.assertNotEqual(chunk.chunk_hash, "old hash")
+        self.assertEqual(ChunkRegistry.objects.count(), 1)
+
+
+class TestReprocessOriginals(CommonTestCase):
+
+    def test_reprocess_originals_from_chunk_paths(self):
+        participant = self.default_participant
+        object_id, patient_id = participant.study.object_id, participant.patient_id
+        hour = datetime(2021, 1, 1, 12)
+        # a file every 20 minutes from 10:00 to 15:00
+        keys = [
+            f"{object_id}/{patient_id}/{GPS}/"
+            f"{int((hour + timedelta(minutes=minutes)).timestamp() * 1000)}.csv"
+            for minutes in range(-120, 200, 20)
+        ]
+        listed = []
+
+        def list_files(prefix, as_generator=False, start_after=None):
+            for key in keys:
+                if start_after is None or key > start_after:
+                    listed.append(key)
+                    yield key
+
+        chunk_path = "/".join(
+            (CHUNKS_FOLDER, object_id, patient_id, GPS, f"{hour.strftime(API_TIME_FORMAT)}.csv")
+        )
+        with patch("database.data_access_models.s3_list_files", list_files):
+            reprocess = reprocess_originals_from_chunk_paths(
+                [chunk_path, chunk_path], concurrency=2
+            )
+        # the last file of the prior hour, and the files of the hour through the next hour
+        expected = keys[5:10]
+        self.assertEqual(
+            sorted(FileToProcess.objects.values_list("s3_file_path", flat=True)), expected
+        )
+        self.assertEqual((reprocess.new_file_count, reprocess.queued_file_count), (5, 0))
+        # the listings started at the prior hour and stopped after the window
+        self.assertEqual(set(listed), set(keys[3:11]))
+
+        with patch("database.data_access_models.s3_list_files", list_files):
+            reprocess = reprocess_originals_from_chunk_paths([chunk_path])
+        self.assertEqual((reprocess.new_file_count, reprocess.queued_file_count), (0, 5))
@@ -1,6 +1,19 @@
+from datetime import date, datetime, timedelta
+
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
+from constants.celery_constants import ScheduleTypes
+from constants.data_stream_constants import GPS, SURVEY_ANSWERS
+from database.data_access_models import ChunkRegistry, DataExtent, FileToProcess
+from database.profiling_models import UploadTracking
+from database.schedule_models import ArchivedEvent, ScheduledEvent
 from database.study_models import DeviceSettings, Study
+from database.tableau_api_models import SummaryStatisticDaily
+from libs.encryption import get_study_encryption_key, STUDY_ENCRYPTION_KEY_CACHE
+from libs.push_notification_helpers import (bulk_set_next_weekly,
+    repopulate_absolute_survey_schedule_events, repopulate_weekly_survey_schedule_events)
 from tests.common import CommonTestCase
 
 
@@ -62,3 +75,192 @@ class StudyModelTests(CommonTestCase):
 
         bad_study = Study.create_with_object_id(name='name', encryption_key=encryption_key, deleted=True)
         self.assertNotIn(bad_study, Study.get_all_studies_by_name())
+
+    def test_encryption_key_cache(self):
+        study = self.session_study
+        STUDY_ENCRYPTION_KEY_CACHE.clear()
+        hits = STUDY_ENCRYPTION_KEY_CACHE.hits
+        self.assertEqual(get_study_encryption_key(study.object_id), study.encryption_key.encode())
+        self.assertEqual(get_study_encryption_key(study.object_id), study.encryption_key.encode())
+        self.assertEqual(STUDY_ENCRYPTION_KEY_CACHE.hits, hits + 1)
+
+        study.encryption_key = 'ppoonnmmllkkjjiihhggffeeddccbbaa'
+        study.save()
+        self.assertEqual(get_study_encryption_key(study.object_id), b'ppoonnmmllkkjjiihhggffeeddccbbaa')
+
+
+class FileToProcessTests(CommonTestCase):
+
+    def test_register_uploads(self):
+        participant = self.default_participant
+        object_id = participant.study.object_id
+        self.generate_file_to_process(f"{object_id}/{participant.patient_id}/gps/1.csv")
+        uploads = [
+            (f"{participant.patient_id}/gps/1.csv", participant, 10),
+            (f"{participant.patient_id}/gps/2.csv", participant, 20),
+        ]
+        new_paths = FileToProcess.register_uploads(uploads)
+        self.assertEqual(new_paths, {f"{participant.patient_id}/gps/2.csv"})
+        self.assertEqual(
+            set(FileToProcess.objects.values_list("s3_file_path", flat=True)),
+            {f"{object_id}/{participant.patient_id}/gps/1.csv", f"{object_id}/{participant.patient_id}/gps/2.csv"}
+        )
+        self.assertEqual(
+            list(UploadTracking.objects.values_list("file_path", "file_size")),
+            [(f"{participant.patient_id}/gps/2.csv", 20)]
+        )
+        # registering the same files again creates nothing
+        self.assertEqual(FileToProcess.register_uploads(uploads), set())
+        self.assertEqual(FileToProcess.objects.count(), 2)
+        self.assertEqual(UploadTracking.objects.count(), 1)
+
+
+class ChunkRegistryTests(CommonTestCase):
+
+    def test_register_unchunked_data_twice(self):
+        participant = self.default_participant
+        path = f"{participant.study.object_id}/{participant.patient_id}/surveyAnswers/x/1.csv"
+        for contents in (b"some data", b"more data here"):
+            ChunkRegistry.register_unchunked_data(
+                SURVEY_ANSWERS, 1600000000, path, participant.study_id, participant.pk, contents
+            )
+        # the second upload updates the file size of the existing registry
+        self.assertEqual(list(ChunkRegistry.objects.values_list("chunk_path", "file_size")),
+                         [(path, 14)])
+
+    def test_register_chunked_data_relies_on_constraints(self):
+        participant = self.default_participant
+        kwargs = dict(
+            data_type=GPS, time_bin=444444, chunk_path="chunk/path.csv", file_contents=b"a,b\n1,2",
+            study_id=participant.study_id, participant_id=participant.pk,
+        )
+        ChunkRegistry.register_chunked_data(**kwargs)
+        # not validated, the unique chunk_path is enforced by the database
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ChunkRegistry.register_chunked_data(**kwargs)
+        chunk = ChunkRegistry.objects.get()
+        chunk.file_size = 100
+        chunk.update_chunk(b"a,b\n1,2\n3,4")
+        self.assertEqual(ChunkRegistry.objects.values_list("file_size", flat=True).get(), 100)
+
+
+class DataExtentTests(CommonTestCase):
+
+    def test_data_extents(self):
+        study, participant = self.session_study, self.default_participant
+        day = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        DataExtent.record(study.pk, participant.pk, {GPS: (day, day + timedelta(hours=1))})
+        # extents only widen
+        DataExtent.record(study.pk, participant.pk, {
+            GPS: (day + timedelta(hours=2), day + timedelta(hours=3)),
+            SURVEY_ANSWERS: (day - timedelta(days=1), day - timedelta(days=1)),
+        })
+        self.assertEqual(DataExtent.get_extent(data_type=GPS), (day, day + timedelta(hours=3)))
+        self.assertEqual(
+            DataExtent.get_extent(study_id=study.pk),
+            (day - timedelta(days=1), day + timedelta(hours=3)),
+        )
+        # ChunkRegistry is the source of truth
+        DataExtent.recalculate([participant.pk])
+        self.assertEqual(DataExtent.get_extent(study_id=study.pk), (None, None))
+
+    def test_study_data_time_bins(self):
+        study, participant = self.session_study, self.default_participant
+        day = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        before_epoch = datetime(1969, 1, 1, tzinfo=timezone.utc)
+        self.generate_chunk_registry(study, participant, GPS, time_bin=before_epoch)
+        self.generate_chunk_registry(study, participant, GPS, time_bin=day)
+        self.generate_chunk_registry(study, participant, GPS, time_bin=day + timedelta(days=1))
+        self.assertEqual(study.get_earliest_data_time_bin(), day)
+        self.assertEqual(study.get_latest_data_time_bin(), day + timedelta(days=1))
+        self.assertEqual(study.get_earliest_data_time_bin(only_after_epoch=False), before_epoch)
+        # data from the future
+        future = timezone.now() + timedelta(days=30)
+        self.generate_chunk_registry(study, participant, GPS, time_bin=future)
+        self.assertEqual(study.get_latest_data_time_bin(), day + timedelta(days=1))
+        self.assertEqual(study.get_latest_data_time_bin(only_before_now=False), future)
+
+
+class SummaryStatisticDailyTests(CommonTestCase):
+
+    def test_bulk_upsert_statistics(self):
+        participant = self.default_participant
+        day = date(2021, 1, 1)
+        SummaryStatisticDaily.bulk_upsert_statistics([
+            (participant.pk, day, {"beiwe_gps_bytes": 10, "beiwe_accelerometer_bytes": 20}),
+            (participant.pk, day + timedelta(days=1), {"beiwe_gps_bytes": 30}),
+        ])
+        # only the provided fields of an existing statistic are updated
+        SummaryStatisticDaily.bulk_upsert_statistics([
+            (participant.pk, day, {"beiwe_gps_bytes": 40}),
+            (participant.pk, day + timedelta(days=2), {"jasmine_distance_traveled": "1.5"}),
+        ])
+        self.assertEqual(
+            list(SummaryStatisticDaily.objects.order_by("date").values_list(
+                "date", "beiwe_gps_bytes", "beiwe_accelerometer_bytes", "jasmine_distance_traveled"
+            )),
+            [
+                (day, 40, 20, None),
+                (day + timedelta(days=1), 30, None, None),
+                (day + timedelta(days=2), None, None, 1.5),
+            ]
+        )
+
+
+class ScheduledEventTests(CommonTestCase):
+
+    def test_bulk_archive(self):
+        weekly_schedule = self.generate_weekly_schedule()
+        events = [
+            ScheduledEvent.objects.create(
+                survey=self.default_survey,
+                participant=self.default_participant,
+                weekly_schedule=weekly_schedule,
+                scheduled_time=timezone.now() - timedelta(hours=i),
+            ) for i in range(3)
+        ]
+        ScheduledEvent.bulk_archive([(events[0], "failed")], self_delete=False)
+        self.assertEqual(ScheduledEvent.objects.count(), 3)
+        ScheduledEvent.bulk_archive([(event, ArchivedEvent.SUCCESS) for event in events], self_delete=True)
+        self.assertEqual(ScheduledEvent.objects.count(), 0)
+        self.assertEqual(
+            sorted(ArchivedEvent.objects.values_list("schedule_type", "status")),
+            [(ScheduleTypes.weekly, "failed")] + [(ScheduleTypes.weekly, ArchivedEvent.SUCCESS)] * 3
+        )
+
+    def test_bulk_set_next_weekly(self):
+        self.generate_weekly_schedule()
+        bulk_set_next_weekly([(self.default_participant, self.default_survey)] * 2)
+        self.assertEqual(ScheduledEvent.objects.count(), 1)
+        # the next weekly event already exists, nothing is created.
+        bulk_set_next_weekly([(self.default_participant, self.default_survey)])
+        self.assertEqual(ScheduledEvent.objects.count(), 1)
+
+    def test_repopulate_weekly_is_incremental(self):
+        participant = self.default_participant
+        self.generate_weekly_schedule()
+        repopulate_weekly_survey_schedule_events(self.default_survey)
+        event = ScheduledEvent.objects.get()
+        self.assertEqual(event.participant_id, participant.pk)
+        # nothing changed, the existing event is kept.
+        repopulate_weekly_survey_schedule_events(self.default_survey)
+        self.assertEqual(ScheduledEvent.objects.get().pk, event.pk)
+
+    def test_repopulate_absolute_skips_archived_events(self):
+        participant = self.default_participant
+        other_participant = self.generate_participant(self.session_study)
+        absolute_schedule = self.generate_absolute_schedule(date.today() + timedelta(days=1))
+        self.generate_archived_event(
+            self.default_survey, participant, ScheduleTypes.absolute, absolute_schedule.event_time
+        )
+        # a stale event for the already sent notification is removed.
+        ScheduledEvent.objects.create(
+            survey=self.default_survey,
+            participant=participant,
+            absolute_schedule=absolute_schedule,
+            scheduled_time=absolute_schedule.event_time,
+        )
+        repopulate_absolute_survey_schedule_events(self.default_survey)
+        self.assertEqual(
+            list(ScheduledEvent.objects.values_list("participant_id", flat=True)), [other_participant.pk]
+        )
@@ -0,0 +1,234 @@
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+from django.utils import timezone
+from firebase_admin.messaging import UnregisteredError
+
+from database.schedule_models import ArchivedEvent, ScheduledEvent
+from database.user_models import Participant, ParticipantFCMHistory, PushNotificationDisabledEvent
+from services.celery_push_notifications import celery_send_push_notification_batch
+from services.push_notification_scheduler import HORIZON, PushNotificationScheduler, RETRY_DELAY
+from tests.common import CommonTestCase
+
+
+def send_batch(notifications):
+    # without a celery configuration the task is a FalseCeleryApp, apply_async runs it directly.
+    celery_send_push_notification_batch.apply_async(args=[notifications])
+
+
+def send_all_responses(*exceptions) -> MagicMock:
+    """ The BatchResponse of messaging.send_all, one response per message. """
+    return MagicMock(responses=[MagicMock(exception=exception) for exception in exceptions])
+
+
+@patch("services.celery_push_notifications.check_firebase_instance", MagicMock(return_value=True))
+@patch("services.celery_push_notifications.send_notifications")
+class TestPushNotificationBatch(CommonTestCase):
+
+    def notification(self, participant: Participant, token: str):
+        """ A token of the participant and a due event, as queued for the batch task. """
+        ParticipantFCMHistory.objects.create(participant=participant, token=token)
+        absolute = self.generate_absolute_schedule(date.today())
+        event = ScheduledEvent.objects.create(
+            survey=self.default_survey, participant=participant, absolute_schedule=absolute,
+            scheduled_time=timezone.now() - timedelta(minutes=1),
+        )
+        return token, [self.default_survey.object_id], [event.pk]
+
+    def archived_statuses(self, participant: Participant):
+        return sorted(ArchivedEvent.objects.filter(participant=participant)
+                      .values_list("status", flat=True))
+
+    def unreachable_count(self, participant: Participant) -> int:
+        participant.refresh_from_db()
+        return participant.push_notification_unreachable_count
+
+    def test_all_succeed(self, send_notifications: MagicMock):
+        participant = self.default_participant
+        participant.update(push_notification_unreachable_count=3)
+        other = self.generate_participant(self.session_study)
+        notifications = [self.notification(participant, "token1"), self.notification(other, "token2")]
+        send_notifications.return_value = send_all_responses(None, None)
+
+        send_batch(notifications)
+        send_notifications.assert_called_once()
+        self.assertEqual(len(send_notifications.call_args[0][0]), 2)
+        for p in (participant, other):
+            self.assertEqual(self.archived_statuses(p), [ArchivedEvent.SUCCESS])
+            self.assertEqual(self.unreachable_count(p), 0)
+        self.assertEqual(ScheduledEvent.objects.count(), 0)
+        self.assertFalse(ParticipantFCMHistory.objects.filter(unregistered__isnull=False).exists())
+
+    def test_mixed_failures(self, send_notifications: MagicMock):
+        succeeds = self.default_participant
+        unregistered = self.generate_participant(self.session_study)
+        fails = self.generate_participant(self.session_study)
+        notifications = [
+            self.notification(succeeds, "token1"),
+            self.notification(unregistered, "token2"),
+            self.notification(fails, "token3"),
+        ]
+        send_notifications.return_value = send_all_responses(
+            None, UnregisteredError("unregistered"), Exception("some error")
+        )
+
+        send_batch(notifications)
+        self.assertEqual(self.archived_statuses(succeeds), [ArchivedEvent.SUCCESS])
+        # an unregistered token is marked as such, the event is left for a later attempt.
+        self.assertEqual(self.archived_statuses(unregistered), [])
+        self.assertIsNotNone(ParticipantFCMHistory.objects.get(token="token2").unregistered)
+        self.assertEqual(self.unreachable_count(unregistered), 0)
+        # other errors are recorded and counted, the event is not deleted.
+        self.assertEqual(self.archived_statuses(fails), ["some error"])
+        self.assertEqual(self.unreachable_count(fails), 1)
+        self.assertIsNone(ParticipantFCMHistory.objects.get(token="token3").unregistered)
+        self.assertEqual(
+            set(ScheduledEvent.objects.values_list("participant_id", flat=True)),
+            {unregistered.pk, fails.pk},
+        )
+
+    def test_failures_of_one_participant_count_separately(self, send_notifications: MagicMock):
+        participant = self.default_participant
+        notifications = [self.notification(participant, "token1"),
+                         self.notification(participant, "token2")]
+        send_notifications.return_value = send_all_responses(Exception("a"), Exception("b"))
+
+        send_batch(notifications)
+        self.assertEqual(self.unreachable_count(participant), 2)
+        self.assertEqual(self.archived_statuses(participant), ["a", "b"])
+
+    @patch("services.celery_push_notifications.PUSH_NOTIFICATION_ATTEMPT_COUNT", 1)
+    def test_failures_disable_in_order(self, send_notifications: MagicMock):
+        # the first failure reaches the limit, the second one disables the participant's token.
+        participant = self.default_participant
+        notifications = [self.notification(participant, "token1"),
+                         self.notification(participant, "token2")]
+        send_notifications.return_value = send_all_responses(Exception("a"), Exception("b"))
+
+        send_batch(notifications)
+        self.assertEqual(self.unreachable_count(participant), 0)
+        self.assertEqual(
+            list(PushNotificationDisabledEvent.objects.values_list("participant_id", "count")),
+            [(participant.pk, 1)],
+        )
+        self.assertIsNone(ParticipantFCMHistory.objects.get(token="token1").unregistered)
+        self.assertIsNotNone(ParticipantFCMHistory.objects.get(token="token2").unregistered)
+        self.assertEqual(self.archived_statuses(participant), ["a", "b"])
+
+    def test_batch_exception(self, send_notifications: MagicMock):
+        participant = self.default_participant
+        other = self.generate_participant(self.session_study)
+        notifications = [self.notification(participant, "token1"), self.notification(other, "token2")]
+        send_notifications.side_effect = Exception("batch failed")
+
+        send_batch(notifications)
+        for p in (participant, other):
+            self.assertEqual(self.archived_statuses(p), ["batch failed"])
+            self.assertEqual(self.unreachable_count(p), 1)
+        self.assertEqual(ScheduledEvent.objects.count(), 2)
+        self.assertFalse(ParticipantFCMHistory.objects.filter(unregistered__isnull=False).exists())
+
+
+@patch("services.push_notification_scheduler.check_firebase_instance", MagicMock(return_value=True))
+@patch("services.push_notification_scheduler.queue_push_notifications")
+class TestPushNotificationScheduler(CommonTestCase):
+    # the scheduler is driven with explicit times, the clock starts at self.now.
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        ParticipantFCMHistory.objects.create(participant=self.default_participant, token="token")
+
+    def event(self, scheduled_time) -> ScheduledEvent:
+        return ScheduledEvent.objects.create(
+            survey=self.default_survey, participant=self.default_participant,
+            absolute_schedule=self.generate_absolute_schedule(date.today()),
+            scheduled_time=scheduled_time,
+        )
+
+    def heap_pks(self, scheduler: PushNotificationScheduler):
+        return sorted(pk for _, pk in scheduler.heap)
+
+    def assert_queued(self, queue_push_notifications: MagicMock, event: ScheduledEvent):
+        queue_push_notifications.assert_called_once_with(
+            {"token": [self.default_survey.object_id]}, {"token": [event.pk]},
+            {"token": self.default_participant.patient_id},
+        )
+        queue_push_notifications.reset_mock()
+
+    def test_dispatches_due_events(self, queue_push_notifications: MagicMock):
+        soon = self.event(self.now + timedelta(seconds=30))
+        later = self.event(self.now + timedelta(hours=2))
+        beyond_horizon = self.event(self.now + HORIZON + timedelta(hours=1))
+        scheduler = PushNotificationScheduler()
+        scheduler.load(self.now)
+        self.assertEqual(self.heap_pks(scheduler), [soon.pk, later.pk])
+
+        scheduler.dispatch(self.now)
+        queue_push_notifications.assert_not_called()
+        scheduler.dispatch(self.now + timedelta(seconds=31))
+        self.assert_queued(queue_push_notifications, soon)
+        self.assertEqual(scheduler.delays, [1.0])
+
+        # the send failed (the event still exists), it is retried after RETRY_DELAY.
+        scheduler.dispatch(self.now + timedelta(seconds=31) + RETRY_DELAY - timedelta(seconds=1))
+        queue_push_notifications.assert_not_called()
+        scheduler.dispatch(self.now + timedelta(seconds=31) + RETRY_DELAY)
+        self.assert_queued(queue_push_notifications, soon)
+        self.assertEqual(scheduler.delays, [1.0])  # retries are not counted as delays
+
+        # the send succeeded, the event is forgotten.
+        soon_pk = soon.pk
+        soon.delete()
+        scheduler.dispatch(self.now + timedelta(seconds=31) + RETRY_DELAY * 2)
+        queue_push_notifications.assert_not_called()
+        self.assertNotIn(soon_pk, scheduler.queued_pks)
+
+        # an event is added when it enters the horizon.
+        scheduler.refresh(self.now + timedelta(hours=2))
+        self.assertEqual(self.heap_pks(scheduler), [later.pk, beyond_horizon.pk])
+
+    def test_deleted_event_is_dropped(self, queue_push_notifications: MagicMock):
+        event = self.event(self.now + timedelta(minutes=1))
+        scheduler = PushNotificationScheduler()
+        scheduler.load(self.now)
+        event.delete()
+        scheduler.refresh(self.now + timedelta(seconds=30))
+
+        scheduler.dispatch(self.now + timedelta(minutes=2))
+        queue_push_notifications.assert_not_called()
+        self.assertEqual(scheduler.heap, [])
+        self.assertEqual(scheduler.queued_pks, set())
+
+    def test_rescheduled_event_is_dropped(self, queue_push_notifications: MagicMock):
+        # rescheduling replaces an event (see update_scheduled_events), the refresh finds the new one.
+        event = self.event(self.now + timedelta(minutes=1))
+        scheduler = PushNotificationScheduler()
+        scheduler.load(self.now)
+        event_pk = event.pk
+        event.delete()
+        rescheduled = self.event(self.now + timedelta(minutes=10))
+        scheduler.refresh(self.now + timedelta(seconds=30))
+        self.assertEqual(self.heap_pks(scheduler), [event_pk, rescheduled.pk])
+
+        scheduler.dispatch(self.now + timedelta(minutes=2))
+        queue_push_notifications.assert_not_called()
+        self.assertEqual(self.heap_pks(scheduler), [rescheduled.pk])
+        scheduler.dispatch(self.now + timedelta(minutes=10))
+        self.assert_queued(queue_push_notifications, rescheduled)
+
+    def test_failed_enqueue_is_retried(self, queue_push_notifications: MagicMock):
+        event = self.event(self.now)
+        scheduler = PushNotificationScheduler()
+        scheduler.load(self.now)
+        queue_push_notifications.side_effect = Exception("broker unavailable")
+
+        with self.assertRaises(Exception):
+            scheduler.dispatch(self.now)
+        self.assertEqual(scheduler.heap, [(self.now + RETRY_DELAY, event.pk)])
+
+        queue_push_notifications.reset_mock(side_effect=True)
+        scheduler.dispatch(self.now + RETRY_DELAY - timedelta(seconds=1))
+        queue_push_notifications.assert_not_called()
+        scheduler.dispatch(self.now + RETRY_DELAY)
+        self.assert_queued(queue_push_notifications, event)
@@ -5,3 +5,8 @@ sys.stderr = sys.stdout
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.django_settings")
 application = get_wsgi_application()
+
+# start the upload spool's workers, they process the uploads spooled before a restart.
+from libs.upload_spool import UPLOAD_SPOOL
+if UPLOAD_SPOOL.enabled:
+    UPLOAD_SPOOL.start()